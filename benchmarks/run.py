@@ -0,0 +1,322 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import write_dataset
+from codeflowlm.trace import get_peak_rss_mb, reset_peak_rss
+
+#Benchmarks da camada de orquestração com streams sintéticos (ver
+#benchmarks/synthetic.py), offline e só com CPU.  Cada caso roda num processo
+#próprio, de forma que o pico de RSS medido é o do caso e não o dos anteriores.
+#
+#  python -m benchmarks.run                         # 10k, 100k e 1M commits
+#  python -m benchmarks.run --commits 10k --case add_first_fix_date
+#  python -m benchmarks.run --save-baseline         # grava benchmarks/baseline.json
+#
+#Os resultados são comparados com benchmarks/baseline.json; um caso mais lento
+#(ou com pico de RSS maior) que o baseline além da tolerância é marcado como
+#regressão e o processo termina com exit code 1.
+
+SIZES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+WINDOW_SIZE = 100
+
+CASES = {}
+
+
+def case(name):
+  def register(setup):
+    CASES[name] = setup
+    return setup
+
+  return register
+
+
+def load_features(files):
+  from codeflowlm.data import get_df_features_full
+  return get_df_features_full(*files['features'])
+
+
+def largest_project(df_features_full):
+  return df_features_full['project'].value_counts().index[0]
+
+
+def project_with_first_fix_date(files):
+  from codeflowlm.latency_verification import add_first_fix_date
+  df_features_full = load_features(files)
+  project = largest_project(df_features_full)
+  df_project = df_features_full[df_features_full['project'] == project]
+  return project, add_first_fix_date(files['commit_guru_path'], df_project, project)
+
+
+#Cada função de setup prepara as entradas fora da medição e devolve a função
+#medida.  O setup é refeito a cada repetição (caches frios, pools vazios).
+@case('add_first_fix_date')
+def setup_add_first_fix_date(files, work_dir):
+  from codeflowlm.latency_verification import _commit_guru_fixes, add_first_fix_date
+  df_features_full = load_features(files)
+  project = largest_project(df_features_full)
+  df_project = df_features_full[df_features_full['project'] == project]
+  _commit_guru_fixes.clear()
+
+  with contextlib.suppress(FileNotFoundError):
+    os.remove(files['commit_guru_path'] + project + '_fixes.pkl')
+
+  return lambda: add_first_fix_date(files['commit_guru_path'], df_project, project)
+
+
+def setup_prepare_train_data(files, do_real_lat_ver):
+  from codeflowlm.latency_verification import BuggyPool, CommitStore, TrainingPool, TrainingQueue
+  from codeflowlm.train import prepare_train_data
+  _, df_project = project_with_first_fix_date(files)
+
+  #Como no loop online: uma janela de WINDOW_SIZE commits por passo, sobre as
+  #mesmas estruturas
+  def run():
+    map_commit_to_row = CommitStore()
+    training_pool, training_queue, buggy_pool = TrainingPool(map_commit_to_row), TrainingQueue(), BuggyPool()
+
+    for start in range(0, df_project.shape[0], WINDOW_SIZE):
+      prepare_train_data(df_project[start:start + WINDOW_SIZE], training_pool, training_queue, map_commit_to_row,
+                         buggy_pool, do_real_lat_ver=do_real_lat_ver)
+
+    return training_pool
+
+  return run
+
+
+@case('prepare_train_data[lat_ver]')
+def setup_prepare_train_data_lat_ver(files, work_dir):
+  return setup_prepare_train_data(files, do_real_lat_ver=False)
+
+
+@case('prepare_train_data[real_lat_ver]')
+def setup_prepare_train_data_real_lat_ver(files, work_dir):
+  return setup_prepare_train_data(files, do_real_lat_ver=True)
+
+
+#Inclui a abertura do change store e a construção do índice (caches frios)
+@case('get_changes_from_features')
+def setup_get_changes_from_features(files, work_dir):
+  from codeflowlm.data import close_stores, get_change_index_file, get_changes_from_features
+  df_features = load_features(files).sample(frac=1.0, random_state=0)
+  close_stores()
+
+  with contextlib.suppress(FileNotFoundError):
+    os.remove(get_change_index_file(files['changes'][0]))
+
+  return lambda: get_changes_from_features(*files['changes'], df_features, do_test=True)
+
+
+#Um pool de treino do tamanho do maior projeto, com o change store já aberto
+@case('prepare_training_data')
+def setup_prepare_training_data(files, work_dir):
+  from codeflowlm.data import ChangeStore
+  from codeflowlm.train import prepare_training_data
+  project, df_project = project_with_first_fix_date(files)
+  ChangeStore.open(*files['changes']).index
+  return lambda: prepare_training_data(work_dir, *files['changes'], project, df_project)
+
+
+#Como no loop online com cross_project: o índice dos outros projetos é
+#construído uma vez e cada passo junta à janela de treino os commits dos outros
+#projetos desde o passo anterior.
+@case('merge_cross_project_data')
+def setup_merge_cross_project_data(files, work_dir):
+  from codeflowlm.train import CrossProjectIndex, merge_cross_project_data
+  df_features_full = load_features(files)
+  project = largest_project(df_features_full)
+  df_project = df_features_full[df_features_full['project'] == project]
+
+  def run():
+    cross_project_index = CrossProjectIndex(df_features_full, project)
+    max_timestamp_for_cp = 0
+    merged = 0
+
+    for start in range(0, df_project.shape[0], WINDOW_SIZE):
+      df_train = df_project[start:start + WINDOW_SIZE]
+      df_train, max_timestamp_for_cp = merge_cross_project_data(None, df_train, project, max_timestamp_for_cp,
+                                                                cross_project_index=cross_project_index)
+      merged += df_train.shape[0]
+
+    return merged
+
+  return run
+
+
+def synthetic_predictions(files):
+  df_features_full = load_features(files)
+  true_labels = df_features_full['is_buggy_commit'].to_numpy().astype(int)
+  rng = np.random.default_rng(0)
+  pred_probs = np.clip(0.35 * true_labels + 0.65 * rng.random(len(true_labels)), 0, 1).reshape(-1, 1)
+  return {'true_labels': true_labels, 'pred_labels': (pred_probs[:, 0] >= 0.5).astype(int), 'pred_probs': pred_probs}
+
+
+@case('prequential_metrics')
+def setup_prequential_metrics(files, work_dir):
+  from codeflowlm.prequential_metrics import prequential_metrics
+  predictions = synthetic_predictions(files)
+  return lambda: prequential_metrics(predictions, 0.99)
+
+
+@case('rolling_roc_auc_curve')
+def setup_rolling_roc_auc_curve(files, work_dir):
+  from codeflowlm.prequential_metrics import rolling_roc_auc_curve
+  predictions = synthetic_predictions(files)
+  return lambda: rolling_roc_auc_curve(predictions['true_labels'], predictions['pred_probs'])
+
+
+def run_case(name, files, repeat):
+  times = []
+  peaks = []
+
+  for _ in range(repeat):
+    work_dir = tempfile.mkdtemp(prefix="codeflowlm_bench_")
+
+    try:
+      with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        fn = CASES[name](files, work_dir)
+        #No Linux, o pico de RSS é zerado antes da medição e não inclui o setup
+        reset_peak_rss()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+        peaks.append(get_peak_rss_mb())
+    finally:
+      shutil.rmtree(work_dir, ignore_errors=True)
+
+  return {'seconds': min(times), 'peak_rss_mb': max(peaks), 'repeat': repeat}
+
+
+def run_case_in_subprocess(name, n_commits, data_dir, repeat):
+  root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+  env = dict(os.environ)
+  env['PYTHONPATH'] = os.pathsep.join([root] + [path for path in [env.get('PYTHONPATH')] if path])
+  command = [sys.executable, '-m', 'benchmarks.run', '--child', name, '--commits', str(n_commits),
+             '--data-dir', data_dir, '--repeat', str(repeat)]
+  process = subprocess.run(command, cwd=root, env=env, capture_output=True, text=True)
+
+  if process.returncode != 0:
+    print(process.stdout + process.stderr)
+    raise RuntimeError(f"Benchmark {name} with {n_commits} commits failed with exit code {process.returncode}.")
+
+  return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def get_case_key(name, n_commits):
+  return f"{name}@{n_commits}"
+
+
+def read_baseline(baseline_file):
+  if not os.path.exists(baseline_file):
+    return {}
+
+  with open(baseline_file, "r") as f:
+    return json.load(f)['results']
+
+
+def write_baseline(baseline_file, results):
+  baseline = {'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+              'machine': platform.machine(), 'cpus': os.cpu_count(), 'results': results}
+
+  with open(baseline_file, "w") as f:
+    json.dump(baseline, f, indent=2, sort_keys=True)
+    f.write("\n")
+
+
+#Regressão: tempo acima de (1 + time_tolerance) vezes o baseline, ignorando
+#diferenças abaixo de min_seconds (ruído), ou pico de RSS acima de
+#(1 + rss_tolerance) vezes o baseline.
+def compare(result, base, time_tolerance, rss_tolerance, min_seconds=0.05):
+  if base is None:
+    return 'new'
+
+  slower = result['seconds'] > base['seconds'] * (1 + time_tolerance) and result['seconds'] - base['seconds'] > min_seconds
+  larger = result['peak_rss_mb'] > base['peak_rss_mb'] * (1 + rss_tolerance)
+
+  if slower or larger:
+    return 'REGRESSION'
+
+  return 'ok'
+
+
+def print_table(rows):
+  header = ['case', 'commits', 'seconds', 'baseline', 'ratio', 'peak RSS MB', 'baseline MB', 'status']
+  lines = [header]
+
+  for key, result, base, status in rows:
+    name, n_commits = key.rsplit('@', 1)
+    lines.append([name, n_commits, f"{result['seconds']:.3f}", f"{base['seconds']:.3f}" if base else '-',
+                  f"{result['seconds'] / base['seconds']:.2f}" if base and base['seconds'] > 0 else '-',
+                  f"{result['peak_rss_mb']:.0f}", f"{base['peak_rss_mb']:.0f}" if base else '-', status])
+
+  widths = [max(len(line[i]) for line in lines) for i in range(len(header))]
+
+  for line in lines:
+    print('  '.join(value.ljust(width) for value, width in zip(line, widths)))
+
+
+def parse_size(size):
+  return SIZES[size.lower()] if size.lower() in SIZES else int(size)
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Scale benchmarks for codeflowlm with synthetic commit streams.")
+  parser.add_argument('--commits', nargs='+', default=list(SIZES), help="stream sizes (10k, 100k, 1m or a number)")
+  parser.add_argument('--case', nargs='+', default=list(CASES), choices=list(CASES), help="benchmarks to run")
+  parser.add_argument('--repeat', type=int, help="repetitions per case, the minimum time is reported "
+                                                 "(default: 3, or 1 from 1M commits)")
+  parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), "codeflowlm_benchmarks"),
+                      help="where the synthetic datasets are generated and reused")
+  parser.add_argument('--baseline', default=BASELINE_FILE)
+  parser.add_argument('--save-baseline', action='store_true', help="store the results as the new baseline")
+  parser.add_argument('--time-tolerance', type=float, default=0.25)
+  parser.add_argument('--rss-tolerance', type=float, default=0.25)
+  parser.add_argument('--child', help=argparse.SUPPRESS)
+  args = parser.parse_args(argv)
+
+  if args.child:
+    n_commits = parse_size(args.commits[0])
+    files = write_dataset(args.data_dir, n_commits)
+    print(json.dumps(run_case(args.child, files, args.repeat or 1)))
+    return 0
+
+  baseline = read_baseline(args.baseline)
+  results = {}
+  rows = []
+
+  for n_commits in [parse_size(size) for size in args.commits]:
+    print(f"Generating {n_commits} synthetic commits in {args.data_dir}...", flush=True)
+    write_dataset(args.data_dir, n_commits)
+
+    repeat = args.repeat or (1 if n_commits >= 1_000_000 else 3)
+
+    for name in args.case:
+      key = get_case_key(name, n_commits)
+      print(f"Running {key}...", flush=True)
+      results[key] = run_case_in_subprocess(name, n_commits, args.data_dir, repeat)
+      base = baseline.get(key)
+      rows.append((key, results[key], base, compare(results[key], base, args.time_tolerance, args.rss_tolerance)))
+
+  print()
+  print_table(rows)
+
+  if args.save_baseline:
+    write_baseline(args.baseline, dict(baseline, **results))
+    print(f"Baseline saved to {args.baseline}.")
+    return 0
+
+  return 1 if any(status == 'REGRESSION' for _, _, _, status in rows) else 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
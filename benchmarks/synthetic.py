@@ -0,0 +1,174 @@
+import json
+import os
+import pickle
+import numpy as np
+import pandas as pd
+
+#Gerador de dados sintéticos para os benchmarks, no formato dos dados reais:
+#
+#  - features_{train,valid,test}.pkl: DataFrames de features (métricas de Kamei),
+#    com commit_hash, project, author_date, author_date_unix_timestamp e
+#    is_buggy_commit;
+#  - changes_{train,valid,test}.pkl: tuplas (commits, labels, mensagens, códigos),
+#    com os commits embaralhados entre as três partes, como no corpus real;
+#  - commit_guru/<project>.csv: CSVs no formato do Commit Guru, em que a coluna
+#    fixes de cada commit defeituoso lista os commits que o corrigem.
+#
+#As taxas padrão seguem os datasets de JIT-SDP: ~25% de commits defeituosos,
+#~90% deles com link para pelo menos uma correção, em geral alguns meses
+#depois.  Tudo é determinístico dado (n_commits, seed).
+
+GENERATOR_VERSION = 1
+
+KAMEI_FEATURES = ['ns', 'nd', 'nf', 'entropy', 'la', 'ld', 'lt', 'fix', 'ndev', 'age', 'nuc', 'exp', 'rexp', 'sexp']
+
+WORDS = np.array(['fix', 'add', 'remove', 'update', 'refactor', 'test', 'null', 'check', 'config', 'parser',
+                  'cache', 'index', 'thread', 'lock', 'stream', 'buffer', 'error', 'handler', 'client', 'server'])
+
+TOKENS = np.array(['if', '(', ')', '{', '}', 'return', 'null', ';', '=', '==', 'new', 'int', 'String', 'this',
+                   'final', 'for', 'i', '+', '-', 'get', 'set', 'list', 'map', 'size', 'value', 'key'])
+
+
+def project_names(n_projects):
+  return [f'project-{i}' for i in range(n_projects)]
+
+
+def commit_hashes(rng, n_commits):
+  return [bytes(row).hex() for row in rng.integers(0, 256, size=(n_commits, 20), dtype=np.uint8)]
+
+
+def generate_features(n_commits, n_projects=4, seed=0, bug_rate=0.25):
+  rng = np.random.default_rng(seed)
+  #Commits de todos os projetos intercalados no tempo, um a cada ~30 minutos
+  timestamps = 1_200_000_000 + np.cumsum(rng.integers(0, 3600, n_commits))
+  weights = np.arange(n_projects, 0, -1) / np.arange(n_projects, 0, -1).sum()
+  projects = np.array(project_names(n_projects))[rng.choice(n_projects, size=n_commits, p=weights)]
+
+  df = pd.DataFrame({
+    'commit_hash': commit_hashes(rng, n_commits),
+    'project': projects,
+    'author_date': pd.to_datetime(timestamps, unit='s').strftime('%Y-%m-%d %H:%M:%S'),
+    'author_date_unix_timestamp': timestamps,
+    'is_buggy_commit': (rng.random(n_commits) < bug_rate).astype(float),
+  })
+
+  df['ns'] = rng.integers(1, 4, n_commits)
+  df['nd'] = rng.integers(1, 8, n_commits)
+  df['nf'] = rng.geometric(0.3, n_commits)
+  df['entropy'] = rng.random(n_commits) * np.log2(df['nf'] + 1)
+  df['la'] = rng.geometric(0.02, n_commits)
+  df['ld'] = rng.geometric(0.05, n_commits)
+  df['lt'] = rng.geometric(0.002, n_commits)
+  df['fix'] = (rng.random(n_commits) < 0.3).astype(float)
+  df['ndev'] = rng.geometric(0.1, n_commits)
+  df['age'] = rng.exponential(30.0, n_commits)
+  df['nuc'] = rng.geometric(0.4, n_commits)
+  df['exp'] = rng.geometric(0.005, n_commits)
+  df['rexp'] = rng.exponential(5.0, n_commits)
+  df['sexp'] = rng.geometric(0.01, n_commits)
+  return df
+
+
+def random_texts(rng, vocabulary, n_texts, mean_tokens):
+  lengths = rng.poisson(mean_tokens, n_texts) + 1
+  tokens = vocabulary[rng.integers(0, len(vocabulary), lengths.sum())]
+  ends = np.cumsum(lengths)
+  return [' '.join(tokens[end - length:end]) for end, length in zip(ends.tolist(), lengths.tolist())]
+
+
+def generate_changes(df_features, seed=0, message_tokens=8, code_tokens=40):
+  rng = np.random.default_rng(seed + 1)
+  n_commits = df_features.shape[0]
+  order = rng.permutation(n_commits)
+  commits = df_features['commit_hash'].to_numpy()[order].tolist()
+  labels = df_features['is_buggy_commit'].to_numpy()[order].astype(int).tolist()
+  messages = random_texts(rng, WORDS, n_commits, message_tokens)
+  codes = random_texts(rng, TOKENS, n_commits, code_tokens)
+  return commits, labels, messages, codes
+
+
+def split_changes(changes, fractions=(0.8, 0.1)):
+  n_commits = len(changes[0])
+  bounds = [0, int(fractions[0] * n_commits), int((fractions[0] + fractions[1]) * n_commits), n_commits]
+  return [tuple(field[start:end] for field in changes) for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+#CSV do Commit Guru de um projeto: cada commit defeituoso com link recebe de 1 a
+#3 correções entre os commits seguintes do mesmo projeto.
+def generate_commit_guru(df_project, seed=0, fix_link_rate=0.9, mean_fix_distance=2000):
+  rng = np.random.default_rng(seed)
+  n_commits = df_project.shape[0]
+  hashes = df_project['commit_hash'].to_numpy()
+  buggy = np.flatnonzero((df_project['is_buggy_commit'].to_numpy() == 1) & (rng.random(n_commits) < fix_link_rate))
+  fixes = np.full(n_commits, '[]', dtype=object)
+  is_fix = np.zeros(n_commits, dtype=bool)
+
+  for position, n_fixes in zip(buggy.tolist(), rng.integers(1, 4, len(buggy)).tolist()):
+    fix_positions = np.unique(np.minimum(position + rng.geometric(1 / mean_fix_distance, n_fixes), n_commits - 1))
+    fix_positions = fix_positions[fix_positions > position]
+
+    if len(fix_positions) > 0:
+      fixes[position] = json.dumps(hashes[fix_positions].tolist())
+      is_fix[fix_positions] = True
+
+  return pd.DataFrame({
+    'commit_hash': hashes,
+    'author_date_unix_timestamp': df_project['author_date_unix_timestamp'].to_numpy(),
+    'fix': is_fix,
+    'contains_bug': df_project['is_buggy_commit'].to_numpy() == 1,
+    'fixes': fixes,
+    'la': df_project['la'].to_numpy(),
+    'ld': df_project['ld'].to_numpy(),
+    'nf': df_project['nf'].to_numpy(),
+  })
+
+
+def get_dataset_dir(data_dir, n_commits, seed=0):
+  return os.path.join(data_dir, f"commits_{n_commits}_seed_{seed}")
+
+
+def get_dataset_files(dataset_dir):
+  return {
+    'features': [os.path.join(dataset_dir, f"features_{part}.pkl") for part in ('train', 'valid', 'test')],
+    'changes': [os.path.join(dataset_dir, f"changes_{part}.pkl") for part in ('train', 'valid', 'test')],
+    'commit_guru_path': os.path.join(dataset_dir, "commit_guru") + os.sep,
+  }
+
+
+#Gera (ou reaproveita, se já gerado com a mesma versão) o dataset de n_commits
+#em data_dir e devolve os caminhos dos arquivos.
+def write_dataset(data_dir, n_commits, seed=0, n_projects=4):
+  dataset_dir = get_dataset_dir(data_dir, n_commits, seed)
+  files = get_dataset_files(dataset_dir)
+  marker = os.path.join(dataset_dir, "dataset.json")
+  description = {'version': GENERATOR_VERSION, 'n_commits': n_commits, 'seed': seed, 'n_projects': n_projects}
+
+  if os.path.exists(marker):
+    with open(marker, "r") as f:
+      if json.load(f) == description:
+        return files
+
+  os.makedirs(files['commit_guru_path'], exist_ok=True)
+  df_features = generate_features(n_commits, n_projects=n_projects, seed=seed)
+  changes = generate_changes(df_features, seed=seed)
+
+  for file, part in zip(files['changes'], split_changes(changes)):
+    with open(file, "wb") as f:
+      pickle.dump(part, f)
+
+  del changes
+  bounds = [0, int(0.8 * n_commits), int(0.9 * n_commits), n_commits]
+
+  for file, start, end in zip(files['features'], bounds[:-1], bounds[1:]):
+    with open(file, "wb") as f:
+      pickle.dump(df_features.iloc[start:end].reset_index(drop=True), f)
+
+  for i, (project, df_project) in enumerate(df_features.groupby('project', sort=True)):
+    df_csv = generate_commit_guru(df_project, seed=seed + i)
+    df_csv.to_csv(os.path.join(files['commit_guru_path'], f"{project}.csv"), index=False)
+
+  #O marcador é gravado por último: um dataset incompleto é gerado de novo
+  with open(marker, "w") as f:
+    json.dump(description, f)
+
+  return files
@@ -0,0 +1,176 @@
+import abc
+import os
+import pickle
+import numpy as np
+
+#Backends de classificação para o loop online.  Por padrão, train() e test()
+#executam os scripts de PLM (run_lora.py/run_peft.py) em subprocessos; com
+#classifier=<Classifier>, o treino e o teste são feitos pelo backend, no próprio
+#processo, a partir das colunas de features do DataFrame.  Útil para experimentos
+#com latency verification, janelas ou cross-project, em que só a orquestração
+#está sendo avaliada.
+#
+#Como os scripts, o backend grava o modelo em
+#<model_path>/checkpoint-best-<eval_metric>/model.bin, que é o que o loop
+#verifica para decidir se já há um modelo treinado (e o que permite retomar uma
+#execução).
+
+#Colunas que não são features: identificação, datas e rótulos
+NON_FEATURE_COLUMNS = {'index', 'commit_hash', 'project', 'author_date', 'author_date_unix_timestamp',
+                       'is_buggy_commit', 'first_fix_date', 'fixes', 'contains_bug'}
+
+
+def get_model_file(model_path, eval_metric):
+  return os.path.join(model_path, f"checkpoint-best-{eval_metric}", "model.bin")
+
+
+class Classifier(abc.ABC):
+  #Treina com as linhas de df_train (rótulo em is_buggy_commit) e devolve o status
+  #no formato de read_training_status()
+  @abc.abstractmethod
+  def train(self, df_train, model_path, th=0.5, eval_metric='f1'):
+    pass
+
+  #Devolve (results, predictions), como test(): predictions com pred_label,
+  #true_label e pred_prob para cada linha de features_test
+  @abc.abstractmethod
+  def test(self, features_test, model_path, th=0.5, eval_metric='f1', calculate_metrics=True):
+    pass
+
+
+def get_feature_columns(df):
+  return [column for column in df.columns
+          if column not in NON_FEATURE_COLUMNS and np.issubdtype(df[column].dtype, np.number)]
+
+
+#Métricas da janela com o threshold usado (como o --calculate_metrics dos scripts)
+def window_metrics(true_labels, pred_labels, th):
+  true_labels = np.asarray(true_labels).astype(int)
+  pred_labels = np.asarray(pred_labels).astype(int)
+  tp = int(((pred_labels == 1) & (true_labels == 1)).sum())
+  positives = int((true_labels == 1).sum())
+  negatives = int((true_labels == 0).sum())
+  predicted = int((pred_labels == 1).sum())
+  recall = tp / positives if positives > 0 else 0.0
+  precision = tp / predicted if predicted > 0 else 0.0
+  r0 = int(((pred_labels == 0) & (true_labels == 0)).sum()) / negatives if negatives > 0 else 0.0
+  f1 = 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.0
+  return {'f1': f1, 'precision': precision, 'recall': recall, 'r0': r0, 'r1': recall,
+          'gmean': np.sqrt(r0 * recall), 'threshold': th}
+
+
+#Regressão logística incremental (SGD) sobre as features.  As features passam por
+#sign(x) * log1p(|x|) e são padronizadas com média/variância acumuladas; as
+#classes são balanceadas pelas contagens acumuladas, já que os defeitos são a
+#minoria.  Cada chamada de train() continua do modelo gravado, com epochs passadas
+#sobre as linhas recebidas.
+class OnlineLogisticRegression(Classifier):
+  def __init__(self, feature_columns=None, learning_rate=0.1, l2=1e-4, epochs=5, batch_size=32, seed=33):
+    self.feature_columns = feature_columns
+    self.learning_rate = learning_rate
+    self.l2 = l2
+    self.epochs = epochs
+    self.batch_size = batch_size
+    self.rng = np.random.default_rng(seed)
+
+  def new_state(self, feature_columns):
+    n_features = len(feature_columns)
+    return {'feature_columns': feature_columns, 'coef': np.zeros(n_features), 'intercept': 0.0,
+            'mean': np.zeros(n_features), 'm2': np.zeros(n_features), 'n_seen': 0, 'counts': np.zeros(2),
+            'updates': 0}
+
+  def read_state(self, model_path, eval_metric):
+    model_file = get_model_file(model_path, eval_metric)
+
+    if not os.path.exists(model_file):
+      return None
+
+    with open(model_file, "rb") as f:
+      return pickle.load(f)
+
+  def write_state(self, state, model_path, eval_metric):
+    model_file = get_model_file(model_path, eval_metric)
+    os.makedirs(os.path.dirname(model_file), exist_ok=True)
+    tmp_file = model_file + ".tmp"
+
+    with open(tmp_file, "wb") as f:
+      pickle.dump(state, f)
+
+    os.replace(tmp_file, model_file)
+
+  @staticmethod
+  def transform(df, feature_columns):
+    values = df.reindex(columns=feature_columns).to_numpy(dtype=float)
+    values = np.nan_to_num(values, nan=0.0, posinf=0.0, neginf=0.0)
+    return np.sign(values) * np.log1p(np.abs(values))
+
+  @staticmethod
+  def standardize(state, x):
+    n_seen = max(state['n_seen'], 1)
+    std = np.sqrt(state['m2'] / n_seen)
+    return (x - state['mean']) / np.where(std > 0, std, 1.0)
+
+  @staticmethod
+  def predict_proba(state, x):
+    z = OnlineLogisticRegression.standardize(state, x) @ state['coef'] + state['intercept']
+    return 1.0 / (1.0 + np.exp(-np.clip(z, -35, 35)))
+
+  #Média/variância acumuladas (Welford, combinando o lote inteiro)
+  @staticmethod
+  def update_moments(state, x):
+    n_batch = x.shape[0]
+    batch_mean = x.mean(axis=0)
+    batch_m2 = ((x - batch_mean) ** 2).sum(axis=0)
+    n_total = state['n_seen'] + n_batch
+    delta = batch_mean - state['mean']
+    state['mean'] = state['mean'] + delta * n_batch / n_total
+    state['m2'] = state['m2'] + batch_m2 + delta ** 2 * state['n_seen'] * n_batch / n_total
+    state['n_seen'] = n_total
+
+  def train(self, df_train, model_path, th=0.5, eval_metric='f1'):
+    state = self.read_state(model_path, eval_metric)
+
+    if state is None:
+      state = self.new_state(self.feature_columns or get_feature_columns(df_train))
+
+    x = self.transform(df_train, state['feature_columns'])
+    y = df_train['is_buggy_commit'].to_numpy().astype(int)
+
+    if x.shape[0] == 0:
+      return {'returncode': 0, 'status': 'unchanged', 'changed': False}
+
+    self.update_moments(state, x)
+    state['counts'] += np.bincount(y, minlength=2)
+    class_weights = state['counts'].sum() / (2 * np.maximum(state['counts'], 1))
+    weights = class_weights[y]
+    x = self.standardize(state, x)
+
+    for _ in range(self.epochs):
+      order = self.rng.permutation(x.shape[0])
+
+      for start in range(0, len(order), self.batch_size):
+        batch = order[start:start + self.batch_size]
+        z = x[batch] @ state['coef'] + state['intercept']
+        error = (1.0 / (1.0 + np.exp(-np.clip(z, -35, 35))) - y[batch]) * weights[batch]
+        learning_rate = self.learning_rate / np.sqrt(1 + state['updates'] / 100)
+        state['coef'] -= learning_rate * (x[batch].T @ error / len(batch) + self.l2 * state['coef'])
+        state['intercept'] -= learning_rate * error.mean()
+        state['updates'] += 1
+
+    self.write_state(state, model_path, eval_metric)
+    print(f"Trained {type(self).__name__} with {x.shape[0]} samples ({int(y.sum())} positives).")
+    return {'returncode': 0, 'status': 'changed', 'changed': True}
+
+  def test(self, features_test, model_path, th=0.5, eval_metric='f1', calculate_metrics=True):
+    state = self.read_state(model_path, eval_metric)
+    true_labels = features_test['is_buggy_commit'].to_numpy().astype(int)
+
+    if state is None:
+      pred_probs = np.zeros(features_test.shape[0])
+    else:
+      pred_probs = self.predict_proba(state, self.transform(features_test, state['feature_columns']))
+
+    pred_labels = (pred_probs >= th).astype(int)
+    predictions = {'pred_label': pred_labels, 'true_label': true_labels, 'pred_prob': pred_probs.reshape(-1, 1)}
+    results = window_metrics(true_labels, pred_labels, th) if calculate_metrics else None
+    return results, predictions
@@ -0,0 +1,147 @@
+import os
+import pickle
+import numpy as np
+
+#Formato colunar para os corpora de mudanças (commits, labels, mensagens, códigos).
+#Cada coluna de texto é um blob UTF-8 com um vetor de offsets (n + 1) ao lado; os
+#labels ficam em um .npy.  A leitura usa mmap, então abrir um corpus não
+#desserializa nada: só os textos acessados são decodificados.
+#
+#  <dir>/labels.npy
+#  <dir>/{commits,messages,codes}.offsets.npy
+#  <dir>/{commits,messages,codes}.bin
+
+TEXT_FIELDS = {0: 'commits', 2: 'messages', 3: 'codes'}
+
+
+def is_columnar_changes(path):
+  return os.path.isdir(path) and os.path.exists(os.path.join(path, 'labels.npy'))
+
+
+def write_text_column(values, offsets_file, blob_file):
+  offsets = np.zeros(len(values) + 1, dtype=np.int64)
+
+  with open(blob_file, "wb") as f:
+    for i, value in enumerate(values):
+      data = value.encode('utf-8')
+      f.write(data)
+      offsets[i + 1] = offsets[i] + len(data)
+
+  np.save(offsets_file, offsets)
+
+
+def write_columnar_changes(changes, columnar_dir):
+  os.makedirs(columnar_dir, exist_ok=True)
+  assert len(changes[0]) == len(changes[1]) == len(changes[2]) == len(changes[3])
+
+  for field, name in TEXT_FIELDS.items():
+    write_text_column(changes[field], os.path.join(columnar_dir, f"{name}.offsets.npy"),
+                      os.path.join(columnar_dir, f"{name}.bin"))
+
+  #labels.npy é escrito por último: é ele que marca o diretório como completo
+  np.save(os.path.join(columnar_dir, "labels.npy"), np.asarray(changes[1]))
+  return columnar_dir
+
+
+def convert_changes_to_columnar(changes_file, columnar_dir=None):
+  if columnar_dir is None:
+    columnar_dir = os.path.splitext(changes_file)[0] + ".cols"
+
+  with open(changes_file, "rb") as f:
+    changes = pickle.load(f)
+
+  return write_columnar_changes(changes, columnar_dir)
+
+
+#Coluna de texto sobre um blob mapeado em memória.  Fatias (slice ou lista de
+#índices) devolvem outra coluna sobre o mesmo blob, sem cópia.
+class TextColumn:
+  def __init__(self, offsets, blob, positions=None):
+    self.offsets = offsets
+    self.blob = blob
+    self.positions = positions
+
+  def __len__(self):
+    if self.positions is None:
+      return len(self.offsets) - 1
+
+    return len(self.positions)
+
+  def _position(self, i):
+    if self.positions is None:
+      return i
+
+    return int(self.positions[i])
+
+  def __getitem__(self, i):
+    if isinstance(i, slice):
+      return self.take(np.arange(len(self))[i])
+
+    if i < 0:
+      i += len(self)
+
+    if i < 0 or i >= len(self):
+      raise IndexError(i)
+
+    i = self._position(i)
+    return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]]).decode('utf-8')
+
+  def __iter__(self):
+    for i in range(len(self)):
+      yield self[i]
+
+  def take(self, positions):
+    positions = np.asarray(positions, dtype=np.int64)
+
+    if self.positions is not None:
+      positions = self.positions[positions]
+
+    return TextColumn(self.offsets, self.blob, positions)
+
+  def tolist(self):
+    return list(self)
+
+
+class ColumnarChanges:
+  def __init__(self, columnar_dir, columns=None, labels=None):
+    self.columnar_dir = columnar_dir
+
+    if columns is None:
+      columns = {}
+
+      for field, name in TEXT_FIELDS.items():
+        offsets = np.load(os.path.join(columnar_dir, f"{name}.offsets.npy"), mmap_mode='r')
+        blob_file = os.path.join(columnar_dir, f"{name}.bin")
+
+        #np.memmap não aceita arquivos vazios
+        if os.path.getsize(blob_file) > 0:
+          blob = np.memmap(blob_file, dtype=np.uint8, mode='r')
+        else:
+          blob = np.zeros(0, dtype=np.uint8)
+
+        columns[field] = TextColumn(offsets, blob)
+
+      labels = np.load(os.path.join(columnar_dir, "labels.npy"), mmap_mode='r')
+
+    self.columns = columns
+    self.labels = labels
+
+  def __len__(self):
+    return len(self.labels)
+
+  def __getitem__(self, field):
+    if field == 1:
+      return self.labels
+
+    return self.columns[field]
+
+  def take(self, positions):
+    positions = np.asarray(positions, dtype=np.int64)
+    columns = {field: column.take(positions) for field, column in self.columns.items()}
+    return ColumnarChanges(self.columnar_dir, columns, self.labels[positions])
+
+  def slice(self, start, stop):
+    return self.take(np.arange(start, min(stop, len(self))))
+
+  def to_changes(self):
+    return (self[0].tolist(), self.labels.tolist(), self[2].tolist(), self[3].tolist())
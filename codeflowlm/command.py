@@ -1,11 +1,55 @@
+import os
 import subprocess
+import threading
 
-def execute_command(command):
+class CommandError(Exception):
+    def __init__(self, command, returncode, message=None):
+        self.command = command
+        self.returncode = returncode
+        super().__init__(message or f"Command exited with code {returncode}: {command}")
+
+class CommandTimeout(CommandError):
+    def __init__(self, command, timeout):
+        self.timeout = timeout
+        super().__init__(command, None, f"Command timed out after {timeout} s: {command}")
+
+#Ambiente dos comandos de treino/teste: o pacote codeflowlm fica no PYTHONPATH,
+#para que os scripts consigam carregar manifestos (ver codeflowlm.manifest).
+def get_command_env():
+    env = dict(os.environ)
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join([package_root] + ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+    return env
+
+def execute_command(command, worker=None, timeout=None, cwd=None):
     print(command)
-    process = subprocess.Popen(command.strip(), shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, encoding='utf-8')
+
+    if worker is not None:
+        return worker.run(command, timeout=timeout, cwd=cwd)
+
+    process = subprocess.Popen(command.strip(), shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, encoding='utf-8', cwd=cwd,
+                               env=get_command_env())
+    timed_out = threading.Event()
+    timer = None
+
+    if timeout is not None:
+        def kill():
+            timed_out.set()
+            process.kill()
+
+        timer = threading.Timer(timeout, kill)
+        timer.start()
 
     for line in iter(process.stdout.readline, ''):
         print(line, end='', flush=True)
 
     process.stdout.close()
-    process.wait()
\ No newline at end of file
+    process.wait()
+
+    if timer is not None:
+        timer.cancel()
+
+    if timed_out.is_set():
+        raise CommandTimeout(command, timeout)
+
+    return process.returncode
\ No newline at end of file
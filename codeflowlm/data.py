@@ -1,58 +1,240 @@
+import abc
+import itertools
+import os
 import pickle
+from collections import OrderedDict
+import numpy as np
 import pandas as pd
+from codeflowlm.columnar import ColumnarChanges, is_columnar_changes
+
+def get_files_key(*files):
+  key = []
+
+  for file in files:
+    #Para corpora colunares, labels.npy é o último arquivo escrito pelo conversor
+    stat = os.stat(os.path.join(file, "labels.npy") if is_columnar_changes(file) else file)
+    key.append((os.path.abspath(file), stat.st_mtime_ns, stat.st_size))
+
+  return tuple(key)
+
+#Cache de arquivos carregados uma única vez por processo, memoizado por caminho,
+#mtime e tamanho.  Se um dos arquivos mudar, a versão antiga é descartada na
+#próxima abertura.  Ficam abertos no máximo max_open conjuntos de arquivos por
+#tipo de store; close() libera a memória explicitamente.
+class FileStore(abc.ABC):
+  max_open = 2
+  _open = None
+
+  def __init_subclass__(cls, **kwargs):
+    super().__init_subclass__(**kwargs)
+    cls._open = OrderedDict()
+
+  @classmethod
+  def open(cls, *files):
+    key = get_files_key(*files)
+    store = cls._open.get(key)
+
+    if store is not None:
+      cls._open.move_to_end(key)
+      return store
+
+    paths = [file_key[0] for file_key in key]
+
+    for stale in [store for store in cls._open.values() if [file_key[0] for file_key in store.key] == paths]:
+      stale.close()
+
+    store = cls(files, key)
+    cls._open[key] = store
+
+    while len(cls._open) > cls.max_open:
+      next(iter(cls._open.values())).close()
+
+    return store
+
+  @classmethod
+  def close_all(cls):
+    for store in list(cls._open.values()):
+      store.close()
+
+  def __init__(self, files, key):
+    self.files = files
+    self.key = key
+    self.load()
+
+  @abc.abstractmethod
+  def load(self):
+    pass
+
+  @abc.abstractmethod
+  def release(self):
+    pass
+
+  def close(self):
+    if type(self)._open.get(self.key) is self:
+      del type(self)._open[self.key]
+
+    self.release()
+
+def load_pickle(file):
+  with open(file, "rb") as f:
+    return pickle.load(f)
+
+#Caches em pickle gravados ao lado dos dados.  Um arquivo ausente, truncado ou
+#corrompido (por exemplo, por uma execução interrompida) conta como cache
+#ausente; a gravação vai para um arquivo temporário renomeado no fim, então um
+#leitor concorrente nunca vê um cache pela metade.
+def read_pickle_cache(file):
+  try:
+    return load_pickle(file)
+  except FileNotFoundError:
+    return None
+  except (EOFError, pickle.UnpicklingError, OSError) as e:
+    print(f"Ignoring unreadable cache {file}: {e}")
+    return None
+
+def write_pickle_cache(obj, file):
+  tmp_file = f"{file}.{os.getpid()}.tmp"
+
+  try:
+    with open(tmp_file, "wb") as f:
+      pickle.dump(obj, f)
+
+    os.replace(tmp_file, file)
+  except OSError as e:
+    print(f"Could not write cache {file}: {e}")
+
+    if os.path.exists(tmp_file):
+      os.remove(tmp_file)
+
+#Features de train/valid/test concatenadas uma única vez.  O DataFrame é
+#compartilhado: quem o usa não deve alterá-lo in place.
+class FeatureStore(FileStore):
+  def load(self):
+    self.df_features_full = pd.concat([load_pickle(file) for file in self.files], ignore_index=True)
+
+  def release(self):
+    self.df_features_full = None
+
+def load_changes(file):
+  if is_columnar_changes(file):
+    return ColumnarChanges(file)
+
+  return load_pickle(file)
+
+#Mudanças de train/valid/test, em pickle ou no formato colunar (ver
+#codeflowlm.columnar).  As três partes ficam como foram carregadas, sem
+#concatenar as listas: take() busca os valores pela posição no corpus
+#concatenado.
+class ChangeStore(FileStore):
+  def load(self):
+    self.parts = [load_changes(file) for file in self.files]
+    self.starts = np.cumsum([0] + [len(part[0]) for part in self.parts])
+    self._index = None
+
+  def release(self):
+    self.parts = None
+    self._index = None
+
+  def __len__(self):
+    return int(self.starts[-1])
+
+  def column(self, field):
+    return itertools.chain.from_iterable(part[field] for part in self.parts)
+
+  def take(self, field, positions):
+    positions = np.asarray(positions, dtype=np.int64)
+    part_ids = np.searchsorted(self.starts, positions, side='right') - 1
+    offsets = positions - self.starts[part_ids]
+    parts = self.parts
+    return [parts[part_id][field][offset] for part_id, offset in zip(part_ids.tolist(), offsets.tolist())]
+
+  @property
+  def index(self):
+    if self._index is None:
+      self._index = get_change_index(*self.files, change_store=self)
+
+    return self._index
+
+def close_stores():
+  FeatureStore.close_all()
+  ChangeStore.close_all()
 
 def get_df_features_full(full_features_train_file, full_features_valid_file, full_features_test_file):
-    with open(full_features_train_file, "rb") as f:
-        ord_cross_features_train = pickle.load(f)
-
-    with open(full_features_valid_file, "rb") as f:
-        ord_cross_features_valid = pickle.load(f)
-    
-    with open(full_features_test_file, "rb") as f:
-        ord_cross_features_test = pickle.load(f)
-    
-    df_features_full = pd.concat([ord_cross_features_train, ord_cross_features_valid, ord_cross_features_test], ignore_index=True)
-    return df_features_full
+  return FeatureStore.open(full_features_train_file, full_features_valid_file, full_features_test_file).df_features_full
 
 def get_ord_cross_changes_full(full_changes_train_file, full_changed_valid_file, full_changes_test_file):
-    with open(full_changes_train_file, "rb") as f:
-        ord_cross_changes_train = pickle.load(f)
-    
-    with open(full_changed_valid_file, "rb") as f:
-        ord_cross_changes_valid = pickle.load(f)
-    
-    with open(full_changes_test_file, "rb") as f:
-        ord_cross_changes_test = pickle.load(f)
-    
-    ord_cross_changes_full = [ord_cross_changes_train[0] + ord_cross_changes_valid[0] + ord_cross_changes_test[0], ord_cross_changes_train[1] + ord_cross_changes_valid[1] + ord_cross_changes_test[1],
-                          ord_cross_changes_train[2] + ord_cross_changes_valid[2] + ord_cross_changes_test[2], ord_cross_changes_train[3] + ord_cross_changes_valid[3] + ord_cross_changes_test[3]]
-    return ord_cross_changes_full
+  change_store = ChangeStore.open(full_changes_train_file, full_changed_valid_file, full_changes_test_file)
+  ord_cross_changes_full = [list(change_store.column(field)) for field in range(4)]
+  return ord_cross_changes_full
 
-def get_changes_from_features(full_changes_train_file, full_changed_valid_file, full_changes_test_file, df_features, do_test=True):
-  commits = []
-  labels = []
-  commit_messages = []
-  codes = []
-  ord_cross_changes_full = get_ord_cross_changes_full(full_changes_train_file, full_changed_valid_file, full_changes_test_file)
-
-  for _, row in df_features.iterrows():
-      commit_id = row['commit_hash']
-      idx = ord_cross_changes_full[0].index(commit_id)
-      label = row['is_buggy_commit']
-      commit_message = ord_cross_changes_full[2][idx]
-      code = ord_cross_changes_full[3][idx]
-      commits.append(commit_id)
-      labels.append(label)
-      commit_messages.append(commit_message)
-      codes.append(code)
-      if do_test:
-        if row['is_buggy_commit'] != ord_cross_changes_full[1][idx]:
-          print("row['is_buggy_commit'] = ", row['is_buggy_commit'])
-          print("ord_cross_changes_full[1][idx] = ", ord_cross_changes_full[1][idx])
-        assert row['is_buggy_commit'] == ord_cross_changes_full[1][idx]
-
-  assert len(commits) == len(labels) == len(commit_messages) == len(codes) == df_features.shape[0]
-  changes = (commits, labels, commit_messages, codes)
-  return changes
+#Índice hash -> posição (e hash -> label) do corpus de mudanças concatenado
+#(train + valid + test).  Em caso de hashes repetidos vale a primeira posição,
+#como em list.index().
+class ChangeIndex:
+  def __init__(self, commits, labels, key=None):
+    commits = pd.Index(list(commits))
+    positions = pd.Series(np.arange(len(commits)), index=commits)
+    self.positions = positions[~positions.index.duplicated(keep='first')]
+    self.labels = np.asarray(list(labels))
+    self.key = key
+
+  def __len__(self):
+    return len(self.labels)
+
+  def lookup(self, commit_hashes):
+    commit_hashes = list(commit_hashes)
+    idx = self.positions.index.get_indexer(commit_hashes)
+
+    if (idx < 0).any():
+      missing = commit_hashes[int(np.argmax(idx < 0))]
+      raise ValueError(f"{missing!r} is not in the change corpus")
 
+    return self.positions.to_numpy()[idx]
 
+def get_change_index_file(full_changes_train_file):
+  return os.path.splitext(full_changes_train_file)[0] + "_index.pkl"
+
+#O índice é construído uma vez e salvo ao lado dos pickles de mudanças; é
+#reconstruído se algum dos três arquivos mudar (mtime/tamanho).
+def get_change_index(full_changes_train_file, full_changed_valid_file, full_changes_test_file, change_store=None):
+  key = get_files_key(full_changes_train_file, full_changed_valid_file, full_changes_test_file)
+  index_file = get_change_index_file(full_changes_train_file)
+
+  index = read_pickle_cache(index_file)
+
+  if isinstance(index, ChangeIndex) and index.key == key:
+    return index
+
+  if change_store is None:
+    change_store = ChangeStore.open(full_changes_train_file, full_changed_valid_file, full_changes_test_file)
+
+  index = ChangeIndex(change_store.column(0), change_store.column(1), key=key)
+
+  write_pickle_cache(index, index_file)
+  return index
+
+#Monta a tupla (commits, labels, mensagens, códigos) para as linhas de df,
+#buscando as mudanças no change store pela posição de cada commit.
+def gather_changes(change_store, df, do_test=False):
+  change_index = change_store.index
+  commits = df['commit_hash'].tolist()
+  labels = df['is_buggy_commit'].tolist()
+  positions = change_index.lookup(commits)
+  commit_messages = change_store.take(2, positions)
+  codes = change_store.take(3, positions)
+
+  if do_test and len(labels) > 0:
+    mismatches = np.flatnonzero(np.asarray(labels) != change_index.labels[positions])
+
+    if len(mismatches) > 0:
+      print("row['is_buggy_commit'] = ", labels[mismatches[0]])
+      print("ord_cross_changes_full[1][idx] = ", change_index.labels[positions[mismatches[0]]])
+    assert len(mismatches) == 0
+
+  assert len(commits) == len(labels) == len(commit_messages) == len(codes) == df.shape[0]
+  return commits, labels, commit_messages, codes
+
+def get_changes_from_features(full_changes_train_file, full_changed_valid_file, full_changes_test_file, df_features, do_test=True):
+  change_store = ChangeStore.open(full_changes_train_file, full_changed_valid_file, full_changes_test_file)
+  changes = gather_changes(change_store, df_features, do_test=do_test)
+  return changes
@@ -0,0 +1,311 @@
+import os
+import pickle
+import numpy as np
+
+#Journal append-only do loop online, usado para retomar uma execução.  Cada passo
+#concluído grava um registro pequeno em <model_path>/journal.pkl (pickles
+#concatenados): as predições da janela como arrays, o delta do training pool,
+#training queue, buggy pool e map_commit_to_row, e os escalares do loop (th,
+#trained, max_timestamp_for_cp, prequential tracker).  A cada SNAPSHOT_EVERY
+#passos o estado completo vai para journal_snapshot.pkl e o journal é truncado,
+#de forma que retomar custa o snapshot mais os passos seguintes.
+#
+#Um passo só é registrado no fim, mas o treino pode ter alterado o modelo antes de
+#uma falha no mesmo passo (ex.: no teste).  Por isso cada treino concluído grava
+#também um marcador em journal_training.pkl, com o digest do checkpoint produzido
+#e o seu efeito no loop (th, trained e se o training pool foi limpo).  Ao retomar,
+#o passo refeito não treina de novo se o checkpoint ainda for o do marcador.
+#
+#Versão 2: os pools guardam ids do CommitStore (map_commit_to_row) em vez de
+#linhas; journals da versão anterior não podem ser retomados.
+#
+#Execuções interrompidas antes do journal deixaram <model_path>/training_status.pickle
+#(current, list_of_predictions e max_timestamp_for_cp).  Sem journal, esse
+#arquivo é migrado para um snapshot, e a execução retoma de onde parou como
+#antes: com pools, fila e buggy pool vazios, trained = 0 e o th da chamada.
+
+JOURNAL_VERSION = 2
+SNAPSHOT_EVERY = 50
+STATE_KEYS = ('training_pool', 'training_queue', 'buggy_pool', 'map_commit_to_row')
+
+
+def check_journal_version(record, file):
+  if record.get('version', 1) != JOURNAL_VERSION:
+    raise ValueError(f"{file} was written by an incompatible version of the step journal "
+                     f"({record.get('version', 1)}, expected {JOURNAL_VERSION}); remove it to start from scratch.")
+
+
+def get_journal_file(model_path):
+  return os.path.join(model_path, "journal.pkl")
+
+
+def get_snapshot_file(model_path):
+  return os.path.join(model_path, "journal_snapshot.pkl")
+
+
+def get_training_marker_file(model_path):
+  return os.path.join(model_path, "journal_training.pkl")
+
+
+def get_legacy_status_file(model_path):
+  return os.path.join(model_path, "training_status.pickle")
+
+
+#pred_prob como matriz float (amostras x posições).  Como no ROC-AUC
+#(prequential_metrics.roc_auc_inputs), int entra como uma posição e lista/array
+#como linha; outros valores viram NaN, que o ROC-AUC ignora.
+def pred_prob_array(pred_prob):
+  if isinstance(pred_prob, np.ndarray) and pred_prob.dtype != object:
+    if pred_prob.ndim == 2:
+      return pred_prob.astype(float)
+
+    if np.issubdtype(pred_prob.dtype, np.integer) or pred_prob.dtype == bool:
+      return pred_prob.astype(float).reshape(-1, 1)
+
+  rows = []
+
+  for yp in pred_prob:
+    if isinstance(yp, (int, np.integer)):
+      rows.append([yp])
+    elif isinstance(yp, list) or isinstance(yp, np.ndarray):
+      rows.append(np.ravel(yp))
+    else:
+      rows.append([np.nan])
+
+  return _stack_rows(rows)
+
+
+def _stack_rows(rows):
+  width = max([len(row) for row in rows], default=1)
+  array = np.full((len(rows), width), np.nan)
+
+  for i, row in enumerate(rows):
+    array[i, :len(row)] = row
+
+  return array
+
+
+def prediction_arrays(predictions):
+  return {'true_label': np.asarray(predictions['true_label']).astype(np.int8),
+          'pred_label': np.asarray(predictions['pred_label']).astype(np.int8),
+          'pred_prob': pred_prob_array(predictions['pred_prob'])}
+
+
+#Concatena as predições de todas as janelas (no formato de prediction_arrays).
+def concatenate_predictions(windows):
+  if not windows:
+    return {'true_labels': np.zeros(0, dtype=np.int8), 'pred_labels': np.zeros(0, dtype=np.int8),
+            'pred_probs': np.zeros((0, 1))}
+
+  width = max(window['pred_prob'].shape[1] for window in windows)
+  pred_probs = np.full((sum(len(window['pred_label']) for window in windows), width), np.nan)
+  start = 0
+
+  for window in windows:
+    n_samples = len(window['pred_label'])
+    pred_probs[start:start + n_samples, :window['pred_prob'].shape[1]] = window['pred_prob']
+    start += n_samples
+
+  return {'true_labels': np.concatenate([window['true_label'] for window in windows]),
+          'pred_labels': np.concatenate([window['pred_label'] for window in windows]),
+          'pred_probs': pred_probs}
+
+
+class StepJournal:
+  def __init__(self, model_path, snapshot_every=SNAPSHOT_EVERY):
+    self.journal_file = get_journal_file(model_path)
+    self.snapshot_file = get_snapshot_file(model_path)
+    self.training_marker_file = get_training_marker_file(model_path)
+    self.legacy_status_file = get_legacy_status_file(model_path)
+    self.snapshot_every = snapshot_every
+    self.windows = []
+    self.results = []
+    self._since_snapshot = 0
+
+  def exists(self):
+    return os.path.exists(self.journal_file) or os.path.exists(self.snapshot_file)
+
+  def read_snapshot(self):
+    if not os.path.exists(self.snapshot_file):
+      return None
+
+    with open(self.snapshot_file, "rb") as f:
+      return pickle.load(f)
+
+  def read_records(self, truncate=False):
+    records = []
+
+    if not os.path.exists(self.journal_file):
+      return records
+
+    with open(self.journal_file, "rb") as f:
+      while True:
+        valid_size = f.tell()
+
+        try:
+          records.append(pickle.load(f))
+        except (EOFError, pickle.UnpicklingError, ValueError, AttributeError, IndexError):
+          break
+
+    #Registro incompleto no fim do arquivo (processo interrompido durante a
+    #escrita): é descartado e o passo correspondente é refeito
+    if truncate and valid_size < os.path.getsize(self.journal_file):
+      print(f"Discarding truncated record at the end of {self.journal_file}.")
+      os.truncate(self.journal_file, valid_size)
+
+    return records
+
+  #Reconstrói o estado do último passo registrado nas estruturas recebidas e
+  #devolve os escalares do loop, ou None se não houver nada registrado.
+  def restore(self, training_pool, training_queue, buggy_pool, map_commit_to_row):
+    structures = dict(zip(STATE_KEYS, (training_pool, training_queue, buggy_pool, map_commit_to_row)))
+    snapshot = self.read_snapshot()
+    last = None
+
+    if snapshot is not None:
+      check_journal_version(snapshot, self.snapshot_file)
+
+      for key, structure in structures.items():
+        structure.apply_changes(snapshot['state'][key])
+
+      self.windows = list(snapshot['windows'])
+      self.results = list(snapshot['results'])
+      last = snapshot
+
+    for record in self.read_records(truncate=True):
+      #Registros já incorporados ao snapshot (queda entre o snapshot e o truncamento)
+      if last is not None and record['current'] < last['next']:
+        continue
+
+      check_journal_version(record, self.journal_file)
+
+      for key, structure in structures.items():
+        structure.apply_changes(record['state'][key])
+
+      self.windows.append(record['predictions'])
+
+      if record['results'] is not None:
+        self.results.append(record['results'])
+
+      self._since_snapshot += 1
+      last = record
+
+    for structure in structures.values():
+      structure.take_changes()
+
+    if last is None:
+      return None
+
+    return {key: last[key] for key in ('next', 'th', 'trained', 'max_timestamp_for_cp', 'prequential_tracker')}
+
+  #Migra o training_status.pickle de uma execução anterior ao journal para um
+  #snapshot (ver o início do módulo).  As estruturas recebidas devem estar vazias.
+  #Devolve True se houve migração.
+  def migrate_legacy_status(self, training_pool, training_queue, buggy_pool, map_commit_to_row, th=None):
+    if self.exists() or not os.path.exists(self.legacy_status_file):
+      return False
+
+    with open(self.legacy_status_file, "rb") as f:
+      training_status = pickle.load(f)
+
+    if 'current' not in training_status:
+      return False
+
+    structures = (training_pool, training_queue, buggy_pool, map_commit_to_row)
+    self.windows = [prediction_arrays(predictions) for predictions in training_status.get('list_of_predictions', [])]
+    self.results = []
+    print(f"Migrating {self.legacy_status_file} (current = {training_status['current']}, "
+          f"{len(self.windows)} windows) to the step journal.")
+    self.write_snapshot({'version': JOURNAL_VERSION, 'current': None, 'next': training_status['current'], 'predictions': None,
+                         'results': None,
+                         'state': {key: structure.full_changes() for key, structure in zip(STATE_KEYS, structures)},
+                         'th': th, 'trained': 0, 'max_timestamp_for_cp': training_status.get('max_timestamp_for_cp', 0),
+                         'prequential_tracker': None})
+    return True
+
+  #Marcador do treino concluído no passo current (ver o início do módulo)
+  def record_training(self, current, checkpoint, th, trained, cleared):
+    marker = {'version': JOURNAL_VERSION, 'current': current, 'checkpoint': checkpoint, 'th': th, 'trained': trained,
+              'cleared': cleared}
+    os.makedirs(os.path.dirname(self.training_marker_file) or '.', exist_ok=True)
+    tmp_file = self.training_marker_file + ".tmp"
+
+    with open(tmp_file, "wb") as f:
+      pickle.dump(marker, f, protocol=pickle.HIGHEST_PROTOCOL)
+      f.flush()
+      os.fsync(f.fileno())
+
+    os.replace(tmp_file, self.training_marker_file)
+
+  #Marcador do treino de um passo ainda não registrado, ou None
+  def read_training(self):
+    if not os.path.exists(self.training_marker_file):
+      return None
+
+    with open(self.training_marker_file, "rb") as f:
+      marker = pickle.load(f)
+
+    check_journal_version(marker, self.training_marker_file)
+    return marker
+
+  def append_step(self, current, next_current, predictions, results, training_pool, training_queue, buggy_pool,
+                  map_commit_to_row, th=None, trained=0, max_timestamp_for_cp=0, prequential_tracker=None):
+    structures = (training_pool, training_queue, buggy_pool, map_commit_to_row)
+    record = {'version': JOURNAL_VERSION, 'current': current, 'next': next_current, 'predictions': prediction_arrays(predictions),
+              'results': results, 'state': {key: structure.take_changes() for key, structure in zip(STATE_KEYS, structures)},
+              'th': th, 'trained': trained, 'max_timestamp_for_cp': max_timestamp_for_cp,
+              'prequential_tracker': prequential_tracker}
+
+    os.makedirs(os.path.dirname(self.journal_file) or '.', exist_ok=True)
+
+    with open(self.journal_file, "ab") as f:
+      pickle.dump(record, f, protocol=pickle.HIGHEST_PROTOCOL)
+      f.flush()
+      os.fsync(f.fileno())
+
+    #Com o passo registrado, o marcador do seu treino não é mais necessário
+    if os.path.exists(self.training_marker_file):
+      os.remove(self.training_marker_file)
+
+    self.windows.append(record['predictions'])
+
+    if results is not None:
+      self.results.append(results)
+
+    self._since_snapshot += 1
+
+    if self._since_snapshot >= self.snapshot_every:
+      record['state'] = {key: structure.full_changes() for key, structure in zip(STATE_KEYS, structures)}
+      self.write_snapshot(record)
+
+  #O snapshot é gravado num arquivo temporário e renomeado; só depois o journal
+  #é truncado.
+  def write_snapshot(self, record):
+    snapshot = dict(record, windows=self.windows, results=self.results)
+    del snapshot['predictions']
+    tmp_file = self.snapshot_file + ".tmp"
+
+    with open(tmp_file, "wb") as f:
+      pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+      f.flush()
+      os.fsync(f.fileno())
+
+    os.replace(tmp_file, self.snapshot_file)
+    open(self.journal_file, "wb").close()
+    self._since_snapshot = 0
+
+  #Predições de todas as janelas registradas, lidas do disco
+  def read_windows(self):
+    snapshot = self.read_snapshot()
+    windows = list(snapshot['windows']) if snapshot is not None else []
+    next_current = snapshot['next'] if snapshot is not None else None
+
+    for record in self.read_records():
+      if next_current is None or record['current'] >= next_current:
+        windows.append(record['predictions'])
+
+    return windows
+
+
+def read_journal_predictions(model_path):
+  return concatenate_predictions(StepJournal(model_path).read_windows())
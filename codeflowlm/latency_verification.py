@@ -2,148 +2,888 @@ from datetime import datetime
 import pandas as pd
 
 
-import math
+import hashlib
+import heapq
+import numpy as np
 import os
 
+from codeflowlm.data import read_pickle_cache, write_pickle_cache
 from codeflowlm.date_util import get_difference
 
 
+_commit_guru_fixes = {}
+
+
+def parse_fixes(df_csv):
+  #Explode a coluna fixes (ex.: '["abc", "def"]') em uma tabela (commit_hash, fix).
+  fixes = df_csv['fixes'].fillna('').astype(str).str[1:-1].str.split()
+  links = pd.DataFrame({'commit_hash': df_csv['commit_hash'], 'fix': fixes}).explode('fix')
+  links = links.dropna(subset=['fix'])
+  links['fix'] = [fix[1:fix.rfind('"')] for fix in links['fix']]
+  return links.reset_index(drop=True)
+
+
+#Lê do CSV do Commit Guru apenas as colunas commit_hash e fixes, já com os links
+#bug -> fix explodidos.  O resultado fica em cache (em memória e em um .pkl ao
+#lado do CSV), invalidado quando o mtime ou o tamanho do CSV mudam.
+def load_commit_guru_fixes(commit_guru_path, project):
+  csv = commit_guru_path + project + '.csv'
+
+  if not os.path.exists(csv):
+    return None
+
+  stat = os.stat(csv)
+  key = (stat.st_mtime_ns, stat.st_size)
+  cached = _commit_guru_fixes.get(csv)
+
+  if cached is not None and cached['key'] == key:
+    return cached
+
+  cache_file = commit_guru_path + project + '_fixes.pkl'
+  cached = read_pickle_cache(cache_file)
+
+  if not isinstance(cached, dict) or cached.get('key') != key:
+    df_csv = pd.read_csv(csv, usecols=['commit_hash', 'fixes'], dtype={'commit_hash': str, 'fixes': str})
+    cached = {'key': key, 'fixes': df_csv, 'links': parse_fixes(df_csv)}
+    write_pickle_cache(cached, cache_file)
+
+  _commit_guru_fixes[csv] = cached
+  return cached
+
+
 def add_first_fix_date(commit_guru_path, df, project):
-    csv = commit_guru_path + project + '.csv'
+    commit_guru = load_commit_guru_fixes(commit_guru_path, project)
 
-    if os.path.exists(csv) == False:
+    if commit_guru is None:
       return df
 
-    df_csv = pd.read_csv(csv)
-    result = pd.merge(df, df_csv[['commit_hash', 'fixes']], on=['commit_hash'], how='left')
+    result = pd.merge(df, commit_guru['fixes'], on=['commit_hash'], how='left')
 
     result = result.fillna('')
     print("result.columns = ", result.columns)
 
-    for index, row in result.iterrows():
-        if row['is_buggy_commit'] == 1:
-          fixes = row['fixes']
-          fixes = fixes[1:-1]
-          fixes = fixes.split()
-          timestamp = math.inf
-
-          for fix in fixes:
-              last_pos = fix.rfind('"')
-              fix = fix[1:last_pos]
-              fix_commit = result[result['commit_hash'] == fix]
-              if fix_commit.shape[0] > 0:
-                  author_date_unix_timestamp = fix_commit['author_date_unix_timestamp']
-                  author_date_unix_timestamp = int(author_date_unix_timestamp.iloc[0])
+    #Data de cada commit do projeto, usada como data da correção
+    fix_dates = result[['commit_hash', 'author_date_unix_timestamp']].drop_duplicates(subset='commit_hash')
+    fix_dates.columns = ['fix', 'fix_date']
+    fix_dates['fix_date'] = pd.to_numeric(fix_dates['fix_date'])
 
-                  if author_date_unix_timestamp < timestamp:
-                      timestamp = author_date_unix_timestamp
-
-          if timestamp < math.inf:
-              result.loc[index, 'first_fix_date'] = int(timestamp)
+    buggy = result['is_buggy_commit'] == 1
+    links = commit_guru['links']
+    links = links[links['commit_hash'].isin(result.loc[buggy, 'commit_hash'])]
+    links = links.merge(fix_dates, on='fix')
+    first_fix_dates = links.groupby('commit_hash')['fix_date'].min()
 
+    result['first_fix_date'] = result['commit_hash'].map(first_fix_dates).where(buggy)
     result = result.fillna(0)
     result['first_fix_date'] = result['first_fix_date'].astype(int)
     return result
 
 
-def add_to_training_pool(row, training_pool):
-  #Verifica se o id já existe no training pool.  Se já existir, checar o label.
-  #Se for 0 e o novo for 1, setar o label no registro atual e ignorar o novo
-  #registro.  Nas demais combinações de labels atual e novo, ignorar o novo
-  #registro e deixar o atual. Se não existir, adicionar o novo.
-  for training_example in training_pool:
-    if training_example['commit_hash'] == row['commit_hash']:
-      if training_example['is_buggy_commit'] == 0 and row['is_buggy_commit'] == 1:
-        training_example['is_buggy_commit'] = 1.0
-        assert training_example['is_buggy_commit'] == row['is_buggy_commit']
+#Cache em disco do resultado de add_first_fix_date por projeto
+#(<commit_guru_path><project>_first_fix_date.pkl), válido enquanto o CSV do
+#Commit Guru e o conteúdo de df não mudam.  Sem CSV não há o que cachear.
+def get_first_fix_date_cache_key(commit_guru_path, df, project):
+  csv = commit_guru_path + project + '.csv'
+
+  if not os.path.exists(csv):
+    return None
+
+  stat = os.stat(csv)
+  fingerprint = hashlib.sha1(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+  fingerprint.update(repr(list(df.columns)).encode('utf-8'))
+  return (stat.st_mtime_ns, stat.st_size, fingerprint.hexdigest())
+
+
+def read_first_fix_date_cache(commit_guru_path, df, project, key=None):
+  if key is None:
+    key = get_first_fix_date_cache_key(commit_guru_path, df, project)
+
+  cache_file = commit_guru_path + project + '_first_fix_date.pkl'
+
+  if key is None:
+    return None
+
+  cached = read_pickle_cache(cache_file)
+
+  if not isinstance(cached, dict) or cached.get('key') != key:
+    return None
+
+  return cached['df']
+
+
+def add_first_fix_date_cached(commit_guru_path, df, project):
+  key = get_first_fix_date_cache_key(commit_guru_path, df, project)
+
+  if key is None:
+    return add_first_fix_date(commit_guru_path, df, project)
+
+  result = read_first_fix_date_cache(commit_guru_path, df, project, key=key)
+
+  if result is not None:
+    return result
+
+  result = add_first_fix_date(commit_guru_path, df, project)
+  write_pickle_cache({'key': key, 'df': result}, commit_guru_path + project + '_first_fix_date.pkl')
+  return result
+
+
+#Posições em que old e new diferem (NaN é igual a NaN)
+def _values_differ(old, new):
+  if old.dtype != new.dtype:
+    old, new = old.astype(object), new.astype(object)
+
+  equal = np.asarray(old == new, dtype=bool)
+  return ~(equal | (pd.isna(old) & pd.isna(new)))
+
+
+#Armazenamento em colunas dos commits vistos pelo engine de latency verification.
+#Cada commit recebe um id inteiro (o mesmo se for registrado de novo) e os seus
+#campos ficam em arrays NumPy, um por coluna, em vez de uma Series por commit.
+#O training queue, o buggy pool e o training pool guardam só ids; o engine usa
+#timestamps, first_fix_dates e labels (o rótulo atual de cada commit, que o
+#engine zera e promove) e os DataFrames só são montados por to_dataframe(), na
+#hora de gravar os dados dos scripts de treino.
+class CommitStore:
+  def __init__(self):
+    self.ids = {}
+    self.hashes = []
+    self.size = 0
+    self._capacity = 0
+    #Colunas das janelas registradas, na ordem em que apareceram.  Cada commit
+    #guarda o índice (em schemas) das colunas da janela em que foi registrado.
+    self.columns = {}
+    self.schemas = []
+    self._schema_ids = {}
+    self.schema = np.empty(0, dtype=np.int64)
+    self.index = np.empty(0, dtype=object)
+    self.timestamps = np.empty(0, dtype=np.float64)
+    self.first_fix_dates = np.empty(0, dtype=np.float64)
+    self.original_labels = np.empty(0, dtype=np.float64)
+    self.labels = np.empty(0, dtype=np.float64)
+    #Ids registrados com valores novos e ids com rótulo alterado desde o último
+    #take_changes(); taken_labels guarda o rótulo de cada commit naquela chamada,
+    #para que um rótulo zerado e promovido de novo não entre no delta.
+    self._changed = {}
+    self._label_changed = {}
+    self.taken_labels = np.empty(0, dtype=np.float64)
+    self._cleared = False
+
+  def __len__(self):
+    return self.size
+
+  def __contains__(self, commit_hash):
+    return commit_hash in self.ids
+
+  def _reserve(self, size):
+    if size <= self._capacity:
+      return
+
+    capacity = max(size, 2 * self._capacity, 1024)
+
+    def grow(array):
+      grown = np.empty(capacity, dtype=array.dtype)
+      grown[:self.size] = array[:self.size]
+      return grown
+
+    self.columns = {name: grow(column) for name, column in self.columns.items()}
+
+    for name in ('schema', 'index', 'timestamps', 'first_fix_dates', 'original_labels', 'labels', 'taken_labels'):
+      setattr(self, name, grow(getattr(self, name)))
+
+    self._capacity = capacity
+
+  def _schema_id(self, schema):
+    schema = tuple(schema)
+
+    if schema not in self._schema_ids:
+      self._schema_ids[schema] = len(self.schemas)
+      self.schemas.append(schema)
+
+    return self._schema_ids[schema]
+
+  def _set_column(self, name, ids, values):
+    column = self.columns.get(name)
+
+    if column is None:
+      column = np.empty(self._capacity, dtype=values.dtype)
+    elif not np.can_cast(values.dtype, column.dtype, casting='safe'):
+      column = column.astype(np.result_type(column.dtype, values.dtype))
+
+    column[ids] = values
+    self.columns[name] = column
+
+  def _new_ids(self, hashes):
+    ids = np.empty(len(hashes), dtype=np.int64)
+    new = []
+
+    for i, commit_hash in enumerate(hashes):
+      record_id = self.ids.get(commit_hash)
+
+      if record_id is None:
+        record_id = self.size + len(new)
+        self.ids[commit_hash] = record_id
+        new.append(i)
+
+      ids[i] = record_id
+
+    self._reserve(self.size + len(new))
+    self.hashes.extend(hashes[i] for i in new)
+    self.size += len(new)
+    return ids, np.asarray(new, dtype=np.int64)
+
+  #Ids de ids (já registrados) cujos valores em df diferem dos guardados
+  def _differs(self, ids, schema_id, df):
+    differs = (self.schema[ids] != schema_id) | _values_differ(self.index[ids], df.index.to_numpy(dtype=object))
+
+    for name in df.columns:
+      differs |= _values_differ(self.columns[name][ids], df[name].to_numpy())
+
+    return differs
+
+  #Registra os commits de df (ordenado ou não) e devolve os seus ids.  Commits já
+  #registrados ficam com os valores de df, mas mantêm o rótulo atual até serem
+  #processados de novo (ver reset_label()).  Só os commits novos ou com valores
+  #diferentes entram no delta do journal.
+  def register(self, df):
+    ids, new = self._new_ids(df['commit_hash'].tolist())
+    schema_id = self._schema_id(df.columns)
+    existing = np.ones(len(ids), dtype=bool)
+    existing[new] = False
+    existing &= ~np.isin(ids, ids[new])
+    changed = ids[new]
+
+    if existing.any() and all(name in self.columns for name in df.columns):
+      changed = np.concatenate([changed, ids[existing][self._differs(ids[existing], schema_id, df[existing])]])
+    elif existing.any():
+      changed = ids
+
+    self.schema[ids] = schema_id
+    self.index[ids] = df.index.to_numpy(dtype=object)
+
+    for name in df.columns:
+      self._set_column(name, ids, df[name].to_numpy())
+
+    self.timestamps[ids] = df['author_date_unix_timestamp'].to_numpy(dtype=np.float64)
+    labels = df['is_buggy_commit'].to_numpy(dtype=np.float64)
+    self.original_labels[ids] = labels
+    self.labels[ids[new]] = labels[new]
+
+    if 'first_fix_date' in df.columns:
+      self.first_fix_dates[ids] = df['first_fix_date'].to_numpy(dtype=np.float64)
+    else:
+      self.first_fix_dates[ids] = np.nan
+
+    self._changed.update(dict.fromkeys(changed.tolist()))
+    return ids
+
+  def has_column(self, record_id, name):
+    return name in self.schemas[self.schema[record_id]]
+
+  def value(self, record_id, name):
+    if not self.has_column(record_id, name):
+      raise KeyError(name)
+
+    return self.columns[name][record_id]
+
+  def set_label(self, record_id, label):
+    self.labels[record_id] = label
+    self._label_changed[record_id] = None
+
+  #Volta o commit ao rótulo da janela em que foi registrado
+  def reset_label(self, record_id):
+    if self.labels[record_id] != self.original_labels[record_id]:
+      self.set_label(record_id, self.original_labels[record_id])
+
+  #DataFrame com as linhas de ids, na ordem dada: as colunas das janelas em que
+  #os commits foram registrados (NaN para os que não têm a coluna) e o índice
+  #original das linhas.
+  def to_dataframe(self, ids):
+    ids = np.asarray(ids, dtype=np.int64)
+
+    if len(ids) == 0:
+      return pd.DataFrame()
+
+    schema = self.schema[ids]
+    schema_ids = pd.unique(schema)
+    names = list(dict.fromkeys(name for schema_id in schema_ids for name in self.schemas[schema_id]))
+    data = {}
+
+    for name in names:
+      values = self.columns[name][ids]
+      present = np.isin(schema, [schema_id for schema_id in schema_ids if name in self.schemas[schema_id]])
+
+      if not present.all():
+        values = values.astype(object)
+        values[~present] = np.nan
+        values = pd.Series(values).infer_objects().to_numpy()
+
+      data[name] = values
+
+    return pd.DataFrame(data, index=pd.Index(self.index[ids].tolist()))
+
+  def clear(self):
+    self.__init__()
+    self._cleared = True
+
+  def _changes(self, ids, cleared):
+    ids = np.asarray(ids, dtype=np.int64)
+    return {'cleared': cleared, 'schemas': list(self.schemas), 'ids': ids,
+            'hashes': [self.hashes[record_id] for record_id in ids.tolist()],
+            'schema': self.schema[ids], 'index': self.index[ids], 'timestamps': self.timestamps[ids],
+            'first_fix_dates': self.first_fix_dates[ids], 'original_labels': self.original_labels[ids],
+            'labels': self.labels[ids], 'columns': {name: column[ids] for name, column in self.columns.items()}}
+
+  #Commits registrados ou alterados desde a última chamada (para o journal de passos)
+  def take_changes(self):
+    ids = list(self._changed)
+    ids += [record_id for record_id in self._label_changed
+            if record_id not in self._changed and self.labels[record_id] != self.taken_labels[record_id]]
+    changes = self._changes(ids, self._cleared)
+    self.taken_labels[changes['ids']] = changes['labels']
+    self._changed = {}
+    self._label_changed = {}
+    self._cleared = False
+    return changes
+
+  def full_changes(self):
+    return self._changes(np.arange(self.size), True)
+
+  def apply_changes(self, changes):
+    if changes['cleared']:
+      self.clear()
+
+    self.schemas = list(changes['schemas'])
+    self._schema_ids = {schema: schema_id for schema_id, schema in enumerate(self.schemas)}
+    ids = changes['ids']
+
+    if len(ids) == 0:
       return
 
-  training_pool.append(row)
+    size = max(self.size, int(ids.max()) + 1)
+    self._reserve(size)
+    self.hashes.extend([None] * (size - self.size))
+    self.size = size
+
+    for record_id, commit_hash in zip(ids.tolist(), changes['hashes']):
+      self.hashes[record_id] = commit_hash
+      self.ids[commit_hash] = record_id
+
+    for name in ('schema', 'index', 'timestamps', 'first_fix_dates', 'original_labels', 'labels'):
+      getattr(self, name)[ids] = changes[name]
+
+    self.taken_labels[ids] = changes['labels']
+
+    for name, values in changes['columns'].items():
+      self._set_column(name, ids, values)
+
+
+#Training pool indexado pelo id do commit (num CommitStore).  Mantém os ids na
+#ordem de inserção, como a lista antiga, mas insere/atualiza em O(1) e mantém a
+#contagem de labels, para que checar se há exemplos positivos e negativos no pool
+#não exija um DataFrame.  Em to_dataframe(), os labels do pool substituem os do
+#store.
+class TrainingPool:
+  def __init__(self, store=None):
+    self.store = store if store is not None else CommitStore()
+    self._labels = {}
+    self.positives = 0
+    self.negatives = 0
+    #Incrementado a cada clear(), para quem acompanha o pool incrementalmente
+    self.generation = 0
+    #Ids alterados desde o último take_changes() (para o journal de passos) e os
+    #labels naquela chamada
+    self._changed = {}
+    self._cleared = False
+    self._last = {}
+
+  def __len__(self):
+    return len(self._labels)
+
+  def __iter__(self):
+    return iter(self._labels)
+
+  def __contains__(self, record_id):
+    return record_id in self._labels
+
+  def _count(self, label, delta):
+    if label == 1:
+      self.positives += delta
+    else:
+      self.negatives += delta
+
+  def add(self, record_id, overwrite_label=False, label=None):
+    #Verifica se o id já existe no training pool.  Se já existir, checar o label.
+    #Se for 0 e o novo for 1, setar o label no registro atual e ignorar o novo
+    #registro.  Nas demais combinações de labels atual e novo, ignorar o novo
+    #registro e deixar o atual. Se não existir, adicionar o novo.
+    #Com overwrite_label=True o label do novo registro sempre substitui o atual.
+    #label, se informado, é usado no lugar do rótulo atual do commit no store.
+    if label is None:
+      label = self.store.labels[record_id]
+
+    label = float(label)
+
+    if record_id not in self._labels:
+      self._labels[record_id] = label
+      self._count(label, 1)
+      self._changed[record_id] = None
+      return
+
+    current_label = self._labels[record_id]
+
+    if overwrite_label or (current_label == 0 and label == 1):
+      self._count(current_label, -1)
+      self._count(label, 1)
+      self._labels[record_id] = label
+      self._changed[record_id] = None
+
+  def label(self, record_id):
+    return self._labels[record_id]
+
+  def ids(self):
+    return np.fromiter(self._labels, dtype=np.int64, count=len(self._labels))
+
+  def clear(self):
+    self._labels.clear()
+    self.positives = 0
+    self.negatives = 0
+    self.generation += 1
+    self._changed.clear()
+    self._cleared = True
+
+  #Delta desde a última chamada: se o pool foi limpo, os ids removidos e os
+  #ids/labels inseridos ou alterados, na ordem de inserção.  Um pool limpo e
+  #preenchido de novo é comparado com o da chamada anterior; o delta só é
+  #completo se a ordem dos ids que continuam no pool mudou.
+  def take_changes(self):
+    if self._cleared:
+      changes = self._diff_last()
+    else:
+      changes = {'cleared': False, 'removed': [],
+                 'labels': [(record_id, self._labels[record_id]) for record_id in self._changed]}
+
+    if changes['cleared']:
+      self._last = dict(self._labels)
+    else:
+      for record_id in changes['removed']:
+        del self._last[record_id]
+
+      self._last.update(changes['labels'])
+
+    self._changed = {}
+    self._cleared = False
+    return changes
+
+  def _diff_last(self):
+    last = self._last
+    kept = [record_id for record_id in self._labels if record_id in last]
+    new = len(self._labels) - len(kept)
+
+    #Os ids que continuam devem manter a ordem e vir antes dos novos
+    if kept != [record_id for record_id in last if record_id in self._labels] or \
+       (new > 0 and kept and list(self._labels)[len(kept) - 1] != kept[-1]):
+      return self.full_changes()
+
+    return {'cleared': False, 'removed': [record_id for record_id in last if record_id not in self._labels],
+            'labels': [(record_id, label) for record_id, label in self._labels.items() if last.get(record_id) != label]}
+
+  #Estado completo, no mesmo formato de take_changes()
+  def full_changes(self):
+    return {'cleared': True, 'removed': [], 'labels': list(self._labels.items())}
+
+  def apply_changes(self, changes):
+    if changes['cleared']:
+      self.clear()
+
+    for record_id in changes.get('removed', []):
+      self._count(self._labels.pop(record_id), -1)
+
+    for record_id, label in changes['labels']:
+      if record_id in self._labels:
+        self._count(self._labels[record_id], -1)
+
+      self._labels[record_id] = label
+      self._count(label, 1)
+
+  def to_dataframe(self):
+    df = self.store.to_dataframe(self.ids())
+
+    if df.shape[0] > 0:
+      df['is_buggy_commit'] = list(self._labels.values())
+
+    return df
+
+
+def add_to_training_pool(record_id, training_pool):
+  training_pool.add(record_id)
 
 
 waiting_time = 90
+SECONDS_PER_DAY = 24 * 60 * 60
 
 
-def do_real_latency_verification(row, training_pool, training_queue,
-                            map_commit_to_row, buggy_pool):
+#Delta de um TrainingQueue/BuggyPool para o journal de passos: as entradas
+#atuais dos commits alterados (None se saíram) e o contador de desempate, que
+#garante a mesma ordem de saída do heap após a reconstrução.  Se o pool foi
+#limpo e preenchido de novo (modo train_from_scratch), o delta é calculado contra
+#as entradas da chamada anterior (_last), e não contra o pool vazio.
+def _take_heap_changes(heap_pool):
+  entries = heap_pool._entries
+  last = heap_pool._last
 
-  #olhar os commits que têm o atributo first_fix_date != 0 e checar se essa data
-  #é anterior à data do commit atual
-  for example in training_queue:
-    example_row = map_commit_to_row[example[0]]
-    
-    if 'first_fix_date' not in example_row:
-      print(f"Example {example[0]} does not have 'first_fix_date' column!!!!!!!!!")
-      print(example_row.shape)
-      continue
-    
-    if example_row['first_fix_date'] != 0 and example_row['first_fix_date'] < row['author_date_unix_timestamp']:
-      print(f"Current date: {row['author_date']}.  Promoting example from {example_row['project']} fixed on {datetime.fromtimestamp(example_row['first_fix_date'])} to training pool.")
-      #volta o label para 1
-      example_row['is_buggy_commit'] = 1.0
-      #training_pool.append(map_commit_to_row[example[0]])
-      add_to_training_pool(example_row, training_pool)
-      assert example_row['is_buggy_commit'] == map_commit_to_row[example[0]]['is_buggy_commit']
-      training_queue.remove(example)
-      buggy_pool.remove(example)
+  if heap_pool._cleared:
+    changed = [record_id for record_id, entry in entries.items() if last.get(record_id) != tuple(entry)]
+    changed += [record_id for record_id in last if record_id not in entries]
+    heap_pool._last = {record_id: tuple(entry) for record_id, entry in entries.items()}
+  else:
+    changed = list(heap_pool._changed)
 
-  #Checks for examples older than waiting time to promote them to training pool
-  for example in training_queue:
-    #timestamp1 = example['author_date_unix_timestamp']
-    example_row = map_commit_to_row[example[0]]
-    timestamp1 = example[1]
-    timestamp2 = row['author_date_unix_timestamp']
-
-    if get_difference(timestamp1, timestamp2) >= waiting_time:
-      print(f"Current date: {row['author_date']}.  Promoting example from {example_row['project']} commited on {datetime.fromtimestamp(timestamp1)} to training pool.")
-      #training_pool.append(map_commit_to_row[example[0]])
-      add_to_training_pool(map_commit_to_row[example[0]], training_pool)
-      training_queue.remove(example)
-    #else: #COMENTADO EM 22/06/25!!!
-    #  break
-    else: #DESCOMENTADO EM 24/06/25!!!
-      break
-
-  #Olhar também para o pool de commits defeituosos para checar se tem algum cujo
+    for record_id in changed:
+      if record_id in entries:
+        last[record_id] = tuple(entries[record_id])
+      else:
+        last.pop(record_id, None)
+
+  changes = {'cleared': False, 'counter': heap_pool._counter,
+             'entries': [(record_id, list(entries[record_id]) if record_id in entries else None)
+                         for record_id in changed]}
+  heap_pool._changed = {}
+  heap_pool._cleared = False
+  return changes
+
+
+def _full_heap_changes(heap_pool):
+  return {'cleared': True, 'counter': heap_pool._counter,
+          'entries': [(record_id, list(entry)) for record_id, entry in heap_pool._entries.items()]}
+
+
+def _apply_heap_changes(heap_pool, changes):
+  if changes['cleared']:
+    heap_pool.clear()
+
+  for record_id, entry in changes['entries']:
+    heap_pool.discard(record_id)
+
+    if entry is not None:
+      entry = list(entry)
+      heap_pool._entries[record_id] = entry
+      heap_pool._push_entry(entry)
+
+  heap_pool._counter = changes['counter']
+  heap_pool._last = {record_id: tuple(entry) for record_id, entry in heap_pool._entries.items()}
+
+
+#Fila do waiting time.  Os exemplos ficam num heap ordenado pela data em que o
+#waiting time expira (author_date_unix_timestamp + waiting_time), de forma que
+#cada commit só retira da fila os exemplos vencidos, em O(log n).  Exemplos
+#removidos por outro motivo (ex.: correção detectada) são descartados de forma
+#preguiçosa quando chegam ao topo do heap.
+class TrainingQueue:
+  def __init__(self):
+    self._heap = []
+    self._entries = {}
+    #Desempate das entradas com a mesma chave, na ordem de inserção
+    self._counter = 0
+    self._changed = {}
+    self._cleared = False
+    #Entradas na última chamada de take_changes()
+    self._last = {}
+
+  def __len__(self):
+    return len(self._entries)
+
+  def __contains__(self, record_id):
+    return record_id in self._entries
+
+  def push(self, record_id, timestamp):
+    self.discard(record_id)
+    entry = [timestamp + waiting_time * SECONDS_PER_DAY, self._counter, record_id, timestamp]
+    self._counter += 1
+    self._entries[record_id] = entry
+    self._changed[record_id] = None
+    self._push_entry(entry)
+
+  def _push_entry(self, entry):
+    heapq.heappush(self._heap, entry)
+
+  def discard(self, record_id):
+    entry = self._entries.pop(record_id, None)
+
+    if entry is not None:
+      entry[2] = None
+      self._changed[record_id] = None
+
+  def pop_expired(self, timestamp):
+    expired = []
+
+    while self._heap:
+      _, _, record_id, commit_timestamp = self._heap[0]
+
+      if record_id is None:
+        heapq.heappop(self._heap)
+        continue
+
+      if get_difference(commit_timestamp, timestamp) < waiting_time:
+        break
+
+      heapq.heappop(self._heap)
+      del self._entries[record_id]
+      self._changed[record_id] = None
+      expired.append((record_id, commit_timestamp))
+
+    return expired
+
+  #O contador volta a zero: reinserir os mesmos commits na mesma ordem reproduz
+  #as mesmas entradas
+  def clear(self):
+    self._heap.clear()
+    self._entries.clear()
+    self._counter = 0
+    self._changed.clear()
+    self._cleared = True
+
+  def take_changes(self):
+    return _take_heap_changes(self)
+
+  def full_changes(self):
+    return _full_heap_changes(self)
+
+  def apply_changes(self, changes):
+    _apply_heap_changes(self, changes)
+
+
+#Pool de commits defeituosos, num heap ordenado por first_fix_date.  Commits sem
+#correção conhecida (first_fix_date == 0) ficam no pool, mas nunca vencem.
+class BuggyPool:
+  def __init__(self):
+    self._heap = []
+    self._entries = {}
+    self._counter = 0
+    self._changed = {}
+    self._cleared = False
+    self._last = {}
+
+  def __len__(self):
+    return len(self._entries)
+
+  def __contains__(self, record_id):
+    return record_id in self._entries
+
+  def push(self, record_id, first_fix_date):
+    self.discard(record_id)
+    entry = [first_fix_date, self._counter, record_id]
+    self._counter += 1
+    self._entries[record_id] = entry
+    self._changed[record_id] = None
+    self._push_entry(entry)
+
+  def _push_entry(self, entry):
+    if entry[0] != 0:
+      heapq.heappush(self._heap, entry)
+
+  def discard(self, record_id):
+    entry = self._entries.pop(record_id, None)
+
+    if entry is not None:
+      entry[2] = None
+      self._changed[record_id] = None
+
+  def pop_fixed(self, timestamp):
+    fixed = []
+
+    while self._heap:
+      first_fix_date, _, record_id = self._heap[0]
+
+      if record_id is None:
+        heapq.heappop(self._heap)
+        continue
+
+      if first_fix_date >= timestamp:
+        break
+
+      heapq.heappop(self._heap)
+      del self._entries[record_id]
+      self._changed[record_id] = None
+      fixed.append(record_id)
+
+    return fixed
+
+  #O contador volta a zero: reinserir os mesmos commits na mesma ordem reproduz
+  #as mesmas entradas
+  def clear(self):
+    self._heap.clear()
+    self._entries.clear()
+    self._counter = 0
+    self._changed.clear()
+    self._cleared = True
+
+  def take_changes(self):
+    return _take_heap_changes(self)
+
+  def full_changes(self):
+    return _full_heap_changes(self)
+
+  def apply_changes(self, changes):
+    _apply_heap_changes(self, changes)
+
+
+def do_real_latency_verification(record_id, training_pool, training_queue,
+                            map_commit_to_row, buggy_pool):
+  timestamp = map_commit_to_row.timestamps[record_id]
+
+  #Olhar para o pool de commits defeituosos para checar se tem algum cujo
   #atributo first_fix_date seja menor que a data do commit atual: esses terão
   #que ser promovidos para dados  de treinamento, sendo reapresentados como
-  #dados positivos.
-  for example in buggy_pool:
-    example_row = map_commit_to_row[example[0]]
-    if example_row['first_fix_date'] != 0 and example_row['first_fix_date'] < row['author_date_unix_timestamp']:
-      print(f"Current date: {row['author_date']}.  Promoting example from {example_row['project']} fixed on {datetime.fromtimestamp(example_row['first_fix_date'])} to training pool.")
-      example_row['is_buggy_commit'] = 1.0
-      #training_pool.append(example_row)
-      add_to_training_pool(example_row, training_pool)
-      assert example_row['is_buggy_commit'] == map_commit_to_row[example[0]]['is_buggy_commit']
-
-      if example in training_queue:
-        training_queue.remove(example)
+  #dados positivos (e saem do training queue, caso ainda estejam lá).
+  for fixed_id in buggy_pool.pop_fixed(timestamp):
+    print(f"Current date: {map_commit_to_row.value(record_id, 'author_date')}.  Promoting example from {map_commit_to_row.value(fixed_id, 'project')} fixed on {datetime.fromtimestamp(map_commit_to_row.first_fix_dates[fixed_id])} to training pool.")
+    #volta o label para 1
+    map_commit_to_row.set_label(fixed_id, 1.0)
+    add_to_training_pool(fixed_id, training_pool)
+    training_queue.discard(fixed_id)
 
-      buggy_pool.remove(example)
+  #Checks for examples older than waiting time to promote them to training pool
+  for expired_id, commit_timestamp in training_queue.pop_expired(timestamp):
+    print(f"Current date: {map_commit_to_row.value(record_id, 'author_date')}.  Promoting example from {map_commit_to_row.value(expired_id, 'project')} commited on {datetime.fromtimestamp(commit_timestamp)} to training pool.")
+    add_to_training_pool(expired_id, training_pool)
 
 
-def do_latency_verification(row, training_pool, training_queue,
+def do_latency_verification(record_id, training_pool, training_queue,
                             map_commit_to_row):
   #Checks for examples older than waiting time to promote them to training pool
-  for example in training_queue:
-    #timestamp1 = example['author_date_unix_timestamp']
-    timestamp1 = example[1]
-    timestamp2 = row['author_date_unix_timestamp']
-
-    if get_difference(timestamp1, timestamp2) >= waiting_time:
-      training_pool.append(map_commit_to_row[example[0]])
-      training_queue.remove(example)
-    else:
-      break
+  for expired_id, _ in training_queue.pop_expired(map_commit_to_row.timestamps[record_id]):
+    add_to_training_pool(expired_id, training_pool)
 
 
-def process_buggy_commit(row, training_queue, map_commit_to_row, buggy_pool):
+def process_buggy_commit(record_id, training_queue, map_commit_to_row, buggy_pool):
   #Ao encontrar no dataset ordenado um commit rotulado como buggy, setar o label
   #como 0, colocar o commit no pool do waiting time e guardar o commit também em
   #um pool de commits defeituosos até que chegue um outro commit qualquer com
   #data posterior à data de detecção dele.
-  row['is_buggy_commit'] = 0.0
-  training_queue.append((row['commit_hash'], row['author_date_unix_timestamp']))
-  map_commit_to_row[row['commit_hash']] = row
-  buggy_pool.append((row['commit_hash'], row['author_date_unix_timestamp']))
\ No newline at end of file
+  map_commit_to_row.set_label(record_id, 0.0)
+  training_queue.push(record_id, map_commit_to_row.timestamps[record_id])
+
+  if not map_commit_to_row.has_column(record_id, 'first_fix_date'):
+    print(f"Example {map_commit_to_row.hashes[record_id]} does not have 'first_fix_date' column!!!!!!!!!")
+    buggy_pool.push(record_id, 0)
+  else:
+    buggy_pool.push(record_id, map_commit_to_row.first_fix_dates[record_id])
+
+
+#Processa um commit do stream (um id do CommitStore map_commit_to_row): coloca-o
+#no training queue/buggy pool (ou direto no training pool) e promove os exemplos
+#vencidos até a data dele.
+def process_commit(record_id, training_pool, training_queue, map_commit_to_row,
+                   buggy_pool, do_real_lat_ver=False):
+  #Como a linha nova de cada janela, o commit começa com o rótulo da janela
+  map_commit_to_row.reset_label(record_id)
+
+  if map_commit_to_row.labels[record_id] == 1:
+    if do_real_lat_ver:
+      process_buggy_commit(record_id, training_queue, map_commit_to_row, buggy_pool)
+    else:
+      add_to_training_pool(record_id, training_pool)
+  else:
+    training_queue.push(record_id, map_commit_to_row.timestamps[record_id])
+
+  if do_real_lat_ver:
+    do_real_latency_verification(record_id, training_pool, training_queue,
+                                 map_commit_to_row, buggy_pool)
+  else:
+    do_latency_verification(record_id, training_pool, training_queue,
+                            map_commit_to_row)
+
+
+def check_timestamps_sorted(timestamps):
+  assert len(timestamps) == 0 or (timestamps[0] >= 0 and np.all(np.diff(timestamps) >= 0))
+
+
+#Alimenta o engine com uma janela inteira de commits (ordenada por data), que é
+#registrada de uma vez no CommitStore map_commit_to_row.  Um commit repetido
+#(na mesma janela ou em janelas diferentes) tem um único id e fica uma única vez
+#no training pool, também sem latency verification real; antes, nesse modo, as
+#linhas repetidas eram acrescentadas de novo ao pool.
+def process_window(df_window, training_pool, training_queue, map_commit_to_row,
+                   buggy_pool, do_real_lat_ver=False):
+  ids = map_commit_to_row.register(df_window)
+  check_timestamps_sorted(map_commit_to_row.timestamps[ids])
+
+  for record_id in ids.tolist():
+    process_commit(record_id, training_pool, training_queue, map_commit_to_row,
+                   buggy_pool, do_real_lat_ver=do_real_lat_ver)
+
+  return df_window['author_date_unix_timestamp'].iloc[-1] if len(ids) > 0 else 0
+
+
+#Registra as promoções feitas pelo engine em vez de guardá-las num pool: para
+#cada uma, a posição do commit que a disparou, o id e o label naquele momento.
+class _PromotionRecorder:
+  def __init__(self, store):
+    self.store = store
+    self.position = 0
+    self.positions = []
+    self.ids = []
+    self.labels = []
+
+  def add(self, record_id, overwrite_label=False, label=None):
+    self.positions.append(self.position)
+    self.ids.append(record_id)
+    self.labels.append(float(self.store.labels[record_id] if label is None else label))
+
+
+#Linha do tempo dos rótulos de um projeto.  O momento em que o rótulo de cada
+#commit fica visível (e qual é esse rótulo) depende só do waiting_time, do
+#first_fix_date e das datas dos commits, então basta passar o stream uma vez pelo
+#engine e registrar cada promoção com a posição do commit que a disparou.
+#O training pool "após processar df_project[:current]" é a aplicação, em ordem,
+#das promoções registradas em posições < current, que apply() obtém com um
+#searchsorted.  É equivalente a limpar o training queue/buggy pool e chamar
+#prepare_train_data sobre todo o prefixo, como no modo train_from_scratch.
+#store deve ser o CommitStore do training pool em que a linha do tempo é aplicada.
+class LabelTimeline:
+  def __init__(self, df_project, do_real_lat_ver=False, store=None):
+    self.store = store if store is not None else CommitStore()
+    recorder = _PromotionRecorder(self.store)
+    training_queue = TrainingQueue()
+    buggy_pool = BuggyPool()
+    ids = self.store.register(df_project)
+    check_timestamps_sorted(self.store.timestamps[ids])
+
+    for position, record_id in enumerate(ids.tolist()):
+      recorder.position = position
+      process_commit(record_id, recorder, training_queue, self.store,
+                     buggy_pool, do_real_lat_ver=do_real_lat_ver)
+
+    self.positions = np.asarray(recorder.positions, dtype=np.int64)
+    self.ids = recorder.ids
+    self.labels = recorder.labels
+    self._training_pool = None
+    self._generation = None
+    self._applied = 0
+
+  def __len__(self):
+    return len(self.ids)
+
+  def promotions_before(self, current):
+    return int(np.searchsorted(self.positions, current, side='left'))
+
+  #Atualiza training_pool para o estado "após processar df_project[:current]".
+  #Só as promoções ainda não aplicadas são inseridas, a não ser que o pool tenha
+  #sido limpo (ex.: modelo treinado), quando todas são reaplicadas.
+  def apply(self, training_pool, current):
+    if training_pool.store is not self.store:
+      raise ValueError("The training pool and the label timeline must share the same CommitStore.")
+
+    if training_pool is not self._training_pool or training_pool.generation != self._generation:
+      self._applied = 0
+
+    end = self.promotions_before(current)
+
+    for i in range(self._applied, end):
+      training_pool.add(self.ids[i], label=self.labels[i])
+
+    self._training_pool = training_pool
+    self._generation = training_pool.generation
+    self._applied = max(self._applied, end)
+    return training_pool
+
@@ -0,0 +1,158 @@
+import os
+import pickle
+import shutil
+import numpy as np
+import pandas as pd
+from codeflowlm.columnar import is_columnar_changes, write_columnar_changes
+from codeflowlm.data import ChangeStore, FileStore, load_pickle
+
+#Artefatos de treino/teste por referência.  Em vez de gravar a cada passo as
+#mensagens, diffs e features das janelas, o loop grava um manifesto pequeno:
+#um pickle cujo carregamento (pickle.load, como os scripts já fazem com os
+#arquivos de --train_data_file, --eval_data_file, --test_data_file e
+#--stream_data_file) reconstrói os mesmos dados a partir dos corpora:
+#
+#  - mudanças: o corpus de mudanças no formato colunar (ver codeflowlm.columnar),
+#    com as posições dos commits e os labels (que podem ter sido alterados pelo
+#    loop).  Arquivos de mudanças em pickle são convertidos uma vez, para
+#    <arquivo>.cols ao lado do pickle, e a conversão é refeita se o pickle mudar;
+#  - features: features_corpus_<project>.pkl, gravado uma vez por execução,
+#    com as posições das linhas, o índice e as colunas que variam por passo.
+#
+#O processo que lê o manifesto precisa importar codeflowlm (execute_command e
+#ModelWorker colocam o pacote no PYTHONPATH).  Como o corpus de mudanças é lido
+#por mmap, cada processo decodifica só os textos do passo.  O corpus de features
+#é um pickle desserializado por inteiro em cada processo (uma vez só com o
+#ModelWorker, que mantém o cache); ele só tem as linhas do projeto (e dos outros
+#projetos no modo cross-project) e nenhum texto.  Se a conversão não puder ser
+#gravada, o manifesto referencia os pickles, e cada processo sem ModelWorker
+#carrega o corpus de mudanças inteiro.
+
+#Colunas gravadas no manifesto em vez de lidas do corpus: o label (alterado
+#pela latency verification) e o timestamp (convertido para número no modo
+#cross-project).  Colunas que não existem no corpus também vão no manifesto.
+OVERRIDE_COLUMNS = ['is_buggy_commit', 'author_date_unix_timestamp']
+
+
+#Referência que o pickle resolve no carregamento: pickle.load devolve
+#loader(*args), não a referência.
+class DataReference:
+  def __init__(self, loader, args):
+    self.loader = loader
+    self.args = args
+
+  def __reduce__(self):
+    return (self.loader, self.args)
+
+
+class FeatureCorpus(FileStore):
+  def load(self):
+    self.df = load_pickle(self.files[0])
+    commits = pd.Index(self.df['commit_hash'])
+    self.positions = pd.Series(np.arange(len(commits)), index=commits)
+    self.positions = self.positions[~self.positions.index.duplicated(keep='first')]
+
+  def release(self):
+    self.df = None
+    self.positions = None
+
+  def lookup(self, commit_hashes):
+    idx = self.positions.index.get_indexer(list(commit_hashes))
+
+    if (idx < 0).any():
+      raise ValueError(f"{list(commit_hashes)[int(np.argmax(idx < 0))]!r} is not in the feature corpus")
+
+    return self.positions.to_numpy()[idx]
+
+
+def materialize_changes(changes_files, positions, labels):
+  change_store = ChangeStore.open(*changes_files)
+  return (change_store.take(0, positions), labels.tolist(), change_store.take(2, positions),
+          change_store.take(3, positions))
+
+
+def materialize_features(corpus_file, positions, index, columns, overrides):
+  corpus = FeatureCorpus.open(corpus_file)
+  df = corpus.df.iloc[positions].reindex(columns=columns)
+  df.index = index
+
+  for column, values in overrides.items():
+    df[column] = values
+
+  return df
+
+
+def get_columnar_changes_dir(changes_file):
+  return os.path.splitext(changes_file)[0] + ".cols"
+
+
+#Corpus colunar equivalente a cada arquivo de mudanças, convertendo os pickles
+#que ainda não têm uma conversão mais nova que eles.  Devolve o próprio arquivo
+#se a conversão não puder ser gravada.
+def get_columnar_changes(changes_files):
+  change_store = None
+  columnar_files = []
+
+  for i, changes_file in enumerate(changes_files):
+    if is_columnar_changes(changes_file):
+      columnar_files.append(changes_file)
+      continue
+
+    columnar_dir = get_columnar_changes_dir(changes_file)
+
+    if is_columnar_changes(columnar_dir) and \
+        os.stat(os.path.join(columnar_dir, "labels.npy")).st_mtime_ns >= os.stat(changes_file).st_mtime_ns:
+      columnar_files.append(columnar_dir)
+      continue
+
+    if change_store is None:
+      change_store = ChangeStore.open(*changes_files)
+
+    tmp_dir = f"{columnar_dir}.{os.getpid()}.tmp"
+
+    try:
+      shutil.rmtree(tmp_dir, ignore_errors=True)
+      write_columnar_changes(change_store.parts[i], tmp_dir)
+      shutil.rmtree(columnar_dir, ignore_errors=True)
+      os.replace(tmp_dir, columnar_dir)
+      columnar_files.append(columnar_dir)
+    except OSError as e:
+      print(f"Could not convert {changes_file} to the columnar format: {e}")
+      shutil.rmtree(tmp_dir, ignore_errors=True)
+      columnar_files.append(changes_file)
+
+  return tuple(columnar_files)
+
+
+class TrainingArtifacts:
+  def __init__(self, path, project, changes_files, df_corpus):
+    self.changes_files = tuple(os.path.abspath(file) for file in changes_files)
+    #Corpus referenciado pelos manifestos (as posições são as mesmas)
+    self.manifest_changes_files = get_columnar_changes(self.changes_files)
+    self.corpus_file = os.path.abspath(os.path.join(path, f"features_corpus_{project}.pkl"))
+    os.makedirs(path, exist_ok=True)
+
+    with open(self.corpus_file, "wb") as f:
+      pickle.dump(df_corpus.reset_index(drop=True), f)
+
+    self.corpus_columns = set(df_corpus.columns)
+
+  def write_changes(self, changes_file, df):
+    positions = ChangeStore.open(*self.changes_files).index.lookup(df['commit_hash'])
+    labels = df['is_buggy_commit'].to_numpy()
+
+    with open(changes_file, "wb") as f:
+      pickle.dump(DataReference(materialize_changes, (self.manifest_changes_files, positions, labels)), f)
+
+  def write_features(self, features_file, df):
+    positions = FeatureCorpus.open(self.corpus_file).lookup(df['commit_hash'])
+    overrides = {column: df[column].to_numpy() for column in df.columns
+                 if column in OVERRIDE_COLUMNS or column not in self.corpus_columns}
+
+    with open(features_file, "wb") as f:
+      pickle.dump(DataReference(materialize_features, (self.corpus_file, positions, df.index, list(df.columns), overrides)), f)
+
+  def write(self, changes_file, features_file, df):
+    self.write_changes(changes_file, df)
+    self.write_features(features_file, df)
+    return changes_file, features_file
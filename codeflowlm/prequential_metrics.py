@@ -1,50 +1,55 @@
 import numpy as np
 import pandas as pd
+from scipy.signal import lfilter
 from scipy.stats import mstats
-from river import metrics
+
+#Soma com decaimento exponencial, por classe, da recorrência
+#  acc[label] = value + fading_factor * acc[label]
+#aplicada a cada amostra (só a posição da classe da amostra é atualizada).  Para
+#cada classe, é um filtro linear sobre a subsequência das amostras dessa classe,
+#propagado para as posições seguintes até a próxima amostra da classe.
+def faded_sums(labels, values, fading_factor, n_classes=2):
+    n_samples = len(labels)
+    sums = np.zeros((n_samples, n_classes))
+
+    for label in range(n_classes):
+        positions = np.flatnonzero(labels == label)
+
+        if len(positions) == 0:
+            continue
+
+        faded = lfilter([1.0], [1.0, -fading_factor], values[positions])
+        last = np.searchsorted(positions, np.arange(n_samples), side='right') - 1
+        sums[:, label] = np.where(last >= 0, faded[np.maximum(last, 0)], 0.0)
+
+    return sums
+
+
+def faded_counts_and_hits(predictions, fading_factor):
+    targets = np.asarray(predictions['true_labels']).astype(int)
+    pred_labels = np.asarray(predictions['pred_labels'])
+    counts = faded_sums(targets, np.ones(len(targets)), fading_factor)
+    hits = faded_sums(targets, (targets == pred_labels).astype(float), fading_factor)
+    return counts, hits
+
 
 def prequential_recalls(predictions, fading_factor):
-    recalls = []
-    counts = np.zeros(2)
-    hits = np.zeros(2)
-
-    targets = predictions['true_labels']
-    predictions = predictions['pred_labels']
-    print('len(targets) = ', len(targets))
-    print('len(predictions) = ', len(predictions))
-    n_samples = len(targets)
-    for i in range(n_samples):
-        label = int(targets[i])
-        counts[label] = 1 + fading_factor * counts[label]
-        hits[label] = int(label == predictions[i]) + \
-            fading_factor * hits[label]
-        recalls.append(hits / (counts + 1e-12))
+    print('len(targets) = ', len(predictions['true_labels']))
+    print('len(predictions) = ', len(predictions['pred_labels']))
+    counts, hits = faded_counts_and_hits(predictions, fading_factor)
     columns = ['r{}'.format(i) for i in range(2)]
-    recalls = pd.DataFrame(recalls, columns=columns)
+    recalls = pd.DataFrame(hits / (counts + 1e-12), columns=columns)
     return recalls
 
 
 def prequential_f1s(predictions, fading_factor):
-    f1s = []
-    recalls = []
-    precisions = []
-    counts = np.zeros(2)
-    hits = np.zeros(2)
-    preds = np.zeros(2)
-    targets = predictions['true_labels']
-    predictions = predictions['pred_labels']
-    n_samples = len(targets)
-
-    for i in range(n_samples):
-        label = int(targets[i])
-        pred = predictions[i]
-        counts[label] = 1 + fading_factor * counts[label]
-        hits[label] = int(label == predictions[i]) + \
-            fading_factor * hits[label]
-        preds[label] = 1 + fading_factor * preds[label]
-        recalls.append(hits[1] / (counts[1] + 1e-12))
-        precisions.append(hits[1] / (preds[1] + 1e-12))
-        f1s.append(2 * precisions[-1] * recalls[-1] / (precisions[-1] + recalls[-1] + 1e-12))
+    counts, hits = faded_counts_and_hits(predictions, fading_factor)
+    #Como no cálculo original, preds é atualizado pelo label verdadeiro da amostra
+    #(preds[label] = 1 + fading_factor * preds[label]), ou seja, é igual a counts.
+    preds = counts
+    recalls = hits[:, 1] / (counts[:, 1] + 1e-12)
+    precisions = hits[:, 1] / (preds[:, 1] + 1e-12)
+    f1s = 2 * precisions * recalls / (precisions + recalls + 1e-12)
 
     metrics = pd.DataFrame({'f1': f1s, 'precision': precisions, 'recall': recalls})
     return metrics
@@ -71,39 +76,221 @@ def prequential_metrics(predictions, fading_factor):
     return metrics
 
 
-def rolling_roc_auc(predictions):
-  metric = metrics.RollingROCAUC()
-  true_label = predictions['true_labels']
-  pred_prob = predictions['pred_probs']
+#Amostras consideradas no ROC-AUC, como na versão original com river.RollingROCAUC:
+#pred_prob int (predições sem modelo) entra como está; lista/array (probabilidades
+#do classificador) entra pela primeira posição; os demais tipos são ignorados.
+#Devolve os labels (True para a classe positiva) e os scores como arrays.  Uma
+#matriz de pred_probs (ex.: a do journal de passos) usa a primeira coluna, e
+#linhas com NaN nela são ignoradas.
+def roc_auc_inputs(true_labels, pred_probs):
+  if isinstance(pred_probs, np.ndarray) and pred_probs.ndim == 2:
+    n_samples = min(len(true_labels), len(pred_probs))
+    labels = np.asarray(true_labels)[:n_samples] == 1
+    scores = pred_probs[:n_samples, 0].astype(float)
+    considered = ~np.isnan(scores)
+    return labels[considered], scores[considered]
+
+  labels = []
+  scores = []
 
-  for yt, yp in zip(true_label, pred_prob):
+  for yt, yp in zip(true_labels, pred_probs):
     if isinstance(yp, int):
-      metric.update(yt, yp)
+      scores.append(yp)
     elif isinstance(yp, list) or isinstance(yp, np.ndarray):
-      metric.update(yt, yp[0])
+      scores.append(yp[0])
+    else:
+      continue
+
+    labels.append(yt == 1)
+
+  return np.asarray(labels, dtype=bool), np.asarray(scores, dtype=float)
+
+
+#ROC-AUC exato de uma janela.  Empates seguem o RollingROCAUC do river: em cada
+#grupo de scores iguais, floor(P/2) dos P positivos ficam acima dos negativos do
+#grupo (e não a metade dos pares, como no AUC usual).  Sem positivos ou sem
+#negativos na janela, o valor é 0.
+def window_roc_auc(labels, scores):
+  positives = scores[labels]
+  negatives = scores[~labels]
+
+  if len(positives) == 0 or len(negatives) == 0:
+    return 0.0
+
+  strict_pairs = np.searchsorted(np.sort(negatives), positives, side='left').sum()
+  values, groups = np.unique(scores, return_inverse=True)
+  tied_positives = np.bincount(groups[labels], minlength=len(values))
+  tied_negatives = np.bincount(groups[~labels], minlength=len(values))
+  tied_pairs = (tied_negatives * (tied_positives // 2)).sum()
+  return float((strict_pairs + tied_pairs) / (len(positives) * len(negatives)))
+
+
+#Para cada amostra t, número de pares (positivo, negativo) com score do positivo
+#estritamente maior formados entre t e as lag amostras anteriores.  Calculado em
+#blocos de linhas sobre uma visão deslizante, para limitar a memória.
+def _strict_pairs_with_previous(labels, scores, lag, chunk_size=4096):
+  n_samples = len(labels)
+  pairs = np.zeros(n_samples, dtype=np.int64)
+
+  if lag == 0 or n_samples == 0:
+    return pairs
+
+  #Para um positivo, contam os negativos anteriores com score menor; para um
+  #negativo, os positivos anteriores com score maior (NaN nunca compara).
+  padding = np.full(lag, np.nan)
+  negative_scores = np.concatenate([padding, np.where(labels, np.nan, scores)])
+  positive_scores = np.concatenate([padding, np.where(labels, scores, np.nan)])
+
+  for start in range(0, n_samples, chunk_size):
+    stop = min(start + chunk_size, n_samples)
+    rows = np.arange(start, stop)
+    positive_rows = rows[labels[start:stop]]
+    negative_rows = rows[~labels[start:stop]]
+    previous_negatives = np.lib.stride_tricks.sliding_window_view(negative_scores[start:stop + lag - 1], lag)
+    previous_positives = np.lib.stride_tricks.sliding_window_view(positive_scores[start:stop + lag - 1], lag)
+    pairs[positive_rows] = np.count_nonzero(previous_negatives[positive_rows - start] < scores[positive_rows, None], axis=1)
+    pairs[negative_rows] = np.count_nonzero(previous_positives[negative_rows - start] > scores[negative_rows, None], axis=1)
+
+  return pairs
+
+
+#Curva do ROC-AUC em janela deslizante: o valor na posição t é o AUC das
+#window_size últimas amostras consideradas até t (o que river.RollingROCAUC.get()
+#devolveria após a t-ésima atualização).  Os pares estritos entram quando a
+#segunda amostra do par chega e saem quando a primeira deixa a janela; os pares
+#empatados são mantidos por grupo de score a partir de contagens acumuladas.
+def rolling_roc_auc_curve(true_labels, pred_probs, window_size=1000):
+  labels, scores = roc_auc_inputs(true_labels, pred_probs)
+  n_samples = len(labels)
 
-  return metric.get()
+  if n_samples == 0:
+    return np.zeros(0)
 
+  lag = window_size - 1
+  positions = np.arange(n_samples)
 
-def calculate_prequential_mean_and_std(predictions, decay_factor=0.99):
+  pairs_with_previous = _strict_pairs_with_previous(labels, scores, lag)
+  pairs_with_next = _strict_pairs_with_previous(labels[::-1], scores[::-1], lag)[::-1]
+  pairs_leaving = np.zeros(n_samples, dtype=np.int64)
+  pairs_leaving[window_size:] = pairs_with_next[:max(n_samples - window_size, 0)]
+  strict_pairs = np.cumsum(pairs_with_previous) - np.cumsum(pairs_leaving)
+
+  values, groups = np.unique(scores, return_inverse=True)
+  order = np.lexsort((positions, groups))
+  keys = groups[order] * n_samples + order
+  group_start = np.searchsorted(groups[order], np.arange(len(values)))
+  cumulative_positives = np.concatenate([[0], np.cumsum(labels[order])])
+
+  #Positivos/negativos do grupo com índice <= position
+  def group_counts(group, position):
+    position = np.maximum(position, -1)
+    end = np.searchsorted(keys, group * n_samples + position, side='right')
+    total = end - group_start[group]
+    positives = cumulative_positives[end] - cumulative_positives[group_start[group]]
+    return positives, total - positives
+
+  def tied_pairs(group, position):
+    positives, negatives = group_counts(group, position)
+    old_positives, old_negatives = group_counts(group, position - window_size)
+    return (negatives - old_negatives) * ((positives - old_positives) // 2)
+
+  #Só mudam os grupos da amostra que entra e da que sai da janela
+  entering = groups
+  leaving = np.where(positions >= window_size, groups[np.maximum(positions - window_size, 0)], -1)
+  delta = tied_pairs(entering, positions) - tied_pairs(entering, positions - 1)
+  changed = (leaving >= 0) & (leaving != entering)
+  leaving = np.maximum(leaving, 0)
+  delta += np.where(changed, tied_pairs(leaving, positions) - tied_pairs(leaving, positions - 1), 0)
+  tied = np.cumsum(delta)
+
+  cumulative_labels = np.cumsum(labels)
+  window_positives = cumulative_labels - np.concatenate([np.zeros(min(window_size, n_samples), dtype=np.int64),
+                                                          cumulative_labels[:max(n_samples - window_size, 0)]])
+  window_negatives = np.minimum(positions + 1, window_size) - window_positives
+  total_pairs = window_positives * window_negatives
+  return np.where(total_pairs > 0, (strict_pairs + tied) / np.maximum(total_pairs, 1), 0.0)
+
+
+def rolling_roc_auc(predictions, window_size=1000):
+  labels, scores = roc_auc_inputs(predictions['true_labels'], predictions['pred_probs'])
+  return window_roc_auc(labels[-window_size:], scores[-window_size:])
+
+
+#Versão incremental de prequential_metrics() + médias/desvios, atualizada a cada
+#janela de predições do loop online.  O estado é O(1): contagens com decaimento
+#por classe e média/variância (Welford) de cada métrica.  Os valores são os
+#mesmos de calculate_prequential_mean_and_std() (desvio padrão amostral, como
+#pandas).
+class PrequentialTracker:
+    metric_names = ['g-mean', 'f1', 'precision', 'recall', 'r0', 'r1', 'r0-r1']
+
+    def __init__(self, fading_factor=0.99):
+        self.fading_factor = fading_factor
+        self.counts = np.zeros(2)
+        self.hits = np.zeros(2)
+        self.n_samples = 0
+        self.means = dict.fromkeys(self.metric_names, 0.0)
+        self.m2 = dict.fromkeys(self.metric_names, 0.0)
+
+    def current(self):
+        recalls = self.hits / (self.counts + 1e-12)
+        #Como em prequential_f1s, precision usa preds == counts
+        recall = self.hits[1] / (self.counts[1] + 1e-12)
+        precision = self.hits[1] / (self.counts[1] + 1e-12)
+        f1 = 2 * precision * recall / (precision + recall + 1e-12)
+        return {'g-mean': np.sqrt(recalls[0] * recalls[1]), 'f1': f1, 'precision': precision,
+                'recall': recall, 'r0': recalls[0], 'r1': recalls[1], 'r0-r1': abs(recalls[0] - recalls[1])}
+
+    def update(self, true_labels, pred_labels):
+        for target, pred in zip(true_labels, pred_labels):
+            label = int(target)
+            self.counts[label] = 1 + self.fading_factor * self.counts[label]
+            self.hits[label] = int(label == pred) + self.fading_factor * self.hits[label]
+            self.n_samples += 1
+
+            for name, value in self.current().items():
+                delta = value - self.means[name]
+                self.means[name] += delta / self.n_samples
+                self.m2[name] += delta * (value - self.means[name])
+
+    def mean(self, name):
+        return self.means[name] if self.n_samples > 0 else np.nan
+
+    def std(self, name):
+        return np.sqrt(self.m2[name] / (self.n_samples - 1)) if self.n_samples > 1 else np.nan
+
+    def summary(self):
+        return {name: (self.mean(name), self.std(name)) for name in self.metric_names}
+
+    def restore(self, other):
+        self.__dict__.update(other.__dict__)
+
+
+#Com um PrequentialTracker que já acompanhou todas as predições (mesmo fading
+#factor), as médias e desvios vêm dele; o DataFrame de métricas continua sendo
+#calculado para o gráfico e o CSV.
+def calculate_prequential_mean_and_std(predictions, decay_factor=0.99, tracker=None):
   metrics = prequential_metrics(predictions, decay_factor)
-  g_mean = metrics['g-mean'].mean()
-  std_g_mean = metrics['g-mean'].std()
-  f1 = metrics['f1'].mean()
+
+  if tracker is None or tracker.n_samples != metrics.shape[0] or tracker.fading_factor != decay_factor:
+    tracker = None
+
+  def mean_and_std(name):
+    if tracker is not None:
+      return tracker.mean(name), tracker.std(name)
+
+    return metrics[name].mean(), metrics[name].std()
+
+  g_mean, std_g_mean = mean_and_std('g-mean')
+  f1, std_f1 = mean_and_std('f1')
 
   print(f"G-Mean: Mean = {g_mean:.4f}, Standard Deviation = {std_g_mean:.4f}")
 
-  std_f1 = metrics['f1'].std()
-  precision = metrics['precision'].mean()
-  std_precision = metrics['precision'].std()
-  recall = metrics['recall'].mean()
-  std_recall = metrics['recall'].std()
-  r0 = metrics['r0'].mean()
-  std_r0 = metrics['r0'].std()
-  r1 = metrics['r1'].mean()
-  std_r1 = metrics['r1'].std()
-  r_diff = metrics['r0-r1'].mean()
-  std_r_diff = metrics['r0-r1'].std()
+  precision, std_precision = mean_and_std('precision')
+  recall, std_recall = mean_and_std('recall')
+  r0, std_r0 = mean_and_std('r0')
+  r1, std_r1 = mean_and_std('r1')
+  r_diff, std_r_diff = mean_and_std('r0-r1')
 
   roc_auc = rolling_roc_auc(predictions)
   print('roc_auc = ', roc_auc)
@@ -0,0 +1,308 @@
+import filecmp
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from codeflowlm.data import get_df_features_full
+from codeflowlm.journal import concatenate_predictions, prediction_arrays
+from codeflowlm.latency_verification import add_first_fix_date
+from codeflowlm.test import test
+from codeflowlm.training_runs import cached_file_digest
+from codeflowlm.worker import ModelWorker
+
+#Reavaliação offline de uma execução do loop online.  Com keep_checkpoints=True,
+#o loop guarda o checkpoint usado no teste de cada passo:
+#
+#  - <model_path>/step_checkpoints/<digest>/checkpoint-best-<metric>/: cópia do
+#    checkpoint, endereçada pelo digest do model.bin.  Cada checkpoint distinto é
+#    guardado uma vez, e os arquivos iguais aos do checkpoint guardado antes dele
+#    são hard links para a cópia anterior;
+#  - <model_path>/step_checkpoints.jsonl: uma linha por passo com a janela de
+#    teste em df_project, o digest do checkpoint (None se ainda não havia modelo),
+#    o threshold, adjust_th e a referência do stream completo passado aos
+#    scripts (--stream_data_file; None sem stream): as posições do trecho de
+#    df_project e, no modo cross-project, a janela de datas dos outros projetos
+#    (como no step log).  O stream cresce com o prefixo, então só a referência é
+#    guardada, não os arquivos.
+#
+#rescore_run() reavalia todas as janelas a partir desse manifesto: as janelas que
+#compartilham checkpoint e threshold vão para uma única chamada de teste, e as
+#chamadas rodam num só processo (ModelWorker).  O resultado é a
+#list_of_predictions do loop, uma entrada por janela.  Sem adjust_th os scripts
+#não usam o stream no teste, então cada chamada recebe o stream do último passo
+#do grupo, remontado a partir da referência.  Passos testados com adjust_th não
+#podem ser reavaliados: o threshold ajustado pelo script depende da janela
+#testada e não fica registrado.
+
+
+def get_step_checkpoints_dir(model_path):
+  return os.path.join(model_path, "step_checkpoints")
+
+
+def get_checkpoint_manifest_file(model_path):
+  return os.path.join(model_path, "step_checkpoints.jsonl")
+
+
+class CheckpointManifest:
+  def __init__(self, model_path, eval_metric='f1'):
+    self.model_path = model_path
+    self.eval_metric = eval_metric
+    self.checkpoints_dir = get_step_checkpoints_dir(model_path)
+    self.manifest_file = get_checkpoint_manifest_file(model_path)
+    self._digests = {}
+    self._last_checkpoint = None
+
+  def get_checkpoint_dir(self, digest):
+    return os.path.join(self.checkpoints_dir, digest)
+
+  #Último checkpoint guardado (numa retomada, o último registrado no manifesto)
+  def last_checkpoint(self):
+    if self._last_checkpoint is None:
+      checkpoints = [step['checkpoint'] for step in read_checkpoint_manifest(self.model_path) if step['checkpoint']]
+      self._last_checkpoint = checkpoints[-1] if checkpoints else None
+
+    return self._last_checkpoint
+
+  #Copia o checkpoint atual de model_path, se ainda não guardado, e devolve o digest
+  def save_checkpoint(self):
+    source = os.path.join(self.model_path, f"checkpoint-best-{self.eval_metric}")
+    digest = cached_file_digest(os.path.join(source, "model.bin"), self._digests)
+
+    if digest is None:
+      return None
+
+    checkpoint_dir = self.get_checkpoint_dir(digest)
+
+    if not os.path.exists(checkpoint_dir):
+      tmp_dir = checkpoint_dir + ".tmp"
+      shutil.rmtree(tmp_dir, ignore_errors=True)
+      shutil.copytree(source, os.path.join(tmp_dir, f"checkpoint-best-{self.eval_metric}"),
+                      copy_function=self._link_or_copy(source))
+      os.replace(tmp_dir, checkpoint_dir)
+
+    self._last_checkpoint = digest
+    return digest
+
+  #Função de cópia para copytree: um arquivo igual ao do último checkpoint guardado
+  #vira um hard link para aquela cópia (nunca para o arquivo de model_path, que o
+  #treino seguinte sobrescreve)
+  def _link_or_copy(self, source):
+    last = self.last_checkpoint()
+    last_dir = None if last is None else os.path.join(self.get_checkpoint_dir(last), f"checkpoint-best-{self.eval_metric}")
+
+    def link_or_copy(src, dst):
+      if last_dir is not None:
+        stored = os.path.join(last_dir, os.path.relpath(src, source))
+
+        if os.path.isfile(stored) and filecmp.cmp(src, stored, shallow=False):
+          try:
+            os.link(stored, dst)
+            return dst
+          except OSError:
+            pass
+
+      return shutil.copy2(src, dst)
+
+    return link_or_copy
+
+  #stream: referência do stream do passo (ver get_stream_reference), ou None
+  def append_step(self, current, end, th, adjust_th=False, stream=None):
+    record = {'current': int(current), 'end': int(end), 'checkpoint': self.save_checkpoint(), 'th': th,
+              'adjust_th': bool(adjust_th), 'stream': stream}
+    os.makedirs(self.model_path, exist_ok=True)
+
+    with open(self.manifest_file, "a") as f:
+      f.write(json.dumps(record) + "\n")
+
+    return record
+
+
+#Referência do stream completo de um passo: df_project[start:end] e, no modo
+#cross-project, os commits dos outros projetos com data em
+#[cross_project_start, cross_project_end)
+def get_stream_reference(start, end, cross_project_window=None):
+  cross_project_start, cross_project_end = (None, None) if cross_project_window is None else cross_project_window
+  return {'start': int(start), 'end': int(end),
+          'cross_project_start': None if cross_project_start is None else float(cross_project_start),
+          'cross_project_end': None if cross_project_end is None else float(cross_project_end)}
+
+
+#Monta de novo o stream referenciado, como adjust_train_data fez no passo
+def build_stream(stream, df_project, project, df_features_full=None):
+  #Import local: codeflowlm.train importa este módulo
+  from codeflowlm.train import CrossProjectIndex, merge_sorted_windows
+
+  df_stream = df_project[stream['start']:stream['end']].copy()
+
+  if stream['cross_project_start'] is None:
+    return df_stream
+
+  if df_features_full is None:
+    raise ValueError("The recorded stream has cross-project data; pass df_features_full to rebuild it.")
+
+  df_others = CrossProjectIndex(df_features_full, project).window(stream['cross_project_start'], stream['cross_project_end'])
+  return merge_sorted_windows(df_stream, df_others) if not df_others.empty else df_stream
+
+
+#Passos registrados no manifesto, em ordem; um passo refeito após retomada
+#sobrescreve o registro anterior
+def read_checkpoint_manifest(model_path):
+  steps = {}
+  manifest_file = get_checkpoint_manifest_file(model_path)
+
+  if not os.path.exists(manifest_file):
+    return []
+
+  with open(manifest_file, "r") as f:
+    for line in f:
+      line = line.strip()
+
+      if line:
+        record = json.loads(line)
+        steps[record['current']] = record
+
+  return [steps[current] for current in sorted(steps)]
+
+
+#Janelas de steps agrupadas por (checkpoint, threshold), em lotes de no máximo
+#max_batch_commits commits (sem limite se None)
+def group_windows(steps, th=None, max_batch_commits=None):
+  groups = {}
+
+  for i, step in enumerate(steps):
+    key = (step['checkpoint'], step['th'] if th is None else th)
+    batches = groups.setdefault(key, [[]])
+    size = sum(steps[j]['end'] - steps[j]['current'] for j in batches[-1])
+
+    if max_batch_commits is not None and batches[-1] and size + step['end'] - step['current'] > max_batch_commits:
+      batches.append([])
+
+    batches[-1].append(i)
+
+  return [(checkpoint, group_th, batch) for (checkpoint, group_th), batches in groups.items() for batch in batches]
+
+
+def slice_predictions(predictions, start, end):
+  return {key: values[start:end] for key, values in predictions.items()}
+
+
+#Predições de uma janela sem modelo, como no loop
+def empty_predictions(df_test):
+  return {'pred_label': [0] * df_test.shape[0], 'true_label': df_test['is_buggy_commit'].to_list(),
+          'pred_prob': [0] * df_test.shape[0]}
+
+
+#Reavalia as janelas registradas no manifesto de model_path contra os seus
+#checkpoints.  df_project deve ser o mesmo do loop (e df_features_full, se o
+#stream tiver dados cross-project); th, se informado, substitui o threshold
+#registrado em cada passo.  Devolve a list_of_predictions do loop.
+def rescore_run(batch_classifier_dir, path, full_changes_train_file, full_changes_valid_file, full_changes_test_file,
+                project, df_project, model_path, th=None, eval_metric='f1', pretrained_model='codet5p-770m',
+                peft_alg='lora', batch_size=16, max_batch_commits=None, worker=None, timeout=None, artifacts=None,
+                classifier=None, df_features_full=None):
+  #Import local: codeflowlm.train importa este módulo
+  from codeflowlm.train import prepare_full_stream_data
+
+  df_project = df_project.reset_index(drop=True)
+  steps = read_checkpoint_manifest(model_path)
+
+  if not steps:
+    raise ValueError(f"No step checkpoints recorded in {model_path}; run the online loop with keep_checkpoints=True.")
+
+  adjusted = [step['current'] for step in steps if step.get('adjust_th') and step['checkpoint'] is not None]
+
+  if adjusted:
+    raise ValueError(f"Steps {adjusted[:5]} of {model_path} were tested with adjust_th=True and cannot be rescored.")
+
+  manifest = CheckpointManifest(model_path, eval_metric=eval_metric)
+  list_of_predictions = [None] * len(steps)
+  groups = group_windows(steps, th=th, max_batch_commits=max_batch_commits)
+  print(f"Rescoring {len(steps)} windows with {len(groups)} test calls...")
+
+  for checkpoint, group_th, batch in groups:
+    windows = [df_project[steps[i]['current']:steps[i]['end']] for i in batch]
+
+    if checkpoint is None:
+      for i, df_test in zip(batch, windows):
+        list_of_predictions[i] = empty_predictions(df_test)
+
+      continue
+
+    df_test = pd.concat(windows)
+    stream = steps[batch[-1]].get('stream')
+    stream_dir, stream_changes_file, stream_features_file = None, None, None
+
+    try:
+      if stream is not None and classifier is None:
+        os.makedirs(path, exist_ok=True)
+        stream_dir = tempfile.mkdtemp(prefix=f"stream_{project}_", dir=path)
+        stream_changes_file, stream_features_file = prepare_full_stream_data(
+          project, build_stream(stream, df_project, project, df_features_full=df_features_full), full_changes_train_file,
+          full_changes_valid_file, full_changes_test_file, artifacts=artifacts, run_dir=stream_dir)
+
+      print(f"Testing checkpoint {checkpoint[:12]} on {len(windows)} windows ({df_test.shape[0]} commits)...")
+      _, predictions = test(batch_classifier_dir, path, full_changes_train_file, full_changes_valid_file,
+                            full_changes_test_file, project, df_test, manifest.get_checkpoint_dir(checkpoint), th=group_th,
+                            pretrained_model=pretrained_model, calculate_metrics=False, peft_alg=peft_alg,
+                            eval_metric=eval_metric, batch_size=batch_size, stream_changes_file=stream_changes_file,
+                            stream_features_file=stream_features_file, worker=worker, timeout=timeout,
+                            artifacts=artifacts, classifier=classifier)
+    finally:
+      if stream_dir is not None:
+        shutil.rmtree(stream_dir, ignore_errors=True)
+
+    sizes = np.array([window.shape[0] for window in windows])
+    ends = np.cumsum(sizes)
+
+    for i, start, end in zip(batch, (ends - sizes).tolist(), ends.tolist()):
+      list_of_predictions[i] = slice_predictions(predictions, start, end)
+
+  return list_of_predictions
+
+
+#Reavalia a execução de train_project(): monta df_project e model_path como
+#train_project e devolve (list_of_predictions, predictions), com predictions no
+#formato devolvido por train_project.
+def rescore_project(batch_classifier_dir, path, model_root, commit_guru_path, full_features_train_file,
+                    full_features_valid_file, full_features_test_file, full_changes_train_file, full_changed_valid_file,
+                    full_changes_test_file, project, early_stop_metric="gmean", model_path=None, th=None,
+                    peft_alg="lora", start=0, end=None, pretrained_model="codet5p-770m", batch_size=16,
+                    max_batch_commits=None, use_model_worker=True, command_timeout=None, classifier=None,
+                    cross_project=False):
+  #Import local: codeflowlm.train importa este módulo
+  from codeflowlm.train import adjust_df_features_full
+
+  df_features_full = get_df_features_full(full_features_train_file, full_features_valid_file, full_features_test_file)
+  df_project = df_features_full[df_features_full['project'] == project]
+  df_project = add_first_fix_date(commit_guru_path, df_project, project)
+  #Os outros projetos, como no loop, para remontar os streams cross-project
+  df_features_full = adjust_df_features_full(commit_guru_path, cross_project, df_features_full) if cross_project else None
+
+  if not end:
+    end = df_project.shape[0]
+
+  df_project = df_project[start:end]
+
+  if not model_path:
+    model_path = model_root + pretrained_model + f"/concat/online/baseline/{project}_best_{early_stop_metric}/checkpoints"
+
+  #Um único processo para todas as chamadas de teste
+  worker = ModelWorker() if use_model_worker and classifier is None else None
+
+  try:
+    list_of_predictions = rescore_run(batch_classifier_dir, path, full_changes_train_file, full_changed_valid_file,
+                                      full_changes_test_file, project, df_project, model_path, th=th,
+                                      eval_metric=early_stop_metric, pretrained_model=pretrained_model,
+                                      peft_alg=peft_alg, batch_size=batch_size, max_batch_commits=max_batch_commits,
+                                      worker=worker, timeout=command_timeout, classifier=classifier,
+                                      df_features_full=df_features_full)
+  finally:
+    if worker is not None:
+      worker.close()
+
+  all_predictions = concatenate_predictions([prediction_arrays(predictions) for predictions in list_of_predictions])
+  predictions = {'true_labels': df_project['is_buggy_commit'].to_numpy(),
+                 'pred_labels': all_predictions['pred_labels'], 'pred_probs': all_predictions['pred_probs']}
+  return list_of_predictions, predictions
@@ -0,0 +1,109 @@
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+import pandas as pd
+
+#Executa train_project_with_lat_ver para vários projetos em paralelo, um projeto
+#por processo.  Cada projeto roda no seu próprio diretório de trabalho
+#(<work_root>/<project>, com os arquivos temporários em <work_root>/<project>/scratch)
+#e com o número de threads de BLAS/OpenMP/torch limitado, para que os processos
+#não disputem os mesmos núcleos.  Um projeto interrompido retoma na próxima
+#execução, como na execução sequencial: do seu journal de passos ou, se foi
+#interrompido antes do journal, do training_status.pickle existente (migrado
+#para o journal, ver codeflowlm.journal).
+
+THREAD_ENV_VARS = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                   'NUMEXPR_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS']
+
+
+def limit_threads(threads_per_worker):
+  #Precisa rodar antes de importar torch/numpy no processo; os subprocessos de
+  #treino/teste herdam as variáveis de ambiente.
+  for var in THREAD_ENV_VARS:
+    os.environ[var] = str(threads_per_worker)
+
+  try:
+    import torch
+    torch.set_num_threads(threads_per_worker)
+  except ImportError:
+    pass
+
+
+def absolute_prefix(path):
+  #model_root e commit_guru_path são usados como prefixo (model_root + pretrained_model),
+  #então a barra final precisa ser preservada.
+  absolute = os.path.abspath(path)
+  return absolute + os.sep if path.endswith(('/', os.sep)) else absolute
+
+
+def run_project(project, work_dir, train_args, train_kwargs):
+  from codeflowlm.train import train_project_with_lat_ver
+
+  scratch_dir = os.path.join(work_dir, 'scratch')
+  os.makedirs(scratch_dir, exist_ok=True)
+  os.chdir(work_dir)
+
+  try:
+    df, finished = train_project_with_lat_ver(train_args[0], scratch_dir, *train_args[1:], project, **train_kwargs)
+    return project, df, finished, None
+  except Exception:
+    traceback.print_exc()
+    return project, None, False, traceback.format_exc()
+
+
+def run_projects(batch_classifier_dir, work_root, model_root, commit_guru_path, full_features_train_file,
+                 full_features_valid_file, full_features_test_file, full_changes_train_file, full_changed_valid_file,
+                 full_changes_test_file, projects=None, max_workers=None, threads_per_worker=None, **kwargs):
+  from codeflowlm.train import projects_with_real_lat_ver
+
+  if projects is None:
+    projects = projects_with_real_lat_ver
+
+  cpu_count = os.cpu_count() or 1
+
+  if max_workers is None:
+    max_workers = min(len(projects), cpu_count)
+
+  if threads_per_worker is None:
+    threads_per_worker = max(1, cpu_count // max_workers)
+
+  #As datas de primeira correção (modo cross-project) usam os núcleos do projeto
+  kwargs.setdefault('first_fix_date_workers', threads_per_worker)
+
+  train_args = [os.path.abspath(batch_classifier_dir), absolute_prefix(model_root), absolute_prefix(commit_guru_path),
+                os.path.abspath(full_features_train_file), os.path.abspath(full_features_valid_file),
+                os.path.abspath(full_features_test_file), os.path.abspath(full_changes_train_file),
+                os.path.abspath(full_changed_valid_file), os.path.abspath(full_changes_test_file)]
+  work_root = os.path.abspath(work_root)
+  results = []
+  errors = {}
+
+  #spawn: cada projeto começa num processo limpo (sem threads/estado herdados do pai)
+  #e max_tasks_per_child=1 libera a memória do projeto ao terminar.
+  with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'),
+                           initializer=limit_threads, initargs=(threads_per_worker,),
+                           max_tasks_per_child=1) as executor:
+    futures = [executor.submit(run_project, project, os.path.join(work_root, project), train_args, kwargs)
+               for project in projects]
+
+    for future in as_completed(futures):
+      project, df, finished, error = future.result()
+      print(f"Project {project} done: finished = {finished}")
+
+      if error is not None:
+        errors[project] = error
+
+      if df is not None and df.shape[0] > 0:
+        df = df.assign(finished=finished)
+      else:
+        df = pd.DataFrame({'project': [project], 'finished': [finished]})
+
+      results.append(df)
+
+  df_results = pd.concat(results, ignore_index=True)
+  df_results['error'] = df_results['project'].map(errors)
+  df_results = df_results.set_index('project').loc[list(projects)].reset_index()
+  df_results.to_csv(os.path.join(work_root, 'results.csv'), index=False)
+  print(df_results)
+  return df_results
@@ -0,0 +1,98 @@
+import json
+import os
+
+#Log append-only dos passos do loop online, para depuração.  Cada passo grava
+#uma linha JSON com os limites das janelas de treino/teste em df_project e os
+#commits da janela de teste; os DataFrames de qualquer passo podem ser
+#reconstruídos a partir de df_project com rebuild_step().  Substitui os antigos
+#df_train_{project}_{current}.csv/df_test_{project}_{current}.csv.
+#
+#No modo cross-project, a janela de treino também recebe os commits dos outros
+#projetos com timestamp em [cross_project_start, cross_project_end); o registro
+#guarda esses limites e a quantidade e os extremos dos commits incluídos, e
+#rebuild_step() precisa de df_features_full para reconstruir a janela.
+
+
+def get_step_log_file(model_path, project):
+  return os.path.join(model_path, f"steps_{project}.jsonl")
+
+
+def append_step(log_file, project, current, train_start, train_end, test_end, df_project, cross_project_window=None, 
+                df_others=None):
+  commits = df_project['commit_hash']
+  record = {
+    'project': project,
+    'current': int(current),
+    'train_start': int(train_start),
+    'train_end': int(train_end),
+    'test_end': int(test_end),
+    'train_first_commit': commits.iloc[train_start] if train_end > train_start else None,
+    'train_last_commit': commits.iloc[train_end - 1] if train_end > train_start else None,
+    'test_commits': commits.iloc[train_end:test_end].tolist(),
+    'cross_project_start': None,
+    'cross_project_end': None,
+  }
+
+  if cross_project_window is not None:
+    other_commits = df_others['commit_hash'] if df_others is not None and df_others.shape[0] > 0 else None
+    record.update({
+      'cross_project_start': float(cross_project_window[0]),
+      'cross_project_end': float(cross_project_window[1]),
+      'cross_project_commits': 0 if other_commits is None else len(other_commits),
+      'cross_project_first_commit': None if other_commits is None else other_commits.iloc[0],
+      'cross_project_last_commit': None if other_commits is None else other_commits.iloc[-1],
+    })
+
+  os.makedirs(os.path.dirname(log_file) or '.', exist_ok=True)
+
+  with open(log_file, "a") as f:
+    f.write(json.dumps(record) + "\n")
+
+
+def read_steps(log_file):
+  steps = {}
+
+  if not os.path.exists(log_file):
+    return steps
+
+  with open(log_file, "r") as f:
+    for line in f:
+      line = line.strip()
+
+      if line:
+        record = json.loads(line)
+        #Um passo refeito após retomada sobrescreve o registro anterior
+        steps[record['current']] = record
+
+  return steps
+
+
+#df_features_full é obrigatório para os passos do modo cross-project
+def rebuild_step(log_file, df_project, current, df_features_full=None):
+  from codeflowlm.train import CrossProjectIndex, merge_sorted_windows
+
+  record = read_steps(log_file)[current]
+  df_project = df_project.reset_index(drop=True)
+  df_train = df_project[record['train_start']:record['train_end']].copy()
+  df_test = df_project[record['train_end']:record['test_end']].copy()
+
+  if df_train.shape[0] > 0:
+    assert df_train['commit_hash'].iloc[0] == record['train_first_commit']
+    assert df_train['commit_hash'].iloc[-1] == record['train_last_commit']
+
+  assert df_test['commit_hash'].tolist() == record['test_commits']
+
+  if record.get('cross_project_start') is not None:
+    if df_features_full is None:
+      raise ValueError(f"Step {current} merged cross-project data; pass df_features_full to rebuild it.")
+
+    df_others = CrossProjectIndex(df_features_full, record['project']).window(record['cross_project_start'], 
+                                                                              record['cross_project_end'])
+    assert df_others.shape[0] == record['cross_project_commits']
+
+    if df_others.shape[0] > 0:
+      assert df_others['commit_hash'].iloc[0] == record['cross_project_first_commit']
+      assert df_others['commit_hash'].iloc[-1] == record['cross_project_last_commit']
+      df_train = merge_sorted_windows(df_train, df_others)
+
+  return df_train, df_test
@@ -1,28 +1,43 @@
 from codeflowlm.data import get_changes_from_features
-from codeflowlm.train import execute_command
+from codeflowlm.command import CommandError, execute_command
+from codeflowlm.trace import trace_phase
+import numpy as np
 import pickle
 import os
 import shlex
+import shutil
+import tempfile
 
 def test(batch_classifier_dir, path, full_changes_train_file, full_changed_valid_file, full_changes_test_file, project, features_test, model_path, th, pretrained_model, 
-         calculate_metrics=True, peft_alg="lora", eval_metric='f1', batch_size=16, stream_changes_file=None, stream_features_file=None, adjust_th=False):
-  changes_test = get_changes_from_features(full_changes_train_file, full_changed_valid_file, full_changes_test_file, features_test, do_test=True)
-  with open(f"{path}/changes_test_online_{project}.pkl", "wb") as f:
-    pickle.dump(changes_test, f)
+         calculate_metrics=True, peft_alg="lora", eval_metric='f1', batch_size=16, stream_changes_file=None, stream_features_file=None, adjust_th=False,
+         worker=None, timeout=None, artifacts=None, classifier=None, tracer=None):
+  #Com um Classifier (codeflowlm.classifier), o teste é feito no próprio processo
+  if classifier is not None:
+    print(f"Testing {type(classifier).__name__} with recent data with th = {th}...")
 
-  with open(f"{path}/features_test_online_{project}.pkl", "wb") as f:
-    pickle.dump(features_test, f)
+    with trace_phase(tracer, 'test'):
+      return classifier.test(features_test, model_path, th=th, eval_metric=eval_metric, calculate_metrics=calculate_metrics)
+
+  #Cada chamada usa um diretório de trabalho próprio, que é também o cwd do
+  #processo de teste: execuções simultâneas não sobrescrevem os arquivos umas das
+  #outras.
+  os.makedirs(path, exist_ok=True)
+  run_dir = tempfile.mkdtemp(prefix=f"test_{project}_", dir=path)
+
+  with trace_phase(tracer, 'prepare_test_data'):
+    write_test_data(run_dir, full_changes_train_file, full_changed_valid_file, full_changes_test_file, project, 
+                    features_test, artifacts=artifacts)
 
   print(f"Testing with recent data with th = {th}...")
 
   print("PEFT algorithm: ", peft_alg)
   
   if peft_alg == "lora":
-    command = get_lora_command(batch_classifier_dir, path, project, model_path, th, pretrained_model, eval_metric, 
+    command = get_lora_command(batch_classifier_dir, run_dir, project, model_path, th, pretrained_model, eval_metric, 
                                batch_size, stream_changes_file=stream_changes_file, stream_features_file=stream_features_file)
     command += " --use_lora"
   else:
-    command = get_pret_command(batch_classifier_dir, path, project, model_path, th, pretrained_model, eval_metric, batch_size, 
+    command = get_pret_command(batch_classifier_dir, run_dir, project, model_path, th, pretrained_model, eval_metric, batch_size, 
                                stream_changes_file=stream_changes_file, stream_features_file=stream_features_file)
   if pretrained_model == 'codet5p-770m':
     command += " --hidden_size 1024"
@@ -33,40 +48,85 @@ def test(batch_classifier_dir, path, full_changes_train_file, full_changed_valid
   if adjust_th:
     command += " --update_threshold"
 
-  execute_command(command)
+  try:
+    with trace_phase(tracer, 'test'):
+      returncode = execute_command(command, worker=worker, timeout=timeout, cwd=run_dir)
 
-  results = None
+    if returncode != 0:
+      raise CommandError(command, returncode)
 
-  if os.path.exists("results.pkl"):
-    with open(f"results.pkl", "rb") as f:
-      results = pickle.load(f)
+    results, predictions = read_test_outputs(run_dir)
+  finally:
+    shutil.rmtree(run_dir, ignore_errors=True)
+
+  return results, predictions
 
-    os.remove("results.pkl")
+def write_test_data(run_dir, full_changes_train_file, full_changed_valid_file, full_changes_test_file, project, 
+                    features_test, artifacts=None):
+  #Com artifacts (TrainingArtifacts), os arquivos de teste são manifestos
+  if artifacts is not None:
+    artifacts.write(f"{run_dir}/changes_test_online_{project}.pkl", f"{run_dir}/features_test_online_{project}.pkl", features_test)
+    return
 
-  with open(f"predictions.pkl", "rb") as f:
-    predictions = pickle.load(f)
+  changes_test = get_changes_from_features(full_changes_train_file, full_changed_valid_file, full_changes_test_file, features_test, do_test=True)
+
+  with open(f"{run_dir}/changes_test_online_{project}.pkl", "wb") as f:
+    pickle.dump(changes_test, f)
 
-  os.remove("predictions.pkl")
+  with open(f"{run_dir}/features_test_online_{project}.pkl", "wb") as f:
+    pickle.dump(features_test, f)
+
+#Converte cada lista de predictions (pred_label, true_label, pred_prob) para um
+#array NumPy; listas irregulares ficam como estão.
+def to_typed_predictions(predictions):
+  typed = {}
+
+  for key, values in predictions.items():
+    try:
+      typed[key] = np.asarray(values)
+    except ValueError:
+      typed[key] = values
+
+    if isinstance(typed[key], np.ndarray) and typed[key].dtype == object:
+      typed[key] = values
+
+  return typed
+
+#Lê as saídas do processo de teste no seu diretório de trabalho: predictions.npz
+#(arrays tipados) se existir, senão predictions.pkl; e results.pkl, se houver.
+def read_test_outputs(run_dir):
+  results = None
+
+  if os.path.exists(os.path.join(run_dir, "results.pkl")):
+    with open(os.path.join(run_dir, "results.pkl"), "rb") as f:
+      results = pickle.load(f)
+
+  if os.path.exists(os.path.join(run_dir, "predictions.npz")):
+    with np.load(os.path.join(run_dir, "predictions.npz"), allow_pickle=False) as npz:
+      predictions = {key: npz[key] for key in npz.files}
+  else:
+    with open(os.path.join(run_dir, "predictions.pkl"), "rb") as f:
+      predictions = to_typed_predictions(pickle.load(f))
 
   return results, predictions
 
 def get_pret_command(batch_classifier_dir, path, project, model_path, th,pretrained_model, eval_metric, batch_size, stream_changes_file=None, stream_features_file=None):
   command = [
     "python",
-    os.path.join(batch_classifier_dir, "PEFT4CC/just-in-time/run_peft.py"),
+    os.path.abspath(os.path.join(batch_classifier_dir, "PEFT4CC/just-in-time/run_peft.py")),
     "--pretrained_model", str(pretrained_model),
     "--method", "prefix",
     "--structure", "concat",
-    "--test_data_file", f"{path}/changes_test_online_{project}.pkl", f"{path}/features_test_online_{project}.pkl",
+    "--test_data_file", os.path.abspath(f"{path}/changes_test_online_{project}.pkl"), os.path.abspath(f"{path}/features_test_online_{project}.pkl"),
   ]
 
   if stream_changes_file is not None and stream_features_file is not None:
     command.extend([
-      "--stream_data_file", str(stream_changes_file), str(stream_features_file)
+      "--stream_data_file", os.path.abspath(stream_changes_file), os.path.abspath(stream_features_file)
     ])
     
   command.extend([
-    "--output_dir", str(model_path),
+    "--output_dir", os.path.abspath(model_path),
     "--batch_size", str(batch_size),
     "--do_test",
     "--threshold", str(th),
@@ -78,17 +138,17 @@ def get_pret_command(batch_classifier_dir, path, project, model_path, th,pretrai
 def get_lora_command(batch_classifier_dir, path, project, model_path, th, pretrained_model, eval_metric, batch_size, stream_changes_file=None, stream_features_file=None):
   command = [
     "python",
-    os.path.join(batch_classifier_dir, "PEFT4CC/just-in-time/run_lora.py"),
-    "--test_data_file", f"{path}/changes_test_online_{project}.pkl", f"{path}/features_test_online_{project}.pkl",
+    os.path.abspath(os.path.join(batch_classifier_dir, "PEFT4CC/just-in-time/run_lora.py")),
+    "--test_data_file", os.path.abspath(f"{path}/changes_test_online_{project}.pkl"), os.path.abspath(f"{path}/features_test_online_{project}.pkl"),
   ]
     
   if stream_changes_file is not None and stream_features_file is not None:
     command.extend([
-      "--stream_data_file", str(stream_changes_file), str(stream_features_file)
+      "--stream_data_file", os.path.abspath(stream_changes_file), os.path.abspath(stream_features_file)
     ])
 
   command.extend([
-    "--output_dir", str(model_path),
+    "--output_dir", os.path.abspath(model_path),
     "--pretrained_model", str(pretrained_model),
     "--batch_size", str(batch_size),
     "--do_test",
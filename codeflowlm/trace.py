@@ -0,0 +1,276 @@
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+#Instrumentação por fase dos passos do loop online.  Cada passo grava uma linha
+#JSON em <model_path>/trace_<project>.jsonl com, para cada fase (adjust_train_data,
+#prepare_train_data, prepare_full_stream_data, prepare_training_data, train,
+#prepare_test_data, test, checkpoint):
+#
+#  - duração;
+#  - bytes lidos/escritos (/proc/self/io: rchar/wchar, aos quais o Linux soma os
+#    dos subprocessos de treino/teste encerrados na fase) e bytes lidos/escritos
+#    em disco pelos subprocessos (getrusage(RUSAGE_CHILDREN));
+#  - RSS no fim da fase e pico de RSS durante a fase (no Linux, VmHWM é zerado no
+#    início de cada fase);
+#  - pico do tracemalloc durante a fase, se trace_malloc=True (o tracemalloc
+#    deixa o processo bem mais lento: as durações ficam infladas).
+#
+#e os tamanhos do training pool, training queue e buggy pool no fim do passo.
+#Com chrome_trace=True as fases também vão para trace_<project>.chrome.json
+#(formato de array do Chrome Trace, aberto em chrome://tracing ou no Perfetto).
+#
+#O tracer é passado ao loop como o PrequentialTracker (step_tracer=StepTracer());
+#train_project imprime o resumo ao final.  Os jobs executados pelo ModelWorker
+#não aparecem nos contadores de subprocessos, já que o worker não termina.
+
+PHASES = ['adjust_train_data', 'prepare_train_data', 'prepare_full_stream_data', 'prepare_training_data', 'train',
+          'prepare_test_data', 'test', 'checkpoint']
+
+
+def get_trace_file(model_path, project):
+  return os.path.join(model_path, f"trace_{project}.jsonl")
+
+
+def get_chrome_trace_file(model_path, project):
+  return os.path.join(model_path, f"trace_{project}.chrome.json")
+
+
+def read_io_counters():
+  try:
+    with open('/proc/self/io', 'r') as f:
+      counters = dict(line.split(':') for line in f if ':' in line)
+
+    return int(counters['rchar']), int(counters['wchar'])
+  except (OSError, KeyError, ValueError):
+    return None, None
+
+
+def read_children_io_bytes():
+  usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+  return usage.ru_inblock * 512, usage.ru_oublock * 512
+
+
+#Pico de RSS do processo.  No Linux, reset_peak_rss() zera o pico (VmHWM), de
+#forma que get_peak_rss_mb() devolve o pico desde então; nos demais sistemas é o
+#pico desde o início do processo.
+def reset_peak_rss():
+  try:
+    with open('/proc/self/clear_refs', 'w') as f:
+      f.write('5')
+  except OSError:
+    pass
+
+
+def read_status_mb(field):
+  try:
+    with open('/proc/self/status', 'r') as f:
+      for line in f:
+        if line.startswith(field + ':'):
+          return int(line.split()[1]) / 1024
+  except OSError:
+    pass
+
+  return None
+
+
+def get_peak_rss_mb():
+  peak = read_status_mb('VmHWM')
+
+  if peak is not None:
+    return peak
+
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def get_rss_mb():
+  rss = read_status_mb('VmRSS')
+  return rss if rss is not None else get_peak_rss_mb()
+
+
+def difference(end, start):
+  return end - start if end is not None and start is not None else None
+
+
+#Fase medida com o tracer, ou sem medição se tracer for None
+def trace_phase(tracer, name):
+  return tracer.phase(name) if tracer is not None else nullcontext()
+
+
+class StepTracer:
+  def __init__(self, chrome_trace=False, trace_malloc=False):
+    self.chrome_trace = chrome_trace
+    self.trace_malloc = trace_malloc
+    self.trace_file = None
+    self.chrome_trace_file = None
+    self.step = None
+    self.phases = {}
+    self._origin = time.perf_counter()
+
+  #Chamado pelo loop online, que conhece model_path e o projeto
+  def open(self, model_path, project):
+    os.makedirs(model_path, exist_ok=True)
+    self.trace_file = get_trace_file(model_path, project)
+
+    if self.chrome_trace:
+      self.chrome_trace_file = get_chrome_trace_file(model_path, project)
+
+      #O formato de array do Chrome Trace aceita o array sem o ']' final, de forma
+      #que os eventos podem ser acrescentados a cada passo (inclusive ao retomar)
+      if not os.path.exists(self.chrome_trace_file):
+        with open(self.chrome_trace_file, "w") as f:
+          f.write("[\n")
+
+    if self.trace_malloc and not tracemalloc.is_tracing():
+      tracemalloc.start()
+
+  def start_step(self, current):
+    self.step = int(current)
+    self.phases = {}
+    self._step_start = time.perf_counter()
+
+  @contextmanager
+  def phase(self, name):
+    read_start, write_start = read_io_counters()
+    children_read_start, children_write_start = read_children_io_bytes()
+    reset_peak_rss()
+
+    if self.trace_malloc and tracemalloc.is_tracing():
+      tracemalloc.reset_peak()
+
+    start = time.perf_counter()
+
+    try:
+      yield
+    finally:
+      duration = time.perf_counter() - start
+      read_end, write_end = read_io_counters()
+      children_read_end, children_write_end = read_children_io_bytes()
+      record = {'duration': duration, 'read_bytes': difference(read_end, read_start),
+                'write_bytes': difference(write_end, write_start),
+                'children_read_bytes': children_read_end - children_read_start,
+                'children_write_bytes': children_write_end - children_write_start,
+                'rss_mb': get_rss_mb(), 'peak_rss_mb': get_peak_rss_mb(), 'tracemalloc_peak_mb': None}
+
+      if self.trace_malloc and tracemalloc.is_tracing():
+        record['tracemalloc_peak_mb'] = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+
+      self.add_phase(name, record, start)
+
+  #Uma fase repetida no mesmo passo acumula as durações e os bytes
+  def add_phase(self, name, record, start):
+    if self.chrome_trace_file is not None:
+      event = {'name': name, 'cat': 'step', 'ph': 'X', 'pid': os.getpid(), 'tid': 0,
+               'ts': (start - self._origin) * 1e6, 'dur': record['duration'] * 1e6, 'args': {'step': self.step}}
+
+      with open(self.chrome_trace_file, "a") as f:
+        f.write(json.dumps(event) + ",\n")
+
+    previous = self.phases.get(name)
+
+    if previous is not None:
+      for key in ('duration', 'read_bytes', 'write_bytes', 'children_read_bytes', 'children_write_bytes'):
+        if record[key] is not None and previous[key] is not None:
+          record[key] += previous[key]
+
+      for key in ('peak_rss_mb', 'tracemalloc_peak_mb'):
+        if previous[key] is not None:
+          record[key] = max(record[key] or 0, previous[key])
+
+    self.phases[name] = record
+
+  def end_step(self, training_pool, training_queue, buggy_pool):
+    if self.trace_file is None or self.step is None:
+      return
+
+    record = {'step': self.step, 'duration': time.perf_counter() - self._step_start, 'phases': self.phases,
+              'training_pool': len(training_pool), 'training_queue': len(training_queue),
+              'buggy_pool': len(buggy_pool), 'rss_mb': get_rss_mb()}
+
+    with open(self.trace_file, "a") as f:
+      f.write(json.dumps(record) + "\n")
+
+    self.step = None
+
+  def print_summary(self):
+    if self.trace_file is not None:
+      print_trace_summary(self.trace_file)
+
+
+def read_trace(trace_file):
+  steps = {}
+
+  if not os.path.exists(trace_file):
+    return steps
+
+  with open(trace_file, "r") as f:
+    for line in f:
+      line = line.strip()
+
+      if line:
+        record = json.loads(line)
+        #Um passo refeito após retomada sobrescreve o registro anterior
+        steps[record['step']] = record
+
+  return steps
+
+
+#Totais por fase de todos os passos do trace: tempo total/médio/máximo, fração
+#do tempo dos passos, bytes lidos/escritos e picos de memória.
+def summarize_trace(trace_file):
+  steps = read_trace(trace_file)
+  total_duration = sum(step['duration'] for step in steps.values())
+  names = PHASES + sorted({name for step in steps.values() for name in step['phases']} - set(PHASES))
+  rows = []
+
+  for name in names:
+    records = [step['phases'][name] for step in steps.values() if name in step['phases']]
+
+    if not records:
+      continue
+
+    durations = [record['duration'] for record in records]
+    rows.append({
+      'phase': name,
+      'steps': len(records),
+      'total_s': sum(durations),
+      'mean_s': sum(durations) / len(durations),
+      'max_s': max(durations),
+      'share': sum(durations) / total_duration if total_duration > 0 else 0.0,
+      'read_mb': sum(record['read_bytes'] or 0 for record in records) / (1024 * 1024),
+      'write_mb': sum(record['write_bytes'] or 0 for record in records) / (1024 * 1024),
+      'children_io_mb': sum(record['children_read_bytes'] + record['children_write_bytes'] for record in records) / (1024 * 1024),
+      'peak_rss_mb': max(record['peak_rss_mb'] or 0 for record in records),
+      'tracemalloc_peak_mb': max((record['tracemalloc_peak_mb'] for record in records
+                                  if record['tracemalloc_peak_mb'] is not None), default=None),
+    })
+
+  return rows, len(steps), total_duration
+
+
+def print_trace_summary(trace_file):
+  rows, n_steps, total_duration = summarize_trace(trace_file)
+  print(f"Step trace {trace_file}: {n_steps} steps, {total_duration:.1f}s")
+
+  if not rows:
+    return
+
+  header = ['phase', 'steps', 'total_s', 'mean_s', 'max_s', 'share', 'read_mb', 'write_mb', 'children_io_mb',
+            'peak_rss_mb', 'tracemalloc_peak_mb']
+  lines = [header]
+
+  for row in rows:
+    lines.append([row['phase'], str(row['steps']), f"{row['total_s']:.3f}", f"{row['mean_s']:.4f}",
+                  f"{row['max_s']:.4f}", f"{100 * row['share']:.1f}%", f"{row['read_mb']:.1f}",
+                  f"{row['write_mb']:.1f}", f"{row['children_io_mb']:.1f}", f"{row['peak_rss_mb']:.0f}",
+                  f"{row['tracemalloc_peak_mb']:.1f}" if row['tracemalloc_peak_mb'] is not None else '-'])
+
+  widths = [max(len(line[i]) for line in lines) for i in range(len(header))]
+
+  for line in lines:
+    print('  '.join(value.ljust(width) for value, width in zip(line, widths)))
@@ -1,4 +1,6 @@
+import numpy as np
 import pandas as pd
+import json
 import pickle
 import os
 import shlex
@@ -6,12 +8,22 @@ from datetime import datetime
 import time
 import traceback
 import shutil
-from codeflowlm.command import execute_command
-from codeflowlm.data import get_ord_cross_changes_full, get_df_features_full
-from codeflowlm.latency_verification import add_first_fix_date, do_latency_verification, do_real_latency_verification, process_buggy_commit
-from codeflowlm.prequential_metrics import calculate_prequential_mean_and_std
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from codeflowlm.command import CommandError, execute_command
+from codeflowlm.data import ChangeStore, gather_changes, get_df_features_full
+from codeflowlm.journal import StepJournal, read_journal_predictions
+from codeflowlm.manifest import TrainingArtifacts
+from codeflowlm.replay import CheckpointManifest, get_stream_reference
+from codeflowlm.trace import trace_phase
+from codeflowlm.training_runs import TrainingRuns, cached_file_digest
+from codeflowlm.latency_verification import BuggyPool, CommitStore, LabelTimeline, TrainingPool, TrainingQueue, add_first_fix_date, add_first_fix_date_cached, process_window, read_first_fix_date_cache
+from codeflowlm.prequential_metrics import PrequentialTracker, calculate_prequential_mean_and_std
 from codeflowlm.plots import plot
+from codeflowlm.step_log import append_step, get_step_log_file
 from codeflowlm.test import test
+from codeflowlm.worker import ModelWorker
 
 USE_FULL_STREAM_FOR_TRAINING = True
 
@@ -31,96 +43,45 @@ batches = []
 #pool.
 def prepare_train_data(df_train, training_pool, training_queue,
                        map_commit_to_row, buggy_pool, do_real_lat_ver=False):
-  last_timestamp = 0
-
-  for _, row in df_train.iterrows():
-    assert row['author_date_unix_timestamp'] >= last_timestamp
-    last_timestamp = row['author_date_unix_timestamp']
-
-    if row['is_buggy_commit'] == 1:
-      if do_real_lat_ver:
-        process_buggy_commit(row, training_queue, map_commit_to_row, buggy_pool)
-      else:
-        training_pool.append(row)
-    else:
-      training_queue.append((row['commit_hash'], row['author_date_unix_timestamp']))
-      map_commit_to_row[row['commit_hash']] = row
-
-    if do_real_lat_ver:
-      do_real_latency_verification(row, training_pool, training_queue,
-                                  map_commit_to_row, buggy_pool)
-    else:
-      do_latency_verification(row, training_pool, training_queue,
-                            map_commit_to_row)
-
-  return last_timestamp
+  return process_window(df_train, training_pool, training_queue, map_commit_to_row,
+                        buggy_pool, do_real_lat_ver=do_real_lat_ver)
 
 def is_valid_training_data(training_pool):
-  df = pd.DataFrame(training_pool)
-
   #Mudança 27/06/2025 -> relaxando restrição para split de validação
   #07/07/2025: pelo menos um exemplo positivo e um exemplo negativo
-  return df.shape[0] > 0 and df['is_buggy_commit'].sum() >= 1 and df['is_buggy_commit'].sum() < df.shape[0]
+  return training_pool.positives >= 1 and training_pool.negatives >= 1
 
-def prepare_full_stream_data(project, df_stream, full_changes_train_file, full_changed_valid_file, full_changes_test_file):
+def prepare_full_stream_data(project, df_stream, full_changes_train_file, full_changed_valid_file, full_changes_test_file, 
+                             artifacts=None, run_dir='.'):
   #Prepara os arquivos de mudanças e features para o stream completo, ou seja, sem dividir em treino/val/test.  Será usado para treinar o modelo com o stream completo, sem divisão prévia entre treino/val/test.
-  commits = []
-  labels = []
-  commit_messages = []
-  codes = []
-  
-  ord_cross_changes_full = get_ord_cross_changes_full(full_changes_train_file, full_changed_valid_file, full_changes_test_file)
-
-  for _, row in df_stream.iterrows():
-    commit_id = row['commit_hash']
-    idx = ord_cross_changes_full[0].index(commit_id)
-    label = row['is_buggy_commit']
-    commit_message = ord_cross_changes_full[2][idx]
-    code = ord_cross_changes_full[3][idx]
-    commits.append(commit_id)
-    labels.append(label)
-    commit_messages.append(commit_message)
-    codes.append(code)
+  #Os arquivos são gravados em run_dir.  Com artifacts (TrainingArtifacts), são manifestos que referenciam os corpora.
+  changes_full_file = os.path.join(run_dir, f"changes_full_{project}.pkl")
+  features_full_file = os.path.join(run_dir, f"features_full_{project}.pkl")
 
-  assert len(commits) == len(labels) == len(commit_messages) == len(codes) == df_stream.shape[0]
+  if artifacts is not None:
+    return artifacts.write(changes_full_file, features_full_file, df_stream)
 
-  changes_full = (commits, labels, commit_messages, codes)
+  change_store = ChangeStore.open(full_changes_train_file, full_changed_valid_file, full_changes_test_file)
+  changes_full = gather_changes(change_store, df_stream)
 
-  with open(f"changes_full_{project}.pkl", "wb") as f:
+  with open(changes_full_file, "wb") as f:
     pickle.dump(changes_full, f)
 
-  with open(f"features_full_{project}.pkl", "wb") as f:
+  with open(features_full_file, "wb") as f:
     pickle.dump(df_stream, f)
 
-  return f"changes_full_{project}.pkl", f"features_full_{project}.pkl"
+  return changes_full_file, features_full_file
 
-#Mudança 12/08/2025: Setei do_eval_with_all_negative=True para que a validação seja feita com a loss de validação caso não haja exemplo
-#de validação positivo
-def prepare_training_data(path, full_changes_train_file, full_changed_valid_file, full_changes_test_file, project, df, 
-                          do_eval_with_all_negative=True):
+#Divisão treino/validação de df (o training pool): devolve df com o índice
+#original na coluna index e as posições das linhas de cada split.
+def split_training_data(df, do_eval_with_all_negative=True):
   if 'first_fix_date' in df.columns and 'fixes' in df.columns:
     df = df.drop(columns=['first_fix_date', 'fixes'])
 
   df = df.reset_index()
-  commits = []
-  labels = []
-  commit_messages = []
-  codes = []
-  
-  ord_cross_changes_full = get_ord_cross_changes_full(full_changes_train_file, full_changed_valid_file, full_changes_test_file)
-
-  for _, row in df.iterrows():
-    commit_id = row['commit_hash']
-    idx = ord_cross_changes_full[0].index(commit_id)
-    label = row['is_buggy_commit']
-    commit_message = ord_cross_changes_full[2][idx]
-    code = ord_cross_changes_full[3][idx]
-    commits.append(commit_id)
-    labels.append(label)
-    commit_messages.append(commit_message)
-    codes.append(code)
-
-  assert len(commits) == len(labels) == len(commit_messages) == len(codes) == df.shape[0]
+  #A divisão treino/validação é feita sobre as posições das linhas de df; as
+  #mudanças de cada split são buscadas depois
+  rows = np.arange(df.shape[0])
   train_size = int(0.9 * df.shape[0])
   print("Training size = ", train_size)
   val_size = df.shape[0] - train_size
@@ -136,6 +97,8 @@ def prepare_training_data(path, full_changes_train_file, full_changed_valid_file
   print("Validation bug ratio = ", val_bug_ratio)
 
   print("df['is_buggy_commit'].sum() = ", df['is_buggy_commit'].sum())
+  train_rows = rows[:train_size]
+  val_rows = rows[train_size:]
 
   if df['is_buggy_commit'].sum() >= 2 and (train_bug_ratio == 0 or val_bug_ratio == 0):
     #Muda a divisão dos dados de forma que o conjuntp de validação contenha ao menos o último exemplo positivo
@@ -143,21 +106,10 @@ def prepare_training_data(path, full_changes_train_file, full_changed_valid_file
     indices = df[condition].index.tolist()
     val_start = indices[-1]
     val_end = val_start + val_size
-    train_df = pd.concat([df.iloc[:val_start], df.iloc[val_end:]])
-    val_df = df.iloc[val_start:val_end]
-
-    train_commits = commits[:val_start] + commits[val_end:]
-    train_labels = labels[:val_start] + labels[val_end:]
-    train_commit_messages = commit_messages[:val_start] + commit_messages[val_end:]
-    train_codes = codes[:val_start] + codes[val_end:]
-    val_commits = commits[val_start:val_end]
-    val_labels = labels[val_start:val_end]
-    val_commit_messages = commit_messages[val_start:val_end]
-    val_codes = codes[val_start:val_end]
-    assert train_df.shape[0] == len(train_commits) == len(train_labels) == len(train_commit_messages) == len(train_codes)
-    assert val_df.shape[0] == len(val_commits) == len(val_labels) == len(val_commit_messages) == len(val_codes)
-    changes_train = (train_commits, train_labels, train_commit_messages, train_codes)
-    changes_valid = (val_commits, val_labels, val_commit_messages, val_codes)
+    train_rows = np.concatenate([rows[:val_start], rows[val_end:]])
+    val_rows = rows[val_start:val_end]
+    train_df = df.iloc[train_rows]
+    val_df = df.iloc[val_rows]
 
     train_bug_ratio = train_df["is_buggy_commit"].sum()/train_df.shape[0]
     print("Adjusted training bug ratio = ", train_bug_ratio)
@@ -181,8 +133,10 @@ def prepare_training_data(path, full_changes_train_file, full_changed_valid_file
     if indices[0] >= train_size:
       train_size = indices[0] + 1
 
-    train_df = df.iloc[:train_size]
-    val_df = df.iloc[train_size:]
+    train_rows = rows[:train_size]
+    val_rows = rows[train_size:]
+    train_df = df.iloc[train_rows]
+    val_df = df.iloc[val_rows]
 
     train_bug_ratio = train_df["is_buggy_commit"].sum()/train_df.shape[0]
     print("Adjusted training bug ratio = ", train_bug_ratio)
@@ -193,88 +147,146 @@ def prepare_training_data(path, full_changes_train_file, full_changed_valid_file
     val_clean_ratio = val_df[val_df["is_buggy_commit"] == 0]["is_buggy_commit"].count()/val_df.shape[0]
     print("Adjusted validation clean ratio = ", val_clean_ratio)
 
-    train_commits = commits[:train_size]
-    train_labels = labels[:train_size]
-    train_commit_messages = commit_messages[:train_size]
-    train_codes = codes[:train_size]
-    val_commits = commits[train_size:]
-    val_labels = labels[train_size:]
-    val_commit_messages = commit_messages[train_size:]
-    val_codes = codes[train_size:]
-    assert train_df.shape[0] == len(train_commits) == len(train_labels) == len(train_commit_messages) == len(train_codes)
-    assert val_df.shape[0] == len(val_commits) == len(val_labels) == len(val_commit_messages) == len(val_codes)
-    changes_train = (train_commits, train_labels, train_commit_messages, train_codes)
-    changes_valid = (val_commits, val_labels, val_commit_messages, val_codes)
-
   elif df['is_buggy_commit'].sum() == 1 and val_bug_ratio == 0 and not do_eval_with_all_negative:
       #Mudança 06/07 -> flag do_eval_with_all_negative, que indica se deve fazer validação mesmo sem nenhum exemplo de validação positivo.
       #Caso seja igual a false, não faz validação, ou seja, seta o split de validação para ser igual ao split de treino.
       print("Not enough positive samples for validation -> using same split for training...")
-      train_df = val_df = df
-      train_commits = val_commits = commits
-      train_labels = val_labels = labels
-      train_commit_messages = val_commit_messages = commit_messages
-      train_codes = val_codes = codes
-      assert train_df.shape[0] == len(train_commits) == len(train_labels) == len(train_commit_messages) == len(train_codes)
-      assert val_df.shape[0] == len(val_commits) == len(val_labels) == len(val_commit_messages) == len(val_codes)
-      changes_train = (train_commits, train_labels, train_commit_messages, train_codes)
-      changes_valid = (val_commits, val_labels, val_commit_messages, val_codes)
+      train_rows = val_rows = rows
 
-  else:
-    train_commits = commits[:train_size]
-    train_labels = labels[:train_size]
-    train_commit_messages = commit_messages[:train_size]
-    train_codes = codes[:train_size]
-    val_commits = commits[train_size:]
-    val_labels = labels[train_size:]
-    val_commit_messages = commit_messages[train_size:]
-    val_codes = codes[train_size:]
-    assert train_df.shape[0] == len(train_commits) == len(train_labels) == len(train_commit_messages) == len(train_codes)
-    assert val_df.shape[0] == len(val_commits) == len(val_labels) == len(val_commit_messages) == len(val_codes)
-    changes_train = (train_commits, train_labels, train_commit_messages, train_codes)
-    changes_valid = (val_commits, val_labels, val_commit_messages, val_codes)
-
-  with open(f"{path}/changes_train_online_{project}.pkl", "wb") as f:
+  return df, train_rows, val_rows
+
+#Mudança 12/08/2025: Setei do_eval_with_all_negative=True para que a validação seja feita com a loss de validação caso não haja exemplo
+#de validação positivo
+def prepare_training_data(path, full_changes_train_file, full_changed_valid_file, full_changes_test_file, project, df, 
+                          do_eval_with_all_negative=True, artifacts=None, split=None):
+  #split: resultado de split_training_data(df), se já calculado
+  if split is None:
+    split = split_training_data(df, do_eval_with_all_negative=do_eval_with_all_negative)
+
+  df, train_rows, val_rows = split
+  train_df = df.iloc[train_rows]
+  val_df = df.iloc[val_rows]
+
+  os.makedirs(path, exist_ok=True)
+  changes_train_file = f"{path}/changes_train_online_{project}.pkl"
+  features_train_file = f"{path}/features_train_online_{project}.pkl"
+  changes_valid_file = f"{path}/changes_valid_online_{project}.pkl"
+  features_valid_file = f"{path}/features_valid_online_{project}.pkl"
+
+  if artifacts is not None:
+    artifacts.write(changes_train_file, features_train_file, train_df)
+    artifacts.write(changes_valid_file, features_valid_file, val_df)
+    return changes_train_file, features_train_file, changes_valid_file, features_valid_file
+
+  change_store = ChangeStore.open(full_changes_train_file, full_changed_valid_file, full_changes_test_file)
+  changes = gather_changes(change_store, df)
+  changes_train = tuple([values[i] for i in train_rows] for values in changes)
+  changes_valid = tuple([values[i] for i in val_rows] for values in changes)
+  assert train_df.shape[0] == len(changes_train[0]) and val_df.shape[0] == len(changes_valid[0])
+
+  with open(changes_train_file, "wb") as f:
     pickle.dump(changes_train, f)
 
-  with open(f"{path}/changes_valid_online_{project}.pkl", "wb") as f:
+  with open(changes_valid_file, "wb") as f:
     pickle.dump(changes_valid, f)
 
-  with open(f"{path}/features_train_online_{project}.pkl", "wb") as f:
+  with open(features_train_file, "wb") as f:
     pickle.dump(train_df, f)
 
-  with open(f"{path}/features_valid_online_{project}.pkl", "wb") as f:
+  with open(features_valid_file, "wb") as f:
     pickle.dump(val_df, f)
 
-  return f"{path}/changes_train_online_{project}.pkl", f"{path}/features_train_online_{project}.pkl", f"{path}/changes_valid_online_{project}.pkl", f"{path}/features_valid_online_{project}.pkl"
+  return changes_train_file, features_train_file, changes_valid_file, features_valid_file
 
 def add_to_cumulative_training_pool(row, global_training_pool):
-  for training_example in global_training_pool:
-    if training_example['commit_hash'] == row['commit_hash']:
-      training_example['is_buggy_commit'] = row['is_buggy_commit']
-      return
-
-  global_training_pool.append(row)
+  record_id = global_training_pool.store.register(row.to_frame().T)[0]
+  global_training_pool.add(record_id, overwrite_label=True)
+
+class TrainingError(Exception):
+  def __init__(self, message, training_status=None):
+    self.training_status = training_status
+    super().__init__(message)
+
+#Status estruturado do processo de treino: exit code mais o status escrito pelo
+#script, lido uma única vez depois que o processo termina.  training_status.json
+#({"status": ..., "changed": ...}) tem precedência sobre o training_status.txt
+#("changed" quando o modelo mudou).
+def read_training_status(model_path, returncode):
+  training_status = {'returncode': returncode, 'status': None, 'changed': False}
+  json_file = os.path.join(model_path, "training_status.json")
+  txt_file = os.path.join(model_path, "training_status.txt")
+
+  if os.path.exists(json_file):
+    with open(json_file, "r") as file:
+      reported = json.load(file)
+
+    training_status['status'] = reported.get('status', 'reported')
+    training_status['changed'] = bool(reported.get('changed', training_status['status'] == 'changed'))
+  elif os.path.exists(txt_file):
+    with open(txt_file, "r") as file:
+      training_status['status'] = file.read()
+
+    training_status['changed'] = training_status['status'] == 'changed'
+
+  print("Training status = ", training_status)
+  return training_status
 
 #peft_alg="pret"|"lora"
 def train(batch_classifier_dir, path, full_changes_train_file, full_changed_valid_file, full_changes_test_file, project, model_path, 
           training_pool, use_only_new_data=True, th=0.5, eval_metric="f1", do_oversample=False, do_undersample=False, 
           pretrained_model='codet5p-770m', trained=0, skewed_oversample=False, peft_alg="lora", seed=33, window_size=100, 
-          target_th=0.5, l0=10, l1=12, m=1.5, batch_size=16, cross_project=False, do_eval_with_all_negative=False, stream_changes_file=None, stream_features_file=None):
+          target_th=0.5, l0=10, l1=12, m=1.5, batch_size=16, cross_project=False, do_eval_with_all_negative=False, stream_changes_file=None, stream_features_file=None,
+          worker=None, timeout=None, artifacts=None, classifier=None, tracer=None, training_runs=None):
 
-  if os.path.exists(os.path.join(model_path, "training_status.txt")):
-    os.remove(os.path.join(model_path, "training_status.txt"))
+  for status_file in ("training_status.txt", "training_status.json"):
+    if os.path.exists(os.path.join(model_path, status_file)):
+      os.remove(os.path.join(model_path, status_file))
 
-  df = pd.DataFrame(training_pool)
+  df = training_pool.to_dataframe()
 
   print("Training pool size = ", df.shape[0])
 
-  changes_train_file, features_train_file, changes_valid_file, features_valid_file = prepare_training_data(path, 
-                                                                                                           full_changes_train_file, 
-                                                                                                           full_changed_valid_file, 
-                                                                                                           full_changes_test_file, 
-                                                                                                           project, df, 
-                                                                                                           do_eval_with_all_negative=do_eval_with_all_negative)
+  #Com um Classifier (codeflowlm.classifier), o treino é feito no próprio
+  #processo, sem arquivos de treino nem subprocesso
+  if classifier is not None:
+    batches.append(df)
+    print(f"Training {type(classifier).__name__} with th={th}...")
+
+    with trace_phase(tracer, 'train'):
+      training_status = classifier.train(df, model_path, th=th, eval_metric=eval_metric)
+
+    return apply_training_status(training_pool, training_status, use_only_new_data, th, trained)
+
+  #Com training_runs (TrainingRuns), um treino igual a um já concluído sem
+  #alterar o modelo não é executado de novo.  Com o stream completo o treino usa
+  #também o stream, que não entra na chave: o treino nunca é pulado.
+  run_key = None
+
+  with trace_phase(tracer, 'prepare_training_data'):
+    split = split_training_data(df, do_eval_with_all_negative=do_eval_with_all_negative)
+
+    if training_runs is not None and stream_changes_file is None:
+      hyperparameters = {'batch_classifier_dir': batch_classifier_dir, 'pretrained_model': pretrained_model, 
+                         'peft_alg': peft_alg, 'th': th, 'eval_metric': eval_metric, 'seed': seed, 
+                         'window_size': window_size, 'target_th': target_th, 'l0': l0, 'l1': l1, 'm': m, 
+                         'batch_size': batch_size, 'do_oversample': do_oversample, 'skewed_oversample': skewed_oversample, 
+                         'do_undersample': do_undersample, 'cross_project': cross_project}
+      run_key = training_runs.key(df, split, hyperparameters, f"{model_path}/checkpoint-best-{eval_metric}/model.bin")
+      training_status = training_runs.lookup(run_key)
+
+      if training_status is not None:
+        print(f"Skipping training: run {run_key[:12]} already completed with status {training_status['status']}.")
+        batches.append(df)
+        return apply_training_status(training_pool, training_status, use_only_new_data, th, trained)
+
+    changes_train_file, features_train_file, changes_valid_file, features_valid_file = prepare_training_data(path, 
+                                                                                                             full_changes_train_file, 
+                                                                                                             full_changed_valid_file, 
+                                                                                                             full_changes_test_file, 
+                                                                                                             project, df, 
+                                                                                                             do_eval_with_all_negative=do_eval_with_all_negative, 
+                                                                                                             artifacts=artifacts, 
+                                                                                                             split=split)
   
   batches.append(df)
 
@@ -326,23 +338,32 @@ def train(batch_classifier_dir, path, full_changes_train_file, full_changed_vali
     """
 
   print(f"Training with th={th}...")
-  execute_command(command)
 
+  with trace_phase(tracer, 'train'):
+    returncode = execute_command(command, worker=worker, timeout=timeout)
+
+  training_status = read_training_status(model_path, returncode)
+
+  if returncode != 0:
+    raise TrainingError(f"Training command exited with code {returncode}.", training_status)
+
+  if run_key is not None:
+    training_runs.record(run_key, training_status, hyperparameters)
+
+  return apply_training_status(training_pool, training_status, use_only_new_data, th, trained)
+
+def apply_training_status(training_pool, training_status, use_only_new_data, th, trained):
   if use_only_new_data:
-    while not os.path.exists(os.path.join(model_path, "training_status.txt")):
-      print("Waiting for traning_status.txt")
-      time.sleep(5)
-
-    with open(os.path.join(model_path, "training_status.txt"), "r") as file:
-      file_contents = file.read()
-
-      if file_contents == 'changed':
-        print(f"Model file has changed!")
-        #Clear training pool
-        training_pool.clear()
-        trained += len(set([sample['commit_hash'] for sample in training_pool]))
-      else:
-        print(f"Model file has not changed.  Keeping training data.")
+    if training_status['status'] is None:
+      raise TrainingError("Training command finished without reporting a training status.", training_status)
+
+    if training_status['changed']:
+      print(f"Model file has changed!")
+      #Clear training pool
+      training_pool.clear()
+      trained += len(training_pool)
+    else:
+      print(f"Model file has not changed.  Keeping training data.")
 
   return th, trained
 
@@ -424,7 +445,42 @@ def check_df_project_sorted(df_project):
       raise ValueError("df_project is NOT increasingly sorted by 'author_date_unix_timestamp'.")
     print("df_project IS increasingly sorted by 'author_date_unix_timestamp'")
 
-def merge_cross_project_data(df_features_full, df_train, project, initial_cp_timestamp=0, current_timestamp=0):
+#Dados dos outros projetos para o modo cross-project, filtrados, com timestamps
+#numéricos e ordenados uma única vez.  window() devolve as linhas com timestamp
+#em [start, end) como uma fatia, via searchsorted.
+class CrossProjectIndex:
+  def __init__(self, df_features_full, project):
+    df_others = df_features_full[df_features_full['project'] != project].copy()
+    df_others['author_date_unix_timestamp'] = pd.to_numeric(df_others['author_date_unix_timestamp'], errors='coerce')
+    self.df_others = df_others.sort_values(by='author_date_unix_timestamp', kind='stable').reset_index(drop=True)
+    self.timestamps = self.df_others['author_date_unix_timestamp'].to_numpy()
+
+  def window(self, start, end):
+    first = np.searchsorted(self.timestamps, start, side='left')
+    last = np.searchsorted(self.timestamps, end, side='left')
+    return self.df_others.iloc[first:max(first, last)]
+
+
+#Intercala duas janelas já ordenadas por author_date_unix_timestamp (merge de
+#listas ordenadas, sem reordenar tudo).  Em timestamps iguais, as linhas de
+#df_train vêm antes, como no concat seguido de ordenação.
+def merge_sorted_windows(df_train, df_others):
+  train_timestamps = pd.to_numeric(df_train['author_date_unix_timestamp'], errors='coerce').to_numpy()
+  other_timestamps = df_others['author_date_unix_timestamp'].to_numpy()
+  train_positions = np.arange(len(train_timestamps)) + np.searchsorted(other_timestamps, train_timestamps, side='left')
+  other_positions = np.arange(len(other_timestamps)) + np.searchsorted(train_timestamps, other_timestamps, side='right')
+
+  order = np.empty(len(train_timestamps) + len(other_timestamps), dtype=np.int64)
+  order[train_positions] = np.arange(len(train_timestamps))
+  order[other_positions] = len(train_timestamps) + np.arange(len(other_timestamps))
+
+  df_merged = pd.concat([df_train, df_others], ignore_index=True).take(order).reset_index(drop=True)
+  df_merged['author_date_unix_timestamp'] = np.concatenate([train_timestamps, other_timestamps])[order]
+  return df_merged
+
+
+def merge_cross_project_data(df_features_full, df_train, project, initial_cp_timestamp=0, current_timestamp=0, 
+                             cross_project_index=None):
   # For cross-project JIT-SDP, adds other projects data.  
   max_timestamp = 0
   if len(df_train) == 0:
@@ -433,41 +489,52 @@ def merge_cross_project_data(df_features_full, df_train, project, initial_cp_tim
     max_timestamp = pd.to_numeric(df_train['author_date_unix_timestamp'], errors='coerce').max()
   
   print(f"Cross-project training enabled. Merging data from other projects with timestamps between {datetime.fromtimestamp(initial_cp_timestamp)} and {datetime.fromtimestamp(max_timestamp)}")
-  if df_features_full is not None:
-    df_others = df_features_full[df_features_full['project'] != project]
-    df_others['author_date_unix_timestamp'] = pd.to_numeric(df_others['author_date_unix_timestamp'], errors='coerce')
-    max_timestamp = float(max_timestamp)
-    initial_cp_timestamp = float(initial_cp_timestamp)
-    df_others = df_others[df_others['author_date_unix_timestamp'] < max_timestamp]
-    df_others = df_others[df_others['author_date_unix_timestamp'] >= initial_cp_timestamp]
+  max_timestamp = float(max_timestamp)
+  initial_cp_timestamp = float(initial_cp_timestamp)
+
+  if cross_project_index is None and df_features_full is not None:
+    cross_project_index = CrossProjectIndex(df_features_full, project)
+
+  if cross_project_index is not None:
+    df_others = cross_project_index.window(initial_cp_timestamp, max_timestamp)
   else:
     df_others = pd.DataFrame()
   
-  # Concatenate df_train and df_others, maintaining ascending order by author_date_unix_timestamp
+  # Junta df_train e df_others, mantendo a ordem crescente de author_date_unix_timestamp
   if not df_others.empty:
-    df_train = pd.concat([df_train, df_others], ignore_index=True)
-    df_train['author_date_unix_timestamp'] = pd.to_numeric(df_train['author_date_unix_timestamp'], errors='coerce')
-    df_train = df_train.sort_values(by='author_date_unix_timestamp', ascending=True).reset_index(drop=True)
+    df_train = merge_sorted_windows(df_train, df_others)
   
   return df_train, max_timestamp
 
-def save_execution_status(model_path, current, step, list_of_predictions, list_of_results, max_timestamp_for_cp):
-  with open(os.path.join(model_path, "training_status.pickle"), "wb") as f:
-        pickle.dump({"current":current + step, "list_of_predictions":list_of_predictions, "max_timestamp_for_cp": max_timestamp_for_cp}, f)
+#Os passos concluídos já estão no journal (StepJournal), então não há o que
+#gravar: a execução retomada continua do passo seguinte ao último registrado.
+def save_execution_status(list_of_predictions, list_of_results):
   return list_of_results, list_of_predictions, False
 
 
 def train_on_line_with_new_data(batch_classifier_dir, path, full_changes_train_file, full_changes_valid_file, 
                                 full_changes_test_file, project, df_project, model_path, training_pool, training_queue, 
-                                map_commit_to_row, buggy_pool=[], training_examples=50, th=0.5, adjust_th=False,
+                                map_commit_to_row, buggy_pool=None, training_examples=50, th=0.5, adjust_th=False,
                                 eval_metric="f1", do_oversample=False, do_undersample=False, 
                                 pretrained_model='codet5p-770m', do_real_lat_ver=False, skewed_oversample=False, 
                                 peft_alg="lora", seed=33, window_size=100, target_th=0.5, l0=10, 
                                 l1=12, m=1.5, train_from_scratch=True, batch_size=16, df_features_full=None, 
-                                cross_project=False, do_eval_with_all_negative=False):
+                                cross_project=False, do_eval_with_all_negative=False, dump_steps=False, 
+                                worker=None, command_timeout=None, prequential_tracker=None, use_manifest=False, 
+                                classifier=None, step_tracer=None, memoize_training=False, keep_checkpoints=False):
   list_of_results = []
   list_of_predictions = []
 
+  if buggy_pool is None:
+    buggy_pool = BuggyPool()
+
+  #Os ids do training pool, da fila e do buggy pool são do CommitStore do pool
+  if map_commit_to_row is None:
+    map_commit_to_row = training_pool.store
+
+  if map_commit_to_row is not training_pool.store:
+    raise ValueError("map_commit_to_row must be the CommitStore of the training pool.")
+
   print('len(training_pool) = ', len(training_pool))
   print('len(training_queue) = ', len(training_queue))
 
@@ -482,17 +549,35 @@ def train_on_line_with_new_data(batch_classifier_dir, path, full_changes_train_f
   max_timestamp_for_cp = 0
 
   print("model_path = ", model_path)
-  if os.path.exists(os.path.join(model_path, "training_status.pickle")):
-    with open(os.path.join(model_path, "training_status.pickle"), "rb") as f:
-      training_status = pickle.load(f)
-      if 'current' in training_status:
-        start = training_status['current']
-        print("Resuming from current = ", start)
-        list_of_predictions = training_status.get('list_of_predictions', [])
-        print("Resuming with list_of_predictions of size = ", len(list_of_predictions))
-        max_timestamp_for_cp = training_status.get('max_timestamp_for_cp', 0)
-      else:
-        print("Starting from scratch.")
+  journal = StepJournal(model_path)
+  resumed_training = None
+  #Execução interrompida antes do journal: retoma do training_status.pickle
+  journal.migrate_legacy_status(training_pool, training_queue, buggy_pool, map_commit_to_row, th=th)
+
+  if journal.exists():
+    #Reconstrói pools, fila e predições do último passo registrado
+    resumed = journal.restore(training_pool, training_queue, buggy_pool, map_commit_to_row)
+
+    if resumed is not None:
+      start = resumed['next']
+      print("Resuming from current = ", start)
+      list_of_predictions = list(journal.windows)
+      list_of_results = list(journal.results)
+      print("Resuming with list_of_predictions of size = ", len(list_of_predictions))
+      max_timestamp_for_cp = resumed['max_timestamp_for_cp']
+      th = resumed['th']
+      trained = resumed['trained']
+      #Treino do passo interrompido que já tinha sido concluído, se houver
+      resumed_training = journal.read_training()
+
+      if prequential_tracker is not None:
+        if resumed['prequential_tracker'] is not None:
+          prequential_tracker.restore(resumed['prequential_tracker'])
+        else:
+          for predictions in list_of_predictions:
+            prequential_tracker.update(predictions['true_label'], predictions['pred_label'])
+    else:
+      print("Starting from scratch.")
 
   step = training_examples
   end = df_project.shape[0]
@@ -503,61 +588,160 @@ def train_on_line_with_new_data(batch_classifier_dir, path, full_changes_train_f
   
   print(df_project.head())
 
+  #Sem cross-project, o training pool do modo train_from_scratch vem da linha do
+  #tempo dos rótulos, calculada uma vez, em vez do replay do prefixo a cada passo.
+  label_timeline = None
+
+  if train_from_scratch and not cross_project:
+    label_timeline = LabelTimeline(df_project, do_real_lat_ver=do_real_lat_ver, store=map_commit_to_row)
+
+  #No modo cross-project, os dados dos outros projetos são indexados por data uma vez
+  cross_project_index = None
+
+  if cross_project and df_features_full is not None:
+    cross_project_index = CrossProjectIndex(df_features_full, project)
+
+  #Com use_manifest, os arquivos de treino/teste/stream de cada passo são
+  #manifestos que referenciam os corpora (ver codeflowlm.manifest)
+  artifacts = None
+
+  if use_manifest:
+    df_corpus = df_project if cross_project_index is None else pd.concat([df_project, cross_project_index.df_others], ignore_index=True)
+    artifacts = TrainingArtifacts(path, project, (full_changes_train_file, full_changes_valid_file, full_changes_test_file), df_corpus)
+
+  #Com memoize_training, treinos repetidos que não alteram o modelo são pulados
+  #(ver codeflowlm.training_runs).  Os scripts treinam também com o stream
+  #completo, que muda a cada passo, então com ele nenhum treino se repete.
+  training_runs = None
+
+  if memoize_training:
+    if USE_FULL_STREAM_FOR_TRAINING and classifier is None:
+      print("Training memoization is disabled: the full stream passed to the training scripts changes at every step.")
+    else:
+      training_runs = TrainingRuns(model_path)
+
+  #Com keep_checkpoints, o checkpoint usado no teste de cada passo é guardado para
+  #a reavaliação offline (ver codeflowlm.replay)
+  checkpoint_manifest = CheckpointManifest(model_path, eval_metric=eval_metric) if keep_checkpoints else None
+  model_file = f"{model_path}/checkpoint-best-{eval_metric}/model.bin"
+  model_digests = {}
+
+  if step_tracer is not None:
+    step_tracer.open(model_path, project)
+
   for current in range(start, end, step):
+    stream_dir = None
+
     try:
       print('current = ', current)
+
+      if step_tracer is not None:
+        step_tracer.start_step(current)
+
       current_timestamp = df_project['author_date_unix_timestamp'].iloc[current]
       print(f"current_timestamp = {datetime.fromtimestamp(int(float(current_timestamp)))}")
 
       if train_from_scratch:
-        df_train = df_project[:current].copy() #all data
+        train_start = 0 #all data
         training_queue.clear()
         buggy_pool.clear()
       else:
-        df_train = df_project[max(current - step, 0):current].copy() #only recent data
+        train_start = max(current - step, 0) #only recent data
 
+      df_train = df_project[train_start:current].copy()
       project = df_project['project'].iloc[current]
-      df_train.to_csv(f'df_train_{project}_{current}.csv')
       df_test = df_project[current:min(current + step, end)].copy()
-      df_test.to_csv(f'df_test_{project}_{current}.csv')
 
-      df_train, max_timestamp_for_cp = adjust_train_data(project, df_features_full, cross_project, df_train, 
-                                                        initial_cp_timestamp=max_timestamp_for_cp, current_timestamp=current_timestamp)
+      initial_cp_timestamp = max_timestamp_for_cp
+
+      with trace_phase(step_tracer, 'adjust_train_data'):
+        df_train, max_timestamp_for_cp = adjust_train_data(project, df_features_full, cross_project, df_train, 
+                                                          initial_cp_timestamp=initial_cp_timestamp, current_timestamp=current_timestamp, 
+                                                          cross_project_index=cross_project_index)
+
+      if dump_steps:
+        #No modo cross-project, registra também a janela dos outros projetos
+        cross_project_window, df_others = None, None
+
+        if cross_project:
+          cross_project_window = (initial_cp_timestamp, max_timestamp_for_cp)
+
+          if cross_project_index is not None:
+            df_others = cross_project_index.window(*cross_project_window)
+
+        append_step(get_step_log_file(model_path, project), project, current, train_start, current, 
+                    min(current + step, end), df_project, cross_project_window=cross_project_window, 
+                    df_others=df_others)
 
       # Builds training queue and training pool based on latency verification and buggy commit detection.  
-      prepare_train_data(df_train, training_pool, training_queue, map_commit_to_row, buggy_pool, do_real_lat_ver=do_real_lat_ver)
+      with trace_phase(step_tracer, 'prepare_train_data'):
+        if label_timeline is not None:
+          label_timeline.apply(training_pool, current)
+        else:
+          prepare_train_data(df_train, training_pool, training_queue, map_commit_to_row, buggy_pool, do_real_lat_ver=do_real_lat_ver)
       
       print("Training pool size = ", len(training_pool))
       df_stream=df_train
       stream_changes_file, stream_features_file = None, None
   
-      if df_stream is not None and USE_FULL_STREAM_FOR_TRAINING:
-        stream_changes_file, stream_features_file = prepare_full_stream_data(project, df_stream, full_changes_train_file, full_changes_valid_file, 
-                                                                         full_changes_test_file)
+      if df_stream is not None and USE_FULL_STREAM_FOR_TRAINING and classifier is None:
+        #Como os arquivos de teste, os do stream ficam num diretório próprio do
+        #passo: execuções simultâneas não sobrescrevem os arquivos umas das outras.
+        os.makedirs(path, exist_ok=True)
+        stream_dir = tempfile.mkdtemp(prefix=f"stream_{project}_", dir=path)
+
+        with trace_phase(step_tracer, 'prepare_full_stream_data'):
+          stream_changes_file, stream_features_file = prepare_full_stream_data(project, df_stream, full_changes_train_file, full_changes_valid_file, 
+                                                                               full_changes_test_file, artifacts=artifacts, 
+                                                                               run_dir=stream_dir)
 
       if is_valid_training_data(training_pool):
-        #Train
-        try:
-          th, trained = train(batch_classifier_dir, path, full_changes_train_file, full_changes_valid_file, 
-                              full_changes_test_file, project, model_path, training_pool, th=th, eval_metric=eval_metric, 
-                              do_oversample=do_oversample and (not skewed_oversample), do_undersample=do_undersample,
-                              pretrained_model=pretrained_model, trained=trained, skewed_oversample=skewed_oversample, 
-                              peft_alg=peft_alg, seed=seed, window_size=window_size, target_th=target_th, l0=l0, l1=l1, 
-                              m=m, batch_size=batch_size, cross_project=cross_project, 
-                              do_eval_with_all_negative=do_eval_with_all_negative, stream_changes_file=stream_changes_file, stream_features_file=stream_features_file)
-        except Exception as e:
-          print("Not enough labeled training/validation data.  Delaying training...")
-          print(f"Ocorreu um erro: {str(e)}")
-          traceback.print_exc()
+        #O passo retomado já tinha treinado antes da interrupção e o checkpoint é o
+        #daquele treino: só o seu efeito no pool e nos escalares é reaplicado
+        if resumed_training is not None and resumed_training['current'] == current and \
+           cached_file_digest(model_file, model_digests) == resumed_training['checkpoint']:
+          print(f"Training of step {current} already completed before the interruption.  Skipping it.")
+
+          if resumed_training['cleared']:
+            training_pool.clear()
+
+          th, trained = resumed_training['th'], resumed_training['trained']
+        else:
+          #Train
+          try:
+            generation = training_pool.generation
+            th, trained = train(batch_classifier_dir, path, full_changes_train_file, full_changes_valid_file, 
+                                full_changes_test_file, project, model_path, training_pool, th=th, eval_metric=eval_metric, 
+                                do_oversample=do_oversample and (not skewed_oversample), do_undersample=do_undersample,
+                                pretrained_model=pretrained_model, trained=trained, skewed_oversample=skewed_oversample, 
+                                peft_alg=peft_alg, seed=seed, window_size=window_size, target_th=target_th, l0=l0, l1=l1, 
+                                m=m, batch_size=batch_size, cross_project=cross_project, 
+                                do_eval_with_all_negative=do_eval_with_all_negative, stream_changes_file=stream_changes_file, stream_features_file=stream_features_file, 
+                                worker=worker, timeout=command_timeout, artifacts=artifacts, classifier=classifier, 
+                                tracer=step_tracer, training_runs=training_runs)
+            journal.record_training(current, cached_file_digest(model_file, model_digests), th, trained, 
+                                    training_pool.generation != generation)
+          except (CommandError, TrainingError):
+            #Falha do processo de treino: salva o estado e aborta (tratado abaixo)
+            raise
+          except Exception as e:
+            print("Not enough labeled training/validation data.  Delaying training...")
+            print(f"Ocorreu um erro: {str(e)}")
+            traceback.print_exc()
+
+      resumed_training = None
 
       #Test with current model (or no model)
       calculate_metrics = df_test['is_buggy_commit'].sum() > 0
+      results = None
 
       if os.path.exists(f"{model_path}/checkpoint-best-{eval_metric}/model.bin"):
         results, predictions = test(batch_classifier_dir, path, full_changes_train_file, full_changes_valid_file, 
                                     full_changes_test_file, project, df_test, model_path, th=th, adjust_th=adjust_th,
                                     pretrained_model=pretrained_model, calculate_metrics=calculate_metrics, peft_alg=peft_alg,
-                                    eval_metric=eval_metric, batch_size=batch_size, stream_changes_file=stream_changes_file, stream_features_file=stream_features_file)
+                                    eval_metric=eval_metric, batch_size=batch_size, stream_changes_file=stream_changes_file, stream_features_file=stream_features_file, 
+                                    worker=worker, timeout=command_timeout, artifacts=artifacts, classifier=classifier, 
+                                    tracer=step_tracer)
         list_of_results.append(results)
       else:
         #file_to_monitor = f'{model_path}/model.bin'
@@ -571,18 +755,43 @@ def train_on_line_with_new_data(batch_classifier_dir, path, full_changes_train_f
                       'pred_prob':pred_prob}
 
       list_of_predictions.append(predictions)
+
+      if prequential_tracker is not None:
+        prequential_tracker.update(df_test['is_buggy_commit'].to_list(), predictions['pred_label'])
+        g_mean, std_g_mean = prequential_tracker.summary()['g-mean']
+        print(f"Prequential G-Mean so far: Mean = {g_mean:.4f}, Standard Deviation = {std_g_mean:.4f}")
+
+      with trace_phase(step_tracer, 'checkpoint'):
+        if checkpoint_manifest is not None:
+          #Só a referência do stream: ele é remontado na reavaliação
+          stream = None
+
+          if stream_changes_file is not None:
+            stream = get_stream_reference(train_start, current, cross_project_window=(initial_cp_timestamp, max_timestamp_for_cp) 
+                                          if cross_project else None)
+
+          checkpoint_manifest.append_step(current, min(current + step, end), th, adjust_th=adjust_th, stream=stream)
+
+        journal.append_step(current, current + step, predictions, results, training_pool, training_queue, buggy_pool, 
+                            map_commit_to_row, th=th, trained=trained, max_timestamp_for_cp=max_timestamp_for_cp, 
+                            prequential_tracker=prequential_tracker)
+
+      if step_tracer is not None:
+        step_tracer.end_step(training_pool, training_queue, buggy_pool)
     except Exception as e:
       print(f"Erro: {e}")           # mensagem
       print(repr(e))                # tipo + mensagem
-      import traceback
       traceback.print_exc()         # stack trace completo
       print("Error during training/testing.  Saving intermediate results and aborting processing...")
-      return save_execution_status(model_path, current, step, list_of_predictions, list_of_results, max_timestamp_for_cp)
+      return save_execution_status(list_of_predictions, list_of_results)
+    finally:
+      if stream_dir is not None:
+        shutil.rmtree(stream_dir, ignore_errors=True)
 
     if time.time() > execution_start + max_exec_time:
       #pauses execution
       print("Maximum execution time reached.  Saving current state...") 
-      return save_execution_status(model_path, current, step, list_of_predictions, list_of_results, max_timestamp_for_cp)
+      return save_execution_status(list_of_predictions, list_of_results)
     """
       with open(os.path.join(model_path, "training_status.pickle"), "wb") as f:
         pickle.dump({"current":current + step, "list_of_predictions":list_of_predictions}, f)
@@ -593,9 +802,11 @@ def train_on_line_with_new_data(batch_classifier_dir, path, full_changes_train_f
 
   return list_of_results, list_of_predictions, True
 
-def adjust_train_data(project, df_features_full, cross_project, df_train, initial_cp_timestamp=0, current_timestamp=0):
+def adjust_train_data(project, df_features_full, cross_project, df_train, initial_cp_timestamp=0, current_timestamp=0, 
+                      cross_project_index=None):
     if cross_project:
-      df_train, max_timestamp = merge_cross_project_data(df_features_full, df_train, project, initial_cp_timestamp, current_timestamp)
+      df_train, max_timestamp = merge_cross_project_data(df_features_full, df_train, project, initial_cp_timestamp, current_timestamp, 
+                                                         cross_project_index=cross_project_index)
       return df_train, max_timestamp
     else:
       return df_train, 0
@@ -607,24 +818,38 @@ def train_on_line_with_new_data_with_early_stop(batch_classifier_dir, path, full
                                                 peft_alg="lora", seed=33, window_size=100, 
                                                 target_th=0.5, l0=10, l1=12, m=1.5, pretrained_model="codet5p-770m", 
                                                 train_from_scratch=True, batch_size=16, df_features_full=None, 
-                                                cross_project=False, do_eval_with_all_negative=False):
+                                                cross_project=False, do_eval_with_all_negative=False, dump_steps=False, 
+                                                use_model_worker=False, command_timeout=None, prequential_tracker=None, 
+                                                use_manifest=False, classifier=None, step_tracer=None, 
+                                                memoize_training=False, keep_checkpoints=False):
   batches = []
-  training_pool = []
-  training_queue = []
-  buggy_pool = []
-  map_commit_to_row = dict()
+  map_commit_to_row = CommitStore()
+  training_pool = TrainingPool(map_commit_to_row)
+  training_queue = TrainingQueue()
+  buggy_pool = BuggyPool()
   print('len(batches) in train_on_line_with_new_data_with_early_stop(): ',
         len(batches))
-  return train_on_line_with_new_data(batch_classifier_dir, path, full_changes_train_file, full_changes_valid_file, 
-                                     full_changes_test_file, project, df_project, model_path, training_pool, 
-                                     training_queue, map_commit_to_row, buggy_pool, eval_metric=early_stop_metric,
-                                     do_oversample=do_oversample, do_real_lat_ver=do_real_lat_ver, adjust_th=adjust_th, 
-                                     skewed_oversample=skewed_oversample, peft_alg=peft_alg, 
-                                     seed=seed, window_size=window_size, 
-                                     target_th=target_th, l0=l0, l1=l1, m=m, pretrained_model=pretrained_model,
-                                     train_from_scratch=train_from_scratch, batch_size=batch_size, 
-                                     df_features_full=df_features_full, cross_project=cross_project, 
-                                     do_eval_with_all_negative=do_eval_with_all_negative)
+  #Um worker de modelo por projeto, mantido entre os passos do loop online
+  worker = ModelWorker() if use_model_worker else None
+
+  try:
+    return train_on_line_with_new_data(batch_classifier_dir, path, full_changes_train_file, full_changes_valid_file, 
+                                       full_changes_test_file, project, df_project, model_path, training_pool, 
+                                       training_queue, map_commit_to_row, buggy_pool, eval_metric=early_stop_metric,
+                                       do_oversample=do_oversample, do_real_lat_ver=do_real_lat_ver, adjust_th=adjust_th, 
+                                       skewed_oversample=skewed_oversample, peft_alg=peft_alg, 
+                                       seed=seed, window_size=window_size, 
+                                       target_th=target_th, l0=l0, l1=l1, m=m, pretrained_model=pretrained_model,
+                                       train_from_scratch=train_from_scratch, batch_size=batch_size, 
+                                       df_features_full=df_features_full, cross_project=cross_project, 
+                                       do_eval_with_all_negative=do_eval_with_all_negative, dump_steps=dump_steps, 
+                                       worker=worker, command_timeout=command_timeout, 
+                                       prequential_tracker=prequential_tracker, use_manifest=use_manifest, 
+                                       classifier=classifier, step_tracer=step_tracer, 
+                                       memoize_training=memoize_training, keep_checkpoints=keep_checkpoints)
+  finally:
+    if worker is not None:
+      worker.close()
 
 def train_project(batch_classifier_dir, path, model_root, commit_guru_path, full_features_train_file, 
                   full_features_valid_file, full_features_test_file, full_changes_train_file, full_changed_valid_file, 
@@ -632,7 +857,9 @@ def train_project(batch_classifier_dir, path, model_root, commit_guru_path, full
                   do_oversample=True, model_path=None, skewed_oversample=False, peft_alg="lora", 
                   seed=33, window_size=100, target_th=0.5, l0=10, l1=12 , m=1.5, start=0, end=None, 
                   pretrained_model="codet5p-770m", train_from_scratch=True, batch_size=16, cross_project=False, 
-                  do_eval_with_all_negative=False):
+                  do_eval_with_all_negative=False, dump_steps=False, use_model_worker=False, command_timeout=None, 
+                  prequential_tracker=None, use_manifest=False, classifier=None, step_tracer=None, 
+                  memoize_training=False, keep_checkpoints=False, first_fix_date_workers=1):
   
   df_features_full = get_df_features_full(full_features_train_file, full_features_valid_file, full_features_test_file)
   df_project = df_features_full[df_features_full['project'] == project]
@@ -643,7 +870,8 @@ def train_project(batch_classifier_dir, path, model_root, commit_guru_path, full
   print('df_project.shape after: ', df_project.shape)
   assert rows1 == rows2
 
-  df_features_full = adjust_df_features_full(commit_guru_path, cross_project, df_features_full)
+  df_features_full = adjust_df_features_full(commit_guru_path, cross_project, df_features_full, 
+                                             max_workers=first_fix_date_workers)
 
   if not end:
     end = df_project.shape[0]
@@ -671,37 +899,56 @@ def train_project(batch_classifier_dir, path, model_root, commit_guru_path, full
                                                                              train_from_scratch=train_from_scratch,
                                                                              batch_size=batch_size, df_features_full=df_features_full, 
                                                                              cross_project=cross_project, 
-                                                                             do_eval_with_all_negative=do_eval_with_all_negative)
-
-  true_labels = []
-  pred_labels = []
-  pred_probs = []
-
-  for prediction in list_of_predictions:
-    tl = prediction['true_label']
-    pl = prediction['pred_label']
-    pp = prediction['pred_prob']
-    true_labels.extend(tl)
-    pred_labels.extend(pl)
-    pred_probs.extend(pp)
-
-  predictions = {'true_labels': df_project['is_buggy_commit'].tolist(),
-                 'pred_labels': pred_labels, 'pred_probs': pred_probs}
+                                                                             do_eval_with_all_negative=do_eval_with_all_negative,
+                                                                             dump_steps=dump_steps, 
+                                                                             use_model_worker=use_model_worker, 
+                                                                             command_timeout=command_timeout, 
+                                                                             prequential_tracker=prequential_tracker, 
+                                                                             use_manifest=use_manifest, 
+                                                                             classifier=classifier, 
+                                                                             step_tracer=step_tracer, 
+                                                                             memoize_training=memoize_training, 
+                                                                             keep_checkpoints=keep_checkpoints)
+
+  #As predições de todas as janelas vêm do journal, já como arrays
+  journal_predictions = read_journal_predictions(model_path)
+  predictions = {'true_labels': df_project['is_buggy_commit'].to_numpy(),
+                 'pred_labels': journal_predictions['pred_labels'], 'pred_probs': journal_predictions['pred_probs']}
+
+  if step_tracer is not None:
+    step_tracer.print_summary()
 
   return results, predictions, model_path, finished
 
-def adjust_df_features_full(commit_guru_path, cross_project, df_features_full):
+#No modo cross-project, adiciona first_fix_date aos dados de todos os projetos.
+#Cada projeto é lido do cache de add_first_fix_date_cached quando possível; os
+#demais são calculados num pool de processos (spawn, como em runner.py), e o
+#resultado é montado com um único concat.
+#As datas de primeira correção dos projetos fora do cache podem ser calculadas em
+#max_workers processos; o padrão é calcular em série.
+def adjust_df_features_full(commit_guru_path, cross_project, df_features_full, max_workers=1):
     if cross_project:
-      projects = df_features_full['project'].unique()
-      df_features_full_with_first_fix_date = pd.DataFrame()
-    
-      for project in projects:
-        df_cross = df_features_full[df_features_full['project'] == project]
-        df_cross = add_first_fix_date(commit_guru_path, df_cross, project)
-        df_features_full_with_first_fix_date = pd.concat([df_features_full_with_first_fix_date, df_cross], ignore_index=True)
-    
+      groups = list(df_features_full.groupby('project', sort=False))
+      frames = [read_first_fix_date_cache(commit_guru_path, df_cross, project) for project, df_cross in groups]
+      missing = [i for i, frame in enumerate(frames) if frame is None]
+      print(f"First fix dates: {len(groups) - len(missing)} projects cached, {len(missing)} to compute.")
+
+      max_workers = min(len(missing), max_workers)
+
+      if max_workers > 1:
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+          computed = executor.map(add_first_fix_date_cached, [commit_guru_path] * len(missing), 
+                                  [groups[i][1] for i in missing], [groups[i][0] for i in missing])
+          
+          for i, frame in zip(missing, computed):
+            frames[i] = frame
+      else:
+        for i in missing:
+          frames[i] = add_first_fix_date_cached(commit_guru_path, groups[i][1], groups[i][0])
+
+      df_features_full_with_first_fix_date = pd.concat(frames, ignore_index=True)
       df_features_full_with_first_fix_date = df_features_full_with_first_fix_date.sort_values(by='author_date_unix_timestamp', 
-                                                                                              ascending=True).reset_index(drop=True)
+                                                                                              ascending=True, kind='stable').reset_index(drop=True)
       return df_features_full_with_first_fix_date
     
     return df_features_full
@@ -712,7 +959,10 @@ def train_project_with_lat_ver(batch_classifier_dir, path, model_root, commit_gu
                                peft_alg="lora", seed=33, decay_factor=0.99, window_size=100, 
                                target_th=0.5, l0=10, l1=12, m=1.5, results_folder='', start=0, end=None, 
                                pretrained_model="codet5p-770m", train_from_scratch=True, 
-                               batch_size=16, cross_project=False, do_eval_with_all_negative=False):
+                               batch_size=16, cross_project=False, do_eval_with_all_negative=False, dump_steps=False, 
+                               use_model_worker=False, command_timeout=None, use_manifest=False, classifier=None, 
+                               step_tracer=None, memoize_training=False, keep_checkpoints=False, 
+                               first_fix_date_workers=1):
 
     columns = ['project', 'g_mean', 'f1', 'precision', 'recall', 'R0', 'R1',
              '|R0-R1|', 'std_g_mean', 'std_f1', 'std_precision', 'std_recall',
@@ -720,6 +970,7 @@ def train_project_with_lat_ver(batch_classifier_dir, path, model_root, commit_gu
 
     print(f"Project: {project}")
     df = pd.DataFrame(columns=columns)
+    prequential_tracker = PrequentialTracker(decay_factor)
 
     _, predictions, model_path, finished = train_project(batch_classifier_dir, path, model_root, commit_guru_path, 
                                                          full_features_train_file, full_features_valid_file, 
@@ -732,7 +983,15 @@ def train_project_with_lat_ver(batch_classifier_dir, path, model_root, commit_gu
                                                          start=start, end=end, pretrained_model=pretrained_model, 
                                                          train_from_scratch=train_from_scratch, batch_size=batch_size, 
                                                          cross_project=cross_project, 
-                                                         do_eval_with_all_negative=do_eval_with_all_negative)
+                                                         do_eval_with_all_negative=do_eval_with_all_negative,
+                                                         dump_steps=dump_steps, 
+                                                         use_model_worker=use_model_worker, 
+                                                         command_timeout=command_timeout, 
+                                                         prequential_tracker=prequential_tracker, 
+                                                         use_manifest=use_manifest, classifier=classifier, 
+                                                         step_tracer=step_tracer, memoize_training=memoize_training, 
+                                                         keep_checkpoints=keep_checkpoints, 
+                                                         first_fix_date_workers=first_fix_date_workers)
 
     if finished:
       print("Training finished successfully.")
@@ -740,11 +999,14 @@ def train_project_with_lat_ver(batch_classifier_dir, path, model_root, commit_gu
       with open(f'{model_path}/{project}_predictions_wp.pkl', 'wb') as f:
         pickle.dump(predictions, f)
       
-      calculate_metrics_and_plot(model_root, project, early_stop_metric, decay_factor, results_folder, pretrained_model, df, predictions, model_path)
+      calculate_metrics_and_plot(model_root, project, early_stop_metric, decay_factor, results_folder, pretrained_model, df, predictions, model_path, 
+                                 prequential_tracker=prequential_tracker)
+
+    return df, finished
 
 def calculate_metrics_and_plot(model_root, project, early_stop_metric, decay_factor, results_folder, pretrained_model, 
-                               df, predictions, model_path):
-    mean_g_mean, std_g_mean, mean_r_diff, std_r_diff, mean_f1, std_f1, mean_precision, std_precision, mean_recall, std_recall, mean_r0, std_r0, mean_r1, std_r1, roc_auc, metrics = calculate_prequential_mean_and_std(predictions, decay_factor=decay_factor)
+                               df, predictions, model_path, prequential_tracker=None):
+    mean_g_mean, std_g_mean, mean_r_diff, std_r_diff, mean_f1, std_f1, mean_precision, std_precision, mean_recall, std_recall, mean_r0, std_r0, mean_r1, std_r1, roc_auc, metrics = calculate_prequential_mean_and_std(predictions, decay_factor=decay_factor, tracker=prequential_tracker)
 
     plot(metrics, model_path)
 
@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+#Registro dos treinos concluídos, endereçado pelo conteúdo.  Quando o modelo não
+#muda, train() mantém o training pool, e o passo seguinte costuma treinar de novo
+#com o mesmo pool e os mesmos hiperparâmetros.  A chave de cada treino é um hash
+#de:
+#
+#  - commit_hash e label de cada exemplo do pool, ordenados;
+#  - a divisão treino/validação (commits de cada split, na ordem);
+#  - os hiperparâmetros do comando de treino;
+#  - o digest do checkpoint de partida (<model_path>/checkpoint-best-<metric>/model.bin).
+#
+#Os scripts também treinam com o stream completo (--stream_data_file), quando
+#passado.  O stream é o prefixo do projeto até o passo, diferente a cada passo,
+#então um treino com stream nunca se repete no loop: train() só consulta e
+#registra treinos sem stream (USE_FULL_STREAM_FOR_TRAINING = False).
+#
+#Só são reaproveitados os treinos que terminaram sem alterar o modelo: o
+#checkpoint continua sendo o de partida, então o resultado de repetir o treino é
+#o mesmo.  Os registros ficam em <model_path>/training_runs/<chave>.json.
+
+
+def get_training_runs_dir(model_path):
+  return os.path.join(model_path, "training_runs")
+
+
+def file_digest(file, chunk_size=1 << 20):
+  digest = hashlib.sha256()
+
+  with open(file, "rb") as f:
+    for chunk in iter(lambda: f.read(chunk_size), b""):
+      digest.update(chunk)
+
+  return digest.hexdigest()
+
+
+#Digest de um checkpoint, calculado de novo só se o arquivo mudou.  cache guarda
+#os digests por (arquivo, tamanho, mtime); None se o arquivo não existe.
+def cached_file_digest(file, cache):
+  if not os.path.exists(file):
+    return None
+
+  stat = os.stat(file)
+  key = (file, stat.st_size, stat.st_mtime_ns)
+
+  if key not in cache:
+    cache[key] = file_digest(file)
+
+  return cache[key]
+
+
+def training_run_key(df, train_rows, val_rows, hyperparameters, checkpoint_digest):
+  hashes = df['commit_hash'].astype(str).to_numpy()
+  labels = df['is_buggy_commit'].to_numpy(dtype=float)
+  order = np.argsort(hashes, kind='stable')
+  content = {
+    'pool': [[commit_hash, label] for commit_hash, label in zip(hashes[order].tolist(), labels[order].tolist())],
+    'train': hashes[np.asarray(train_rows, dtype=np.int64)].tolist(),
+    'valid': hashes[np.asarray(val_rows, dtype=np.int64)].tolist(),
+    'hyperparameters': hyperparameters,
+    'checkpoint': checkpoint_digest,
+  }
+  return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class TrainingRuns:
+  def __init__(self, model_path):
+    self.model_path = model_path
+    self.runs_dir = get_training_runs_dir(model_path)
+    self._digests = {}
+
+  def key(self, df, split, hyperparameters, checkpoint_file):
+    _, train_rows, val_rows = split
+    return training_run_key(df, train_rows, val_rows, hyperparameters, cached_file_digest(checkpoint_file, self._digests))
+
+  def get_run_file(self, key):
+    return os.path.join(self.runs_dir, f"{key}.json")
+
+  #Status registrado para a chave (no formato de read_training_status()), ou None
+  #se não houver um treino reaproveitável
+  def lookup(self, key):
+    run_file = self.get_run_file(key)
+
+    if not os.path.exists(run_file):
+      return None
+
+    with open(run_file, "r") as f:
+      run = json.load(f)
+
+    training_status = run['training_status']
+
+    if training_status['returncode'] != 0 or training_status['status'] is None or training_status['changed']:
+      return None
+
+    return training_status
+
+  def record(self, key, training_status, hyperparameters=None):
+    os.makedirs(self.runs_dir, exist_ok=True)
+    run_file = self.get_run_file(key)
+    tmp_file = run_file + ".tmp"
+
+    with open(tmp_file, "w") as f:
+      json.dump({'key': key, 'training_status': training_status, 'hyperparameters': hyperparameters}, f, default=str)
+
+    os.replace(tmp_file, run_file)
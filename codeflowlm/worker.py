@@ -0,0 +1,186 @@
+import atexit
+import copy
+import json
+import os
+import runpy
+import select
+import shlex
+import subprocess
+import sys
+import threading
+import traceback
+from codeflowlm.command import CommandTimeout, get_command_env
+
+#Worker de longa duração para os comandos de treino/teste (run_lora.py/run_peft.py).
+#Em vez de iniciar um interpretador por chamada, o loop online mantém um processo
+#por projeto e envia a ele os argumentos de cada job pelo stdin; o exit code de
+#cada job volta por um pipe separado.  O worker roda o script no próprio
+#processo, então torch/transformers são importados uma vez, e guarda em memória
+#os modelos e tokenizers carregados com from_pretrained: nas chamadas seguintes,
+#o backbone é copiado da memória em vez de relido do disco.
+
+_pretrained_cache = {}
+
+
+def _local_files_key(path):
+  #Para diretórios locais, a chave inclui mtime/tamanho dos arquivos, para que um
+  #checkpoint regravado não seja servido do cache.
+  if not isinstance(path, (str, os.PathLike)) or not os.path.isdir(path):
+    return None
+
+  key = []
+
+  for name in sorted(os.listdir(path)):
+    file = os.path.join(path, name)
+
+    if os.path.isfile(file):
+      stat = os.stat(file)
+      key.append((name, stat.st_mtime_ns, stat.st_size))
+
+  return tuple(key)
+
+
+def _cached_from_pretrained(from_pretrained):
+  def cached_from_pretrained(cls, *args, **kwargs):
+    path = args[0] if args else kwargs.get('pretrained_model_name_or_path')
+
+    try:
+      key = (cls, repr(args), repr(sorted(kwargs.items())), _local_files_key(path))
+    except Exception:
+      return from_pretrained(cls, *args, **kwargs)
+
+    if key not in _pretrained_cache:
+      _pretrained_cache[key] = from_pretrained(cls, *args, **kwargs)
+
+    #Os scripts alteram o modelo (LoRA, prefix tuning, treino): cada job recebe uma cópia
+    return copy.deepcopy(_pretrained_cache[key])
+
+  return classmethod(cached_from_pretrained)
+
+
+def _patch_from_pretrained():
+  try:
+    from transformers import PreTrainedModel, PreTrainedTokenizerBase
+  except ImportError:
+    return
+
+  for base in (PreTrainedModel, PreTrainedTokenizerBase):
+    base.from_pretrained = _cached_from_pretrained(base.from_pretrained.__func__)
+
+
+def run_script(argv, cwd):
+  script = argv[0]
+  os.chdir(cwd)
+  sys.argv = list(argv)
+  sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+
+  try:
+    runpy.run_path(script, run_name='__main__')
+    return 0
+  except SystemExit as e:
+    if e.code is None:
+      return 0
+
+    return e.code if isinstance(e.code, int) else 1
+  except Exception:
+    traceback.print_exc()
+    return 1
+  finally:
+    sys.path.pop(0)
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+
+def serve(jobs, results):
+  _patch_from_pretrained()
+
+  for line in jobs:
+    job = json.loads(line)
+    returncode = run_script(job['argv'], job['cwd'])
+    results.write(json.dumps({'returncode': returncode}) + "\n")
+    results.flush()
+
+
+class ModelWorker:
+  def __init__(self):
+    self._process = None
+    self._results = None
+    atexit.register(self.close)
+
+  def start(self):
+    results_fd, child_results_fd = os.pipe()
+    env = get_command_env()
+    self._process = subprocess.Popen([sys.executable, '-u', '-m', 'codeflowlm.worker', str(child_results_fd)],
+                                     stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                     text=True, encoding='utf-8', env=env, pass_fds=(child_results_fd,))
+    os.close(child_results_fd)
+    self._results = os.fdopen(results_fd, 'r')
+    threading.Thread(target=self._forward_output, args=(self._process.stdout,), daemon=True).start()
+
+  @staticmethod
+  def _forward_output(stdout):
+    for line in iter(stdout.readline, ''):
+      print(line, end='', flush=True)
+
+  def is_alive(self):
+    return self._process is not None and self._process.poll() is None
+
+  #Executa um comando "python script.py args..." no worker e devolve o exit code.
+  #Se o worker morrer durante o job, devolve o exit code do processo; o próximo
+  #job inicia um worker novo.  Se o job passar de timeout segundos, o worker é
+  #encerrado e CommandTimeout é lançada.
+  def run(self, command, timeout=None, cwd=None):
+    argv = shlex.split(command)
+
+    if not argv or os.path.basename(argv[0]) not in ('python', 'python3'):
+      raise ValueError(f"ModelWorker can only run python scripts: {command}")
+
+    if not self.is_alive():
+      self.close()
+      self.start()
+
+    try:
+      self._process.stdin.write(json.dumps({'argv': argv[1:], 'cwd': os.path.abspath(cwd or os.getcwd())}) + "\n")
+      self._process.stdin.flush()
+      ready, _, _ = select.select([self._results], [], [], timeout)
+
+      if not ready:
+        self._process.kill()
+        self.close()
+        raise CommandTimeout(command, timeout)
+
+      line = self._results.readline()
+    except (BrokenPipeError, OSError):
+      line = ''
+
+    if line:
+      return json.loads(line)['returncode']
+
+    returncode = self._process.wait()
+    print(f"Model worker died with exit code {returncode}.")
+    self.close()
+    return returncode if returncode else 1
+
+  def close(self):
+    if self._process is None:
+      return
+
+    try:
+      self._process.stdin.close()
+    except (BrokenPipeError, OSError):
+      pass
+
+    try:
+      self._process.wait(timeout=60)
+    except subprocess.TimeoutExpired:
+      self._process.terminate()
+      self._process.wait()
+
+    self._results.close()
+    self._process = None
+    self._results = None
+
+
+if __name__ == '__main__':
+  results = os.fdopen(int(sys.argv[1]), 'w')
+  serve(sys.stdin, results)
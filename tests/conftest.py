@@ -0,0 +1,61 @@
+import os
+import sys
+import textwrap
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import write_dataset
+
+#Script de treino/teste falso no lugar de PEFT4CC/just-in-time/run_lora.py:
+#conta os treinos em <output_dir>/train_calls.txt e nunca altera o modelo; os
+#testes vão para <output_dir>/test_calls.txt e predizem tudo como limpo.
+FAKE_RUN_LORA = textwrap.dedent("""
+  import json, os, pickle, sys
+  a = sys.argv
+  out = a[a.index('--output_dir') + 1]
+
+  if '--do_test' in a:
+    with open(a[a.index('--test_data_file') + 1], 'rb') as f:
+      labels = pickle.load(f)[1]
+
+    with open(os.path.join(out, 'test_calls.txt'), 'a') as f:
+      f.write(' '.join(a[1:]) + '\\n')
+
+    with open('predictions.pkl', 'wb') as f:
+      pickle.dump({'pred_label': [0] * len(labels), 'true_label': list(labels), 'pred_prob': [[0.0]] * len(labels)}, f)
+
+    sys.exit(0)
+
+  with open(os.path.join(out, 'train_calls.txt'), 'a') as f:
+    f.write(' '.join(a[1:]) + '\\n')
+
+  with open(os.path.join(out, 'training_status.json'), 'w') as f:
+    json.dump({'status': 'unchanged', 'changed': False}, f)
+""")
+
+
+@pytest.fixture(scope='session')
+def dataset(tmp_path_factory):
+  return write_dataset(str(tmp_path_factory.mktemp('data')), 2000)
+
+
+#~1 ano de commits: o bastante para o waiting time promover exemplos negativos
+@pytest.fixture(scope='session')
+def long_dataset(tmp_path_factory):
+  return write_dataset(str(tmp_path_factory.mktemp('data')), 20000)
+
+
+@pytest.fixture
+def df_project(dataset):
+  df = pd.concat([pd.read_pickle(file) for file in dataset['features']], ignore_index=True)
+  return df[df['project'] == 'project-0'].reset_index(drop=True)
+
+
+@pytest.fixture
+def batch_classifier_dir(tmp_path):
+  script_dir = tmp_path / 'bc' / 'PEFT4CC' / 'just-in-time'
+  script_dir.mkdir(parents=True)
+  (script_dir / 'run_lora.py').write_text(FAKE_RUN_LORA)
+  return str(tmp_path / 'bc')
@@ -0,0 +1,117 @@
+import pickle
+import numpy as np
+from codeflowlm.classifier import OnlineLogisticRegression
+from codeflowlm.data import get_df_features_full
+from codeflowlm.journal import StepJournal
+from codeflowlm.latency_verification import BuggyPool, CommitStore, TrainingPool, TrainingQueue, process_window
+from codeflowlm.train import CrossProjectIndex, adjust_df_features_full, merge_cross_project_data, train_project
+
+
+#Backend que conta os treinos, com um seed que só depende dos dados (para que uma
+#execução retomada seja comparável à ininterrupta) e que pode falhar num teste
+class CountingClassifier(OnlineLogisticRegression):
+  def __init__(self, fail_at_test=None):
+    super().__init__()
+    self.fail_at_test = fail_at_test
+    self.train_calls = 0
+    self.test_calls = 0
+
+  def train(self, df_train, model_path, th=0.5, eval_metric='f1'):
+    self.train_calls += 1
+    self.rng = np.random.default_rng(df_train.shape[0])
+    return super().train(df_train, model_path, th=th, eval_metric=eval_metric)
+
+  def test(self, features_test, model_path, th=0.5, eval_metric='f1', calculate_metrics=True):
+    self.test_calls += 1
+
+    if self.test_calls == self.fail_at_test:
+      raise RuntimeError("test failed")
+
+    return super().test(features_test, model_path, th=th, eval_metric=eval_metric, calculate_metrics=calculate_metrics)
+
+
+def run(tmp_path, dataset, name, classifier):
+  return train_project('bc', str(tmp_path / 'work'), str(tmp_path / 'models') + '/', 
+                       dataset['commit_guru_path'].rstrip('/') + '/', *dataset['features'], *dataset['changes'], 
+                       'project-0', model_path=str(tmp_path / name), end=2500, classifier=classifier)
+
+
+def test_resume_after_failed_test_does_not_retrain(tmp_path, long_dataset):
+  uninterrupted = CountingClassifier()
+  _, expected, _, finished = run(tmp_path, long_dataset, 'uninterrupted', uninterrupted)
+  assert finished
+
+  #O teste falha depois de um treino que alterou o modelo
+  interrupted = CountingClassifier(fail_at_test=3)
+  _, _, _, finished = run(tmp_path, long_dataset, 'resumed', interrupted)
+  assert not finished
+  assert interrupted.train_calls == 3
+
+  resumed = CountingClassifier()
+  _, predictions, _, finished = run(tmp_path, long_dataset, 'resumed', resumed)
+  assert finished
+  assert interrupted.train_calls + resumed.train_calls == uninterrupted.train_calls
+
+  for key in ('true_labels', 'pred_labels', 'pred_probs'):
+    np.testing.assert_array_equal(predictions[key], expected[key])
+
+
+#Com train_from_scratch e cross_project, o loop reconstrói as filas a cada passo a
+#partir de todo o prefixo; o registro de cada passo deve conter só a diferença
+#para o passo anterior, e a retomada deve reproduzir o estado exato
+def test_rebuilt_pools_record_only_changes(tmp_path, long_dataset):
+  cg = long_dataset['commit_guru_path'].rstrip('/') + '/'
+  df_features_full = adjust_df_features_full(cg, True, get_df_features_full(*long_dataset['features']))
+  df_project = df_features_full[df_features_full['project'] == 'project-0'].reset_index(drop=True)[:2000]
+  index = CrossProjectIndex(df_features_full, 'project-0')
+  predictions = {'true_label': [0], 'pred_label': [0], 'pred_prob': [[0.1]]}
+  journal = StepJournal(str(tmp_path), snapshot_every=100)
+  state = new_state()
+  max_timestamp_for_cp = 0
+
+  for current in range(0, 2000, 100):
+    state[0].clear()
+    state[1].clear()
+    state[2].clear()
+    df_train, max_timestamp_for_cp = merge_cross_project_data(
+      df_features_full, df_project[0:current].copy(), 'project-0', max_timestamp_for_cp,
+      df_project['author_date_unix_timestamp'].iloc[current], cross_project_index=index)
+    process_window(df_train, state[0], state[1], state[3], state[2], do_real_lat_ver=True)
+    journal.append_step(current, current + 100, predictions, None, *state, max_timestamp_for_cp=max_timestamp_for_cp)
+
+    restored = new_state()
+    StepJournal(str(tmp_path)).restore(*restored)
+    assert describe(restored) == describe(state)
+
+  changes = journal.read_records()[-1]['state']
+  assert not changes['training_pool']['cleared']
+  assert len(changes['map_commit_to_row']['ids']) < len(state[3]) // 2
+
+
+def new_state():
+  store = CommitStore()
+  return TrainingPool(store), TrainingQueue(), BuggyPool(), store
+
+
+def describe(state):
+  pool, queue, buggy_pool, store = state
+  return (list(pool._labels.items()), dict(queue._entries), queue._counter, dict(buggy_pool._entries),
+          buggy_pool._counter, store.hashes[:store.size], store.labels[:store.size].tolist())
+
+
+#Execução interrompida antes do journal: o training_status.pickle gravado pelo
+#loop antigo é migrado e a execução continua dali, sem refazer as janelas
+def test_resume_from_legacy_training_status(tmp_path, long_dataset):
+  model_path = tmp_path / 'legacy'
+  model_path.mkdir()
+  list_of_predictions = [{'pred_label': [1] * 50, 'true_label': [0] * 50, 'pred_prob': [[0.9]] * 50} for _ in range(40)]
+
+  with open(model_path / 'training_status.pickle', 'wb') as f:
+    pickle.dump({'current': 2000, 'list_of_predictions': list_of_predictions, 'max_timestamp_for_cp': 0}, f)
+
+  classifier = CountingClassifier()
+  _, predictions, _, finished = run(tmp_path, long_dataset, 'legacy', classifier)
+  assert finished
+  assert classifier.test_calls <= 10
+  assert len(predictions['pred_labels']) == 2500
+  assert (predictions['pred_labels'][:2000] == 1).all()
@@ -0,0 +1,141 @@
+import numpy as np
+import pandas as pd
+import pytest
+from benchmarks.synthetic import generate_features
+from codeflowlm.date_util import get_difference
+from codeflowlm.latency_verification import BuggyPool, LabelTimeline, TrainingPool, TrainingQueue, process_window, waiting_time
+
+DAY = 24 * 60 * 60
+
+
+def make_window(rows, start=1_200_000_000):
+  commit_hashes, days, labels = zip(*rows)
+  timestamps = start + np.asarray(days) * DAY
+  return pd.DataFrame({'commit_hash': list(commit_hashes), 'project': 'project-0',
+                       'author_date': pd.to_datetime(timestamps, unit='s').strftime('%Y-%m-%d %H:%M:%S'),
+                       'author_date_unix_timestamp': timestamps, 'is_buggy_commit': np.asarray(labels, dtype=float)})
+
+
+def pool_rows(training_pool):
+  df = training_pool.to_dataframe()
+  return list(zip(df['commit_hash'], df['is_buggy_commit']))
+
+
+def test_duplicate_commits_in_a_window_enter_the_pool_once():
+  training_pool = TrainingPool()
+  training_queue = TrainingQueue()
+  df_window = make_window([('a', 0, 1), ('a', 0, 1), ('b', 1, 0), ('b', 2, 0), ('c', 200, 0)])
+  process_window(df_window, training_pool, training_queue, training_pool.store, BuggyPool())
+
+  assert pool_rows(training_pool) == [('a', 1.0), ('b', 0.0)]
+  assert len(training_queue) == 1
+
+
+def test_commits_repeated_in_a_later_window_are_not_added_again():
+  training_pool = TrainingPool()
+  training_queue = TrainingQueue()
+  df_window = make_window([('a', 0, 1), ('b', 1, 0), ('c', 200, 0)])
+
+  for _ in range(2):
+    process_window(df_window, training_pool, training_queue, training_pool.store, BuggyPool())
+
+  assert pool_rows(training_pool) == [('a', 1.0), ('b', 0.0)]
+  assert len(training_queue) == 1
+
+
+#Cópia congelada da semântica de prepare_train_data no modo train_from_scratch,
+#antes da LabelTimeline: a cada passo o training queue e o buggy pool começam
+#vazios e o prefixo inteiro é reprocessado linha a linha, com listas.  O pool é
+#um dict hash -> [linha, label] (um commit entra uma vez; um label 0 passa a 1),
+#os exemplos corrigidos são promovidos na ordem de first_fix_date e nenhum
+#exemplo é pulado durante a iteração.
+def reference_add(pool, row, label):
+  entry = pool.get(row['commit_hash'])
+
+  if entry is None:
+    pool[row['commit_hash']] = [row, label]
+  elif entry[1] == 0 and label == 1:
+    entry[1] = label
+
+
+def reference_prepare_train_data(df_train, pool, do_real_lat_ver):
+  rows = {}
+  labels = {}
+  training_queue = []
+  buggy_pool = []
+
+  for _, row in df_train.iterrows():
+    commit_hash = row['commit_hash']
+    timestamp = row['author_date_unix_timestamp']
+    rows[commit_hash] = row
+    labels[commit_hash] = float(row['is_buggy_commit'])
+
+    if labels[commit_hash] == 1:
+      if do_real_lat_ver:
+        labels[commit_hash] = 0.0
+        training_queue.append((commit_hash, timestamp))
+        buggy_pool.append((commit_hash, row['first_fix_date']))
+      else:
+        reference_add(pool, row, 1.0)
+    else:
+      training_queue.append((commit_hash, timestamp))
+
+    if do_real_lat_ver:
+      fixed = sorted([example for example in buggy_pool if example[1] != 0 and example[1] < timestamp],
+                     key=lambda example: example[1])
+
+      for example in fixed:
+        labels[example[0]] = 1.0
+        reference_add(pool, rows[example[0]], 1.0)
+        training_queue = [queued for queued in training_queue if queued[0] != example[0]]
+        buggy_pool.remove(example)
+
+    while training_queue and get_difference(training_queue[0][1], timestamp) >= waiting_time:
+      expired_hash, _ = training_queue.pop(0)
+      reference_add(pool, rows[expired_hash], labels[expired_hash])
+
+
+def reference_dataframe(pool):
+  df = pd.DataFrame([row for row, _ in pool.values()]).infer_objects()
+  df['is_buggy_commit'] = [label for _, label in pool.values()]
+  return df
+
+
+#Projeto sintético com ~1 commit por dia e correções até ~200 dias depois, para
+#que o waiting time e as correções promovam exemplos ao longo do stream
+def make_project(n_commits=600, seed=0):
+  rng = np.random.default_rng(seed)
+  df = generate_features(n_commits, n_projects=1, seed=seed)
+  timestamps = 1_200_000_000 + np.cumsum(rng.integers(0, 2 * DAY, n_commits))
+  df['author_date_unix_timestamp'] = timestamps
+  df['author_date'] = pd.to_datetime(timestamps, unit='s').strftime('%Y-%m-%d %H:%M:%S')
+  fix_positions = np.minimum(np.arange(n_commits) + rng.integers(1, 200, n_commits), n_commits - 1)
+  has_fix = (df['is_buggy_commit'] == 1) & (rng.random(n_commits) < 0.9)
+  df['first_fix_date'] = np.where(has_fix, timestamps[fix_positions], 0)
+  return df
+
+
+@pytest.mark.parametrize('do_real_lat_ver', [False, True])
+def test_label_timeline_matches_prefix_replay(do_real_lat_ver):
+  df_project = make_project()
+  training_pool = TrainingPool()
+  timeline = LabelTimeline(df_project, do_real_lat_ver=do_real_lat_ver, store=training_pool.store)
+  reference_pool = {}
+  step = 50
+
+  for i, current in enumerate(range(0, df_project.shape[0], step)):
+    reference_prepare_train_data(df_project[:current], reference_pool, do_real_lat_ver)
+    timeline.apply(training_pool, current)
+
+    if reference_pool:
+      pd.testing.assert_frame_equal(training_pool.to_dataframe(), reference_dataframe(reference_pool), 
+                                    check_dtype=False, obj=f"training pool at current={current}")
+    else:
+      assert len(training_pool) == 0
+
+    #Simula a limpeza do pool após um treino que alterou o modelo
+    if (i + 1) % 3 == 0:
+      training_pool.clear()
+      reference_pool.clear()
+
+  assert len(timeline) > 0
@@ -0,0 +1,28 @@
+import pickle
+from codeflowlm.columnar import is_columnar_changes
+from codeflowlm.data import ChangeStore, gather_changes
+from codeflowlm.manifest import TrainingArtifacts
+
+
+#Os manifestos referenciam o corpus de mudanças colunar (lido por mmap), não os
+#pickles, e reconstroem as mesmas mudanças
+def test_manifest_references_columnar_changes(tmp_path, dataset, df_project):
+  artifacts = TrainingArtifacts(str(tmp_path), 'project-0', dataset['changes'], df_project)
+  assert all(is_columnar_changes(file) for file in artifacts.manifest_changes_files)
+
+  df = df_project[100:300].copy()
+  df['is_buggy_commit'] = 1 - df['is_buggy_commit']
+  changes_file, features_file = artifacts.write(str(tmp_path / 'changes.pkl'), str(tmp_path / 'features.pkl'), df)
+
+  with open(changes_file, 'rb') as f:
+    changes = pickle.load(f)
+
+  with open(features_file, 'rb') as f:
+    features = pickle.load(f)
+
+  assert changes == gather_changes(ChangeStore.open(*dataset['changes']), df)
+  assert features.equals(df)
+
+  #A conversão é reaproveitada enquanto os pickles não mudam
+  assert TrainingArtifacts(str(tmp_path), 'project-0', dataset['changes'], df_project).manifest_changes_files == \
+    artifacts.manifest_changes_files
@@ -0,0 +1,68 @@
+import os
+import pytest
+from codeflowlm.replay import CheckpointManifest, get_stream_reference, read_checkpoint_manifest, rescore_run
+
+
+def write_checkpoint(model_path, model, config='{}'):
+  checkpoint_dir = os.path.join(model_path, 'checkpoint-best-f1')
+  os.makedirs(checkpoint_dir, exist_ok=True)
+
+  for name, content in (('model.bin', model), ('config.json', config)):
+    with open(os.path.join(checkpoint_dir, name), 'w') as f:
+      f.write(content)
+
+
+#Um checkpoint novo só copia os arquivos que mudaram; os outros são hard links
+#para a cópia guardada antes (nunca para o checkpoint em model_path)
+def test_unchanged_checkpoint_files_are_linked(tmp_path):
+  model_path = str(tmp_path / 'model')
+  manifest = CheckpointManifest(model_path)
+  write_checkpoint(model_path, 'a')
+  first = manifest.append_step(0, 10, 0.5)['checkpoint']
+  write_checkpoint(model_path, 'b')
+  second = CheckpointManifest(model_path).append_step(10, 20, 0.5)['checkpoint']
+
+  stored = [os.path.join(manifest.get_checkpoint_dir(digest), 'checkpoint-best-f1') for digest in (first, second)]
+  assert os.path.samefile(os.path.join(stored[0], 'config.json'), os.path.join(stored[1], 'config.json'))
+  assert not os.path.samefile(os.path.join(stored[1], 'config.json'), os.path.join(model_path, 'checkpoint-best-f1', 'config.json'))
+
+  with open(os.path.join(stored[1], 'model.bin')) as f:
+    assert f.read() == 'b'
+
+
+def test_adjust_th_steps_are_not_rescored(tmp_path, df_project):
+  model_path = str(tmp_path / 'model')
+  write_checkpoint(model_path, 'a')
+  CheckpointManifest(model_path).append_step(0, 10, 0.5, adjust_th=True, stream=get_stream_reference(0, 0))
+  assert read_checkpoint_manifest(model_path)[0]['adjust_th']
+
+  #O threshold ajustado pelo script não é registrado: a reavaliação recusa o passo
+  with pytest.raises(ValueError, match='adjust_th'):
+    rescore_run('bc', str(tmp_path / 'work'), None, None, None, 'project-0', df_project, model_path)
+
+
+#Janelas com o mesmo checkpoint e streams crescentes vão para uma única chamada
+#de teste, com o stream do último passo; o manifesto guarda só a referência
+def test_windows_sharing_a_checkpoint_are_scored_in_one_call(tmp_path, dataset, df_project, batch_classifier_dir):
+  model_path = str(tmp_path / 'model')
+  write_checkpoint(model_path, 'a')
+  manifest = CheckpointManifest(model_path)
+
+  for current in (100, 150, 200):
+    manifest.append_step(current, current + 50, 0.5, stream=get_stream_reference(0, current))
+
+  assert os.listdir(manifest.checkpoints_dir) == [read_checkpoint_manifest(model_path)[0]['checkpoint']]
+  list_of_predictions = rescore_run(batch_classifier_dir, str(tmp_path / 'work'), *dataset['changes'], 'project-0',
+                                    df_project, model_path)
+
+  checkpoint_dir = manifest.get_checkpoint_dir(read_checkpoint_manifest(model_path)[0]['checkpoint'])
+
+  with open(os.path.join(checkpoint_dir, 'test_calls.txt')) as f:
+    test_calls = f.readlines()
+
+  assert len(test_calls) == 1
+  assert '--stream_data_file' in test_calls[0]
+  assert [len(predictions['true_label']) for predictions in list_of_predictions] == [50, 50, 50]
+
+  for current, predictions in zip((100, 150, 200), list_of_predictions):
+    assert predictions['true_label'].tolist() == df_project['is_buggy_commit'][current:current + 50].tolist()
@@ -0,0 +1,29 @@
+import os
+import pickle
+import pandas as pd
+from codeflowlm.classifier import OnlineLogisticRegression
+from codeflowlm.runner import run_projects
+
+
+#Um projeto interrompido pelo código anterior ao journal (training_status.pickle
+#em model_path) é retomado pelo runner de onde parou
+def test_runner_resumes_project_from_training_status(tmp_path, long_dataset):
+  model_root = str(tmp_path / 'models') + '/'
+  model_path = model_root + 'codet5p-770m/concat/online/baseline/project-0_best_gmean/checkpoints'
+  os.makedirs(model_path)
+  list_of_predictions = [{'pred_label': [1] * 50, 'true_label': [0] * 50, 'pred_prob': [[0.9]] * 50} for _ in range(40)]
+
+  with open(os.path.join(model_path, 'training_status.pickle'), 'wb') as f:
+    pickle.dump({'current': 2000, 'list_of_predictions': list_of_predictions, 'max_timestamp_for_cp': 0}, f)
+
+  df_results = run_projects('bc', str(tmp_path / 'work'), model_root, long_dataset['commit_guru_path'].rstrip('/') + '/',
+                            *long_dataset['features'], *long_dataset['changes'], projects=['project-0'], max_workers=1,
+                            end=2500, classifier=OnlineLogisticRegression())
+  assert df_results['finished'].tolist() == [True]
+  assert pd.isna(df_results['error'].iloc[0])
+
+  with open(os.path.join(model_path, 'project-0_predictions_wp.pkl'), 'rb') as f:
+    predictions = pickle.load(f)
+
+  assert len(predictions['pred_labels']) == 2500
+  assert (predictions['pred_labels'][:2000] == 1).all()
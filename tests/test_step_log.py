@@ -0,0 +1,47 @@
+import os
+import pandas as pd
+import pytest
+import codeflowlm.train as train_module
+from codeflowlm.classifier import OnlineLogisticRegression
+from codeflowlm.data import get_df_features_full
+from codeflowlm.latency_verification import add_first_fix_date
+from codeflowlm.step_log import get_step_log_file, read_steps, rebuild_step
+from codeflowlm.train import adjust_df_features_full, train_project
+
+
+def test_rebuild_cross_project_steps(tmp_path, dataset, monkeypatch):
+  #Guarda a janela de treino (já com os commits dos outros projetos) de cada passo
+  windows = []
+  prepare_train_data = train_module.prepare_train_data
+
+  def recording_prepare_train_data(df_train, *args, **kwargs):
+    windows.append(df_train.copy())
+    return prepare_train_data(df_train, *args, **kwargs)
+
+  monkeypatch.setattr(train_module, 'prepare_train_data', recording_prepare_train_data)
+  commit_guru_path = dataset['commit_guru_path'].rstrip('/') + '/'
+  model_path = str(tmp_path / 'model')
+  _, _, _, finished = train_project('bc', str(tmp_path / 'work'), str(tmp_path / 'models') + '/', commit_guru_path, 
+                                    *dataset['features'], *dataset['changes'], 'project-1', model_path=model_path, 
+                                    end=300, cross_project=True, dump_steps=True, 
+                                    classifier=OnlineLogisticRegression())
+  assert finished
+
+  #df_project e df_features_full como em train_project
+  df_features_full = get_df_features_full(*dataset['features'])
+  df_project = add_first_fix_date(commit_guru_path, df_features_full[df_features_full['project'] == 'project-1'], 
+                                  'project-1')[:300]
+  df_features_full = adjust_df_features_full(commit_guru_path, True, df_features_full)
+  log_file = get_step_log_file(model_path, 'project-1')
+  steps = read_steps(log_file)
+  assert sorted(steps) == list(range(0, 300, 50))
+  assert len(windows) == len(steps)
+  assert any(record['cross_project_commits'] > 0 for record in steps.values())
+
+  for current, df_window in zip(sorted(steps), windows):
+    df_train, df_test = rebuild_step(log_file, df_project, current, df_features_full=df_features_full)
+    pd.testing.assert_frame_equal(df_train.reset_index(drop=True), df_window.reset_index(drop=True))
+    assert df_test.shape[0] == min(current + 50, 300) - current
+
+  with pytest.raises(ValueError):
+    rebuild_step(log_file, df_project, 50)
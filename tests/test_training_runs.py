@@ -0,0 +1,88 @@
+import os
+import pickle
+import codeflowlm.train as train_module
+from codeflowlm.data import get_df_features_full
+from codeflowlm.latency_verification import CommitStore, TrainingPool, TrainingQueue, add_first_fix_date
+from codeflowlm.train import train
+from codeflowlm.training_runs import TrainingRuns
+
+
+def count_train_calls(model_path):
+  train_calls_file = os.path.join(model_path, 'train_calls.txt')
+
+  if not os.path.exists(train_calls_file):
+    return 0
+
+  with open(train_calls_file) as f:
+    return len(f.readlines())
+
+
+def write_stream(tmp_path, name, df_stream):
+  changes_file, features_file = str(tmp_path / f'changes_{name}.pkl'), str(tmp_path / f'features_{name}.pkl')
+
+  with open(changes_file, 'wb') as f:
+    pickle.dump(df_stream['commit_hash'].tolist(), f)
+
+  with open(features_file, 'wb') as f:
+    pickle.dump(df_stream, f)
+
+  return changes_file, features_file
+
+
+#Os scripts treinam também com o stream completo: com stream, o treino não é pulado
+def test_training_with_stream_is_not_skipped(tmp_path, dataset, df_project, batch_classifier_dir):
+  model_path = str(tmp_path / 'model')
+  os.makedirs(os.path.join(model_path, 'checkpoint-best-f1'))
+
+  with open(os.path.join(model_path, 'checkpoint-best-f1', 'model.bin'), 'wb') as f:
+    f.write(b'model')
+
+  store = CommitStore()
+  training_pool = TrainingPool(store)
+
+  for record_id in store.register(df_project.head(100)):
+    training_pool.add(record_id)
+
+  training_runs = TrainingRuns(model_path)
+  stream = write_stream(tmp_path, 'a', df_project.head(150))
+
+  def run(stream_changes_file=None, stream_features_file=None):
+    train(batch_classifier_dir, str(tmp_path / 'work'), *dataset['changes'], 'project-0', model_path, training_pool,
+          stream_changes_file=stream_changes_file, stream_features_file=stream_features_file, training_runs=training_runs)
+    return count_train_calls(model_path)
+
+  assert run(*stream) == 1
+  assert run(*stream) == 2
+  assert run() == 3
+  #Sem stream, o mesmo pool não é treinado de novo
+  assert run() == 3
+  assert len(training_pool) == 100
+
+
+#No loop, um passo cujos commits não liberam nenhum exemplo (uma rajada de commits
+#na mesma data, com latency verification real) treina com o mesmo pool do passo
+#anterior, e o treino é pulado
+def test_loop_skips_training_on_unchanged_pool(tmp_path, long_dataset, batch_classifier_dir, monkeypatch, capsys):
+  monkeypatch.setattr(train_module, 'USE_FULL_STREAM_FOR_TRAINING', False)
+  cg = long_dataset['commit_guru_path'].rstrip('/') + '/'
+  df_features_full = get_df_features_full(*long_dataset['features'])
+  df_project = df_features_full[df_features_full['project'] == 'project-0']
+  df_project = add_first_fix_date(cg, df_project, 'project-0')[:2400].reset_index(drop=True)
+
+  for column in ('author_date', 'author_date_unix_timestamp'):
+    df_project.loc[2200:, column] = df_project.loc[2199, column]
+
+  def run(name, memoize_training):
+    store = CommitStore()
+    train_module.train_on_line_with_new_data(batch_classifier_dir, str(tmp_path / 'work'), *long_dataset['changes'],
+                                             'project-0', df_project, str(tmp_path / name), TrainingPool(store),
+                                             TrainingQueue(), store, do_real_lat_ver=True,
+                                             memoize_training=memoize_training)
+    return count_train_calls(str(tmp_path / name))
+
+  train_calls = run('baseline', False)
+  capsys.readouterr()
+  memoized_calls = run('memoized', True)
+  skips = capsys.readouterr().out.count('Skipping training')
+  assert skips > 0
+  assert memoized_calls + skips == train_calls